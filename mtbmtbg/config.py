@@ -57,6 +57,24 @@ class EngineType:
     TBSPARSE = 'tbsparse'
 
 
+class SolverType:
+    """eigen solver used on each k point
+    """
+    # direct diagonalization from scratch
+    DENSE = 'dense'
+    # block davidson seeded by the eigenvectors of the previous k point
+    DAVIDSON = 'davidson'
+
+
+class PrecisionType:
+    """floating point precision of the hamiltonian and the eigen solver
+    """
+    # complex128
+    DOUBLE = 'double'
+    # complex64
+    SINGLE = 'single'
+
+
 class ValleyType:
     """different type of valleys
     """
@@ -1,9 +1,8 @@
 import numpy as np
 
-import mtbmtbg.moire_setup as mset
 import mtbmtbg.moire_tb as mtb
 import mtbmtbg.moire_gk as mgk
-import mtbmtbg.moire_io as mio
+from mtbmtbg.moire_session import MoireSession
 from mtbmtbg.config import TBInfo, DataType, EngineType, ValleyType, Structure
 
 
@@ -58,7 +57,24 @@ def _analyze_moire_potential(u: np.ndarray, i: int = 0) -> tuple:
     return {'u1': u1, 'u2': u2, 'u3': u3, 'u4': u4}
 
 
-def analyze_moire_potential(n_moire: int, n_g: int, datatype=DataType.CORRU, valley=ValleyType.VALLEYK1) -> dict:
+def _set_session_setup(n_moire: int, n_g: int, datatype, valley, session=None) -> tuple:
+    """atoms, pairs and constant matrices from a session, a new one if None
+
+    Returns:
+        tuple: (structure, tb_const), see `MoireSession.structure` and `MoireSession.get_const`
+    """
+
+    session = MoireSession(n_moire, n_g, datatype, valley) if session is None else session
+    structure = session.get_structure(n_moire, datatype)
+
+    return (structure, session.get_const(n_g, valley))
+
+
+def analyze_moire_potential(n_moire: int,
+                            n_g: int,
+                            datatype=DataType.CORRU,
+                            valley=ValleyType.VALLEYK1,
+                            session=None) -> dict:
     """calculate the moire potential at high symmetry point
 
     Args:
@@ -66,26 +82,18 @@ def analyze_moire_potential(n_moire: int, n_g: int, datatype=DataType.CORRU, val
         n_g (int): an interger to control the glist size. 
         datatype (DataType, optional): input atom type. Defaults to DataType.CORRU.
         valley (ValleyType, optional): valley to be calculated. Defaults to ValleyType.VALLEYK1.
+        session (MoireSession, optional): reused setup of the structure. Defaults to None.
 
     Returns:
         dict: { 'glist': o_g_vec_list, 'mpot': moire_potential }
     """
 
-    # load atom data
-    atom_pstn_list = mio.read_atom_pstn_list(n_moire, datatype)
-    # construct moire info
-    (_, m_basis_vecs, high_symm_pnts) = mset._set_moire(n_moire)
-    (all_nns, enlarge_atom_pstn_list) = mset.set_atom_neighbour_list(atom_pstn_list, m_basis_vecs)
-    (npair_dict, ndist_dict) = mset.set_relative_dis_ndarray(atom_pstn_list, enlarge_atom_pstn_list, all_nns)
-    # set up original g list
-    o_g_vec_list = mgk.set_g_vec_list(n_g, m_basis_vecs)
-    # move to specific valley or combined valley
-    g_vec_list = mtb._set_g_vec_list_valley(n_moire, o_g_vec_list, m_basis_vecs, valley)
+    (structure, tb_const) = _set_session_setup(n_moire, n_g, datatype, valley, session)
+    (npair_dict, ndist_dict, high_symm_pnts) = (structure['npair'], structure['ndist'], structure['high_symm_pnts'])
+    (o_g_vec_list, g_vec_list, const_mtrx_dict) = (tb_const['o_glist'], tb_const['glist'], tb_const['const'])
     print("G[0,0]", g_vec_list[0])
-    # constant matrix dictionary
-    const_mtrx_dict = mtb._set_const_mtrx(n_moire, npair_dict, ndist_dict, m_basis_vecs, g_vec_list, atom_pstn_list)
     # number of atoms in the moire unit cell
-    n_atom = atom_pstn_list.shape[0]
+    n_atom = structure['atoms'].shape[0]
 
     print("="*100)
     moire_potential = {}
@@ -106,22 +114,13 @@ def analyze_moire_potential(n_moire: int, n_g: int, datatype=DataType.CORRU, val
     return {'glist': o_g_vec_list, 'mpot': moire_potential}
 
 
-def moire_potential_vs_k(n_moire: int, n_g: int, n_k: int, datatype=DataType.CORRU):
-    # load atom data
-    atom_pstn_list = mio.read_atom_pstn_list(n_moire, datatype)
-    # construct moire info
-    (_, m_basis_vecs, high_symm_pnts) = mset._set_moire(n_moire)
-    (all_nns, enlarge_atom_pstn_list) = mset.set_atom_neighbour_list(atom_pstn_list, m_basis_vecs)
-    (npair_dict, ndist_dict) = mset.set_relative_dis_ndarray(atom_pstn_list, enlarge_atom_pstn_list, all_nns)
-    # set up original g list
-    o_g_vec_list = mgk.set_g_vec_list(n_g, m_basis_vecs)
-    # move to specific valley or combined valley
-    g_vec_list = mtb._set_g_vec_list_valley(n_moire, o_g_vec_list, m_basis_vecs, ValleyType.VALLEYK1)
+def moire_potential_vs_k(n_moire: int, n_g: int, n_k: int, datatype=DataType.CORRU, session=None):
+    (structure, tb_const) = _set_session_setup(n_moire, n_g, datatype, ValleyType.VALLEYK1, session)
+    (npair_dict, ndist_dict, m_basis_vecs) = (structure['npair'], structure['ndist'], structure['m_basis_vecs'])
+    (o_g_vec_list, g_vec_list, const_mtrx_dict) = (tb_const['o_glist'], tb_const['glist'], tb_const['const'])
     print("G[0,0] should near K1", g_vec_list[0], Structure.ATOM_K_1)
-    # constant matrix dictionary
-    const_mtrx_dict = mtb._set_const_mtrx(n_moire, npair_dict, ndist_dict, m_basis_vecs, g_vec_list, atom_pstn_list)
     # number of atoms in the moire unit cell
-    n_atom = atom_pstn_list.shape[0]
+    n_atom = structure['atoms'].shape[0]
     kmesh = mgk.set_kmesh(n_k, m_basis_vecs)
 
     mg = np.linalg.norm(o_g_vec_list[1])
@@ -150,7 +149,11 @@ def moire_potential_vs_k(n_moire: int, n_g: int, n_k: int, datatype=DataType.COR
     return {'distance': np.array(dis_list), 'moire_aa': np.array(moire_aa), 'moire_ab': np.array(moire_ab)}
 
 
-def analyze_band_convergence(n_moire: int, n_g: int, datatype=DataType.CORRU, valley=ValleyType.VALLEYK1) -> dict:
+def analyze_band_convergence(n_moire: int,
+                             n_g: int,
+                             datatype=DataType.CORRU,
+                             valley=ValleyType.VALLEYK1,
+                             session=None) -> dict:
     """analyze band convergence by get the abs value of A1 bands.
     !ATTENTION!: ValleyType.VALLEYC is not supported HERE!
 
@@ -159,24 +162,16 @@ def analyze_band_convergence(n_moire: int, n_g: int, datatype=DataType.CORRU, va
         n_g (int): test the convergence of n_g
         datatype (DataType, optional): input atom data type. Defaults to DataType.CORRU.
         valley (ValleyType, optional): valley type. Defaults to ValleyType.VALLEYK1.
+        session (MoireSession, optional): reused setup of the structure. Defaults to None.
     
     Returns:
         dict:     return {'glist': o_g_vec_list, 'band': moire_band}
     """
-    # load atom data
-    atom_pstn_list = mio.read_atom_pstn_list(n_moire, datatype)
-    # construct moire info
-    (_, m_basis_vecs, high_symm_pnts) = mset._set_moire(n_moire)
-    (all_nns, enlarge_atom_pstn_list) = mset.set_atom_neighbour_list(atom_pstn_list, m_basis_vecs)
-    (npair_dict, ndist_dict) = mset.set_relative_dis_ndarray(atom_pstn_list, enlarge_atom_pstn_list, all_nns)
-    # set up original g list
-    o_g_vec_list = mgk.set_g_vec_list(n_g, m_basis_vecs)
-    # move to specific valley or combined valley
-    g_vec_list = mtb._set_g_vec_list_valley(n_moire, o_g_vec_list, m_basis_vecs, valley)
-    # constant matrix dictionary
-    const_mtrx_dict = mtb._set_const_mtrx(n_moire, npair_dict, ndist_dict, m_basis_vecs, g_vec_list, atom_pstn_list)
+    (structure, tb_const) = _set_session_setup(n_moire, n_g, datatype, valley, session)
+    (npair_dict, ndist_dict, high_symm_pnts) = (structure['npair'], structure['ndist'], structure['high_symm_pnts'])
+    (o_g_vec_list, const_mtrx_dict) = (tb_const['o_glist'], tb_const['const'])
     # number of atoms in the moire unit cell
-    n_atom = atom_pstn_list.shape[0]
+    n_atom = structure['atoms'].shape[0]
 
     print("="*100)
     moire_band = {}
@@ -0,0 +1,169 @@
+import os
+import inspect
+import numpy as np
+
+import mtbmtbg.config as config
+import mtbmtbg.moire_io as mio
+import mtbmtbg.moire_checkpoint as mckpt
+
+# directory of the cached results, environment variable MTBMTBG_CACHE
+CACHE_DIR = os.environ.get('MTBMTBG_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'mtbmtbg'))
+# the least recently used results are evicted beyond this size (bytes), environment variable MTBMTBG_CACHE_SIZE
+CACHE_SIZE = int(os.environ.get('MTBMTBG_CACHE_SIZE', 2*1024**3))
+# arguments which never change the results
+CACHE_IGNORE = ('n_proc', 'n_thread', 'session', 'checkpoint', 'restart', 'dmesh_file')
+# physical parameters the results depend on
+CACHE_CONFIG = (config.Structure, config.TBInfo, config.Cont, config.Phonon)
+
+
+def _set_config_inputs() -> dict:
+    """physical parameters of `config`, changing one of them invalidates the cache"""
+
+    inputs = {}
+    for cls in CACHE_CONFIG:
+        for (name, value) in vars(cls).items():
+            if not name.startswith('_'):
+                inputs[cls.__name__+'.'+name] = np.asarray(value).tolist()
+
+    return inputs
+
+
+def set_cache_key(func, *args, keep: tuple = None, **kwargs) -> str:
+    """hash of a solver call: its name and arguments with the defaults, the parameters of
+    `config` and the atom positions of (n_moire, datatype) if the solver reads them
+
+    Args:
+        func (callable): solver, e.g. `moire_tb.tb_solver`
+        args, kwargs: arguments of the solver
+        keep (tuple, optional): names of the results cached. Defaults to None, all.
+
+    Returns:
+        str: sha256 hex digest
+    """
+
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    inputs = {name: value for (name, value) in bound.arguments.items() if name not in CACHE_IGNORE}
+    inputs.update(_set_config_inputs())
+    inputs['func'] = func.__module__+'.'+func.__qualname__
+    inputs['keep'] = keep
+    arrays = []
+    if 'datatype' in inputs and 'n_moire' in inputs:
+        arrays.append(mio.read_atom_pstn_list(inputs['n_moire'], inputs['datatype']))
+
+    return mckpt.set_input_key(inputs, *arrays)
+
+
+def _set_cache_file(key: str, cache_dir: str = None) -> str:
+    """path of a cached result"""
+
+    return os.path.join(CACHE_DIR if cache_dir is None else cache_dir, key+'.npz')
+
+
+def cache_load(key: str, cache_dir: str = None) -> dict:
+    """load a cached result and mark it as recently used
+
+    Args:
+        key (str): returned by `set_cache_key`
+        cache_dir (str, optional): cache directory. Defaults to None, CACHE_DIR.
+
+    Returns:
+        dict: result, None if it is not cached
+    """
+
+    path = _set_cache_file(key, cache_dir)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        # scalars such as kline = 0 come back as 0-d arrays
+        ret = {name: data[name].item() if data[name].ndim == 0 else data[name] for name in data.files}
+    os.utime(path)
+
+    return ret
+
+
+def cache_evict(max_size: int = None, cache_dir: str = None):
+    """remove the least recently used results until the cache fits in `max_size` bytes
+
+    Args:
+        max_size (int, optional): size of the cache. Defaults to None, CACHE_SIZE.
+        cache_dir (str, optional): cache directory. Defaults to None, CACHE_DIR.
+    """
+
+    max_size = CACHE_SIZE if max_size is None else max_size
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npz'):
+            stat = os.stat(os.path.join(cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    size = sum(entry[1] for entry in entries)
+    for (_, entry_size, name) in sorted(entries):
+        if size <= max_size:
+            break
+        os.remove(os.path.join(cache_dir, name))
+        size -= entry_size
+
+
+def cache_save(key: str, ret: dict, cache_dir: str = None):
+    """save a result and evict the least recently used ones beyond CACHE_SIZE
+
+    Args:
+        key (str): returned by `set_cache_key`
+        ret (dict): name -> array or scalar
+        cache_dir (str, optional): cache directory. Defaults to None, CACHE_DIR.
+    """
+
+    path = _set_cache_file(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = path+'.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, **ret)
+    # concurrent readers never see a partial file
+    os.replace(tmp_file, path)
+    cache_evict(cache_dir=cache_dir)
+
+
+def cache_invalidate(key: str = None, cache_dir: str = None):
+    """remove a cached result, or all of them
+
+    Args:
+        key (str, optional): returned by `set_cache_key`. Defaults to None, the whole cache.
+        cache_dir (str, optional): cache directory. Defaults to None, CACHE_DIR.
+    """
+
+    if key is not None:
+        path = _set_cache_file(key, cache_dir)
+        if os.path.exists(path):
+            os.remove(path)
+    else:
+        cache_evict(0, cache_dir)
+
+
+def cached_call(func, *args, keep: tuple = None, cache_dir: str = None, **kwargs) -> dict:
+    """call a solver returning a dict, or load its result if the same call was cached
+
+    Args:
+        func (callable): solver, e.g. `moire_tb.tb_solver` or `moire_cont.cont_solver`
+        args, kwargs: arguments of the solver
+        keep (tuple, optional): names of the results cached and returned, e.g. ('emesh', 'kline')
+            for plots, which leaves out the eigenvectors. Defaults to None, all.
+        cache_dir (str, optional): cache directory. Defaults to None, CACHE_DIR.
+
+    Returns:
+        dict: result of the solver
+    """
+
+    key = set_cache_key(func, *args, keep=keep, **kwargs)
+    ret = cache_load(key, cache_dir)
+    if ret is None:
+        ret = func(*args, **kwargs)
+        if keep is not None:
+            ret = {name: ret[name] for name in keep}
+        cache_save(key, ret, cache_dir)
+    else:
+        print("load cached result".ljust(30), ":", key)
+
+    return ret
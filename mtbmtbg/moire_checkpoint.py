@@ -0,0 +1,133 @@
+import os
+import hashlib
+import pickle
+import numpy as np
+
+# k points solved by the serial k point loop between two checkpoints
+N_SAVE = 10
+# files in a checkpoint directory, the results are stored as <name>.npy
+KEY_FILE = 'key.txt'
+SETUP_FILE = 'setup.pkl'
+DONE_FILE = 'done.npy'
+
+
+def set_input_key(inputs: dict, *arrays) -> str:
+    """hash of the inputs of a run
+
+    Args:
+        inputs (dict): name -> parameter with a stable repr
+        arrays: input data, e.g. the atom positions
+
+    Returns:
+        str: sha256 hex digest
+    """
+
+    sha = hashlib.sha256(repr(sorted(inputs.items())).encode())
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        sha.update(str((arr.shape, arr.dtype.str)).encode())
+        sha.update(arr.tobytes())
+
+    return sha.hexdigest()
+
+
+def open_checkpoint(path: str, key: str, restart: bool = False) -> bool:
+    """create a checkpoint directory, or check the one to resume
+
+    Args:
+        path (str): checkpoint directory
+        key (str): hash of the inputs, see `set_input_key`
+        restart (bool, optional): resume the checkpoint in `path`. Defaults to False.
+
+    Raises:
+        Exception: the checkpoint to resume was written for other inputs.
+
+    Returns:
+        bool: whether the checkpoint is resumed
+    """
+
+    os.makedirs(path, exist_ok=True)
+    key_file = os.path.join(path, KEY_FILE)
+    if restart and os.path.exists(key_file):
+        with open(key_file) as f:
+            if f.read().strip() != key:
+                raise Exception("checkpoint "+path+" was written for other inputs.")
+        print("resume checkpoint".ljust(30), ":", path)
+        return True
+
+    # a new run, the k points and the setup of an old one are invalid
+    for name in (DONE_FILE, SETUP_FILE, KEY_FILE):
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    with open(key_file, 'w') as f:
+        f.write(key)
+
+    return False
+
+
+def save_setup(path: str, setup: dict):
+    """cache the setup of a run, e.g. the constant matrices
+
+    Args:
+        path (str): checkpoint directory
+        setup (dict): picklable setup
+    """
+
+    tmp_file = os.path.join(path, SETUP_FILE+'.tmp')
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(setup, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # a preempted write never leaves a truncated setup behind
+    os.replace(tmp_file, os.path.join(path, SETUP_FILE))
+
+
+def load_setup(path: str) -> dict:
+    """load the setup cached by `save_setup`
+
+    Args:
+        path (str): checkpoint directory
+
+    Returns:
+        dict: setup, None if it is not cached
+    """
+
+    setup_file = os.path.join(path, SETUP_FILE)
+    if not os.path.exists(setup_file):
+        return None
+    with open(setup_file, 'rb') as f:
+        return pickle.load(f)
+
+
+def set_todo(path: str, n_kpts: int, resumed: bool) -> np.ndarray:
+    """k points left to solve
+
+    Args:
+        path (str): checkpoint directory
+        n_kpts (int): number of k points
+        resumed (bool): whether the checkpoint is resumed
+
+    Returns:
+        np.ndarray: indices of the k points not done
+    """
+
+    done_file = os.path.join(path, DONE_FILE)
+    if resumed and os.path.exists(done_file):
+        done = np.load(done_file)
+        if done.shape == (n_kpts,):
+            return np.flatnonzero(done == 0)
+    np.save(done_file, np.zeros(n_kpts, dtype=np.uint8))
+
+    return np.arange(n_kpts)
+
+
+def set_out_file(path: str, names: list) -> dict:
+    """paths of the result files in a checkpoint
+
+    Args:
+        path (str): checkpoint directory
+        names (list): names of the results
+
+    Returns:
+        dict: name -> path of the .npy file
+    """
+
+    return {name: os.path.join(path, name+'.npy') for name in names}
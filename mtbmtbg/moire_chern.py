@@ -1,6 +1,9 @@
 import numpy as np
+from itertools import product
 import scipy.linalg as la
 
+import mtbmtbg.moire_setup as mset
+import mtbmtbg.moire_gk as mgk
 import mtbmtbg.moire_tb as mtb
 from mtbmtbg.config import DataType, ValleyType
 
@@ -41,64 +44,109 @@ def d(x, y, n_k):
     return (dx, dy)
 
 
-def braket_norm(phi1, phi2, x1, y1, x2, y2, n_k, trans, nmap):
+def shift_bands(phi, shift_map):
+    """move the plane wave coefficients of the bands to the G vectors shifted by a reciprocal vector
+
+    Args:
+        phi (np.ndarray): bands, 4 sublattice blocks of the Glist
+        shift_map (np.ndarray): index map of the shifted G vectors, see `moire_gk.set_g_shift`
+
+    Returns:
+        np.ndarray: shifted bands, zero for the G vectors shifted outside the Glist
+    """
+
+    num_g = shift_map.shape[0]
+    phi = np.reshape(phi, (4, num_g, -1))[:, shift_map]
+    phi[:, shift_map<0] = 0
+
+    return phi.reshape(4*num_g, -1)
+
+
+def braket_norm(phi1, phi2, x1, y1, x2, y2, n_k, shift_list, nmap):
 
     dx1, dy1 = d(x1, y1, n_k)
     dx2, dy2 = d(x2, y2, n_k)
-    amat1 = trans[nmap[0, dx1, dy1]]
-    amat2 = trans[nmap[0, dx2, dy2]]
-    braket = ((amat1.T)@phi1).transpose().conj().dot(amat2.T@phi2)
+    phi1 = shift_bands(phi1, shift_list[nmap[0, dx1, dy1]])
+    phi2 = shift_bands(phi2, shift_list[nmap[0, dx2, dy2]])
+    braket = phi1.transpose().conj().dot(phi2)
     res_det = la.det(braket)
 
     return res_det/la.norm(res_det)
 
 
-def ux(bands, x, y, n_k, init, last, transmat_list, neighbor_map):
+def ux(bands, x, y, n_k, init, last, shift_list, neighbor_map):
     phi1 = bands[index(x, y, n_k)][:, init:last+1]
     phi2 = bands[index(x+1, y, n_k)][:, init:last+1]
 
-    return braket_norm(phi1, phi2, x, y, x+1, y, n_k, transmat_list, neighbor_map)
+    return braket_norm(phi1, phi2, x, y, x+1, y, n_k, shift_list, neighbor_map)
 
 
-def uy(bands, x, y, n_k, init, last, transmat_list, neighbor_map):
+def uy(bands, x, y, n_k, init, last, shift_list, neighbor_map):
     phi1 = bands[index(x, y, n_k)][:, init:last+1]
     phi2 = bands[index(x, y+1, n_k)][:, init:last+1]
 
-    return braket_norm(phi1, phi2, x, y, x, y+1, n_k, transmat_list, neighbor_map)
+    return braket_norm(phi1, phi2, x, y, x, y+1, n_k, shift_list, neighbor_map)
 
 
-def small_loop(bands, m, n, n_k, init, last, transmat_list, neighbor_map):
+def small_loop(bands, m, n, n_k, init, last, shift_list, neighbor_map):
 
     return np.log(
-        ux(bands, m, n, n_k, init, last, transmat_list, neighbor_map)*
-        uy(bands, m+1, n, n_k, init, last, transmat_list, neighbor_map)/
-        ux(bands, m, n+1, n_k, init, last, transmat_list, neighbor_map)/
-        uy(bands, m, n, n_k, init, last, transmat_list, neighbor_map))
+        ux(bands, m, n, n_k, init, last, shift_list, neighbor_map)*
+        uy(bands, m+1, n, n_k, init, last, shift_list, neighbor_map)/
+        ux(bands, m, n+1, n_k, init, last, shift_list, neighbor_map)/
+        uy(bands, m, n, n_k, init, last, shift_list, neighbor_map))
 
 
-def cal_chern(bands, n_k, init, last, transmat_list, neighbor_map):
+def cal_chern(bands, n_k, init, last, shift_list, neighbor_map):
 
     ret = 0
 
     for m in range(n_k):
         for n in range(n_k):
-            ret += small_loop(bands, m, n, n_k, init, last, transmat_list, neighbor_map)
+            ret += small_loop(bands, m, n, n_k, init, last, shift_list, neighbor_map)
 
     return ret/(2*np.pi*1j)
 
 
-def cal_moire_chern(n_moire: int, n_g: int, n_k: int, n_chern: int, datatype=DataType.CORRU,
-                    valley=ValleyType.VALLEYK1):
+def cal_moire_chern(n_moire: int,
+                    n_g: int,
+                    n_k: int,
+                    n_chern: int,
+                    datatype=DataType.CORRU,
+                    valley=ValleyType.VALLEYK1,
+                    dmesh_file: str = None,
+                    session=None,
+                    irreducible: bool = False):
+    """chern numbers of the 2*n_chern bands around charge neutrality
+
+    Only the eigenvectors of these bands are kept by `tb_solver`, in memory or in the memory
+    mapped `dmesh_file` for large kmeshes. A `moire_session.MoireSession` reuses the setup, and
+    `irreducible` solves the C3z irreducible kmesh and unfolds its eigenvectors.
+    """
 
     cherns = []
-    ret = mtb.tb_solver(n_moire, n_g, n_k, disp=False, datatype=datatype, valley=valley)
+    (_, m_basis_vecs, _) = mset._set_moire(n_moire)
+    o_g_vec_list = mgk.set_g_vec_list(n_g, m_basis_vecs)
+    nband = 4*mtb._set_g_vec_list_valley(n_moire, o_g_vec_list, m_basis_vecs, valley).shape[0]
+    ret = mtb.tb_solver(n_moire,
+                        n_g,
+                        n_k,
+                        disp=False,
+                        datatype=datatype,
+                        valley=valley,
+                        band_range=(nband//2-n_chern, nband//2+n_chern),
+                        dmesh_file=dmesh_file,
+                        session=session,
+                        irreducible=irreducible)
     dmesh = ret['dmesh']
-    trans = ret['trans']
     nmap = ret['nbmap']
-    nband = dmesh.shape[2]
-    dmesh = dmesh[:, :, (nband//2-n_chern):(nband//2+n_chern)]
+    # a link shifts the G vectors by 0, or by mg1, mg2 or mg1+mg2 across the B.Z. boundary
+    shift_list = {
+        nmap[0, dx, dy]: mgk.set_g_shift(o_g_vec_list, m_basis_vecs, (dx, dy))
+        for (dx, dy) in product(range(2), range(2))
+    }
     for i in range(2*n_chern):
-        chern = cal_chern(dmesh, n_k, i, i, trans, nmap)
+        chern = cal_chern(dmesh, n_k, i, i, shift_list, nmap)
         assert np.imag(chern)<1e-9
         cherns.append(np.rint(np.real(chern)))
         print("band i:", i, "chern number:", np.rint(np.real(chern)))
@@ -1,9 +1,12 @@
 import numpy as np
+from threadpoolctl import threadpool_limits
 
 import mtbmtbg.moire_setup as mset
 import mtbmtbg.moire_gk as mgk
+import mtbmtbg.moire_eigen as meig
+import mtbmtbg.moire_parallel as mpar
 from mtbmtbg.moire_shuffle import cont_shuffle_to_tbplw
-from mtbmtbg.config import Cont, Structure
+from mtbmtbg.config import Cont, Structure, PrecisionType
 
 # reciprocal unit vector for atom system
 A_G_UNITVEC_1 = Structure.A_G_UNITVEC_1
@@ -21,16 +24,6 @@ def _set_kpt(rotmat):
     return {'kpt1': kpt1, 'kpt2': kpt2}
 
 
-def _check_eq(vec1, vec2):
-
-    assert vec1.shape == vec2.shape
-
-    if np.linalg.norm(vec1-vec2)<1E-9:
-        return True
-    else:
-        return False
-
-
 def _set_g_vec_list_valley(n_moire: int, g_vec_list: np.ndarray, m_basis_vecs: dict, valley: int) -> np.ndarray:
     """set Glist containg one specific valley or all valleys
 
@@ -82,34 +75,31 @@ def _make_t(glist, m_basis_vecs, valley):
     """
     calculate interlayer interaction hamiltonian element
     """
-    m_g_unitvec_1 = m_basis_vecs['mg1']
-    m_g_unitvec_2 = m_basis_vecs['mg2']
     glist_size = np.shape(glist)[0]
 
-    tmat = np.zeros((2*glist_size, 2*glist_size), complex)
+    tmat = np.zeros((glist_size, 2, glist_size, 2), complex)
     (g1, g2, g3, t1, t2, t3) = _make_transfer_const(m_basis_vecs, valley)
+    # the G vectors are looked up by their integer coordinates
+    g_coords = mgk.set_g_coords(glist, m_basis_vecs)
+    g_table = mgk.set_g_table(g_coords)
+    g_shifts = mgk.set_g_coords(np.array([g1, g2, g3]), m_basis_vecs)
 
-    for i in range(glist_size):
-        for j in range(glist_size):
-            delta_k = glist[i]-glist[j]
-            # matrix element in three cases:
-            if _check_eq(delta_k, g1):
-                tmat[2*i:2*i+2, 2*j:2*j+2] = t1
-            if _check_eq(delta_k, g2):
-                tmat[2*i:2*i+2, 2*j:2*j+2] = t2
-            if _check_eq(delta_k, g3):
-                tmat[2*i:2*i+2, 2*j:2*j+2] = t3
+    # matrix element in three cases: glist[i]-glist[j] = g1, g2 or g3
+    for (g_shift, t) in zip(g_shifts, (t1, t2, t3)):
+        j = mgk.find_g_coords(g_table, g_coords-g_shift)
+        i = np.flatnonzero(j >= 0)
+        tmat[i, :, j[i], :] = t
 
-    return tmat
+    return tmat.reshape(2*glist_size, 2*glist_size)
 
 
-def _make_h(glist, k, kpt, rotmat, valley):
+def _make_h(glist, k, kpt, rotmat, valley, dtype=complex):
     """
     calculate first layer hamiltonian, approximated by dirac hamiltonian
     """
 
     glist_size = np.shape(glist)[0]
-    h1mat = np.zeros((2*glist_size, 2*glist_size), complex)
+    h1mat = np.zeros((2*glist_size, 2*glist_size), dtype)
 
     for i in range(glist_size):
         q = k+glist[i]-valley*kpt
@@ -120,32 +110,65 @@ def _make_h(glist, k, kpt, rotmat, valley):
     return h1mat
 
 
-def _make_hamk(k, kpts, glist, rt_mtrx_half, tmat, valley):
+def _make_hamk(k, kpts, glist, rt_mtrx_half, tmat, valley, dtype=complex):
     """
-    generate total hamiltonian 
+    generate total hamiltonian in `dtype`, `tmat` is expected in the same precision
     """
     kpt1 = kpts['kpt1']
     kpt2 = kpts['kpt2']
 
-    h1mat = _make_h(glist, k, kpt1, rt_mtrx_half, valley)
-    h2mat = _make_h(glist, k, kpt2, rt_mtrx_half.T, valley)
+    h1mat = _make_h(glist, k, kpt1, rt_mtrx_half, valley, dtype)
+    h2mat = _make_h(glist, k, kpt2, rt_mtrx_half.T, valley, dtype)
     hamk = np.block([[h1mat, np.conj(np.transpose(tmat))], [tmat, h2mat]])
 
     return hamk
 
 
-def cont_solver(n_moire: int, n_g: int, n_k: int, disp: bool = True, valley: int = 1) -> dict:
+def _solve_kpnt(shared: dict, k_vec: np.ndarray, params: dict) -> dict:
+    """solve a single k point of the continuum model, also in a worker process of `moire_parallel.parallel_kmesh`
+
+    Args:
+        shared (dict): {kpt1, kpt2, glist, rt, tmat, tmat_solve}, tmat_solve in the precision of the solve
+        k_vec (np.ndarray): k point
+        params (dict): {valley, backend, precision, n_eig, n_refine}
+
+    Returns:
+        dict: {emesh, dmesh}, and {resid} for PrecisionType.SINGLE
     """
-    continuum model solver for TBG system
+
+    kpts = {'kpt1': shared['kpt1'], 'kpt2': shared['kpt2']}
+    tmat_solve = shared['tmat_solve']
+    hamk = _make_hamk(k_vec, kpts, shared['glist'], shared['rt'], tmat_solve, params['valley'], tmat_solve.dtype)
+    if params['backend'] is None:
+        eigen_val, eigen_vec = np.linalg.eigh(hamk)
+    else:
+        eigen_val, eigen_vec = meig.eigh(hamk, backend=params['backend'])
+    ret = {}
+    if params['precision'] == PrecisionType.SINGLE:
+        # rebuilt in double precision for the refinement, replacing the single precision one
+        hamk = _make_hamk(k_vec, kpts, shared['glist'], shared['rt'], shared['tmat'], params['valley'])
+        eigen_val, eigen_vec, ret['resid'] = meig.refine_eigh(lambda x: hamk@x, eigen_val, eigen_vec, params['n_eig'],
+                                                              None, params['n_refine'])
+    ret['emesh'] = eigen_val
+    ret['dmesh'] = eigen_vec
+
+    return ret
+
+
+def _set_cont_problem(n_moire: int,
+                      n_g: int,
+                      n_k: int,
+                      disp: bool = True,
+                      valley: int = 1,
+                      precision=PrecisionType.DOUBLE,
+                      kmesh: np.ndarray = None) -> tuple:
+    """set up the k points and the constant arrays shared by all k points, `kmesh` replaces the ones of `n_k`
+
+    Returns:
+        tuple: (kmesh, kline, shared arrays of `_solve_kpnt`)
     """
 
-    dmesh = []
-    emesh = []
     kline = 0
-    emax = -1000
-    emin = 1000
-    count = 1
-
     # construct moire info
     rt_angle_r, rt_angle_d = mset._set_moire_angle(n_moire)
     rt_mtrx_half = mset._set_rt_mtrx(rt_angle_r/2)
@@ -159,20 +182,110 @@ def cont_solver(n_moire: int, n_g: int, n_k: int, disp: bool = True, valley: int
     # atomic K points
     kpts = _set_kpt(rt_mtrx_half)
 
-    if disp:
+    if kmesh is not None:
+        kmesh = np.asarray(kmesh)
+    elif disp:
         (kline, kmesh) = mgk.set_tb_disp_kmesh(n_k, high_symm_pnts)
     else:
         kmesh = mgk.set_kmesh(n_k, m_basis_vecs)
 
-    for k in kmesh:
-        print("k sampling process, counter:", count)
-        count += 1
-        hamk = _make_hamk(k, kpts, g_vec_list, rt_mtrx_half, tmat, valley)
-        eigen_val, eigen_vec = np.linalg.eigh(hamk)
-        emesh.append(eigen_val)
-        dmesh.append(eigen_vec)
+    # the hamiltonian is assembled in the precision of the solve
+    dtype = np.complex64 if precision == PrecisionType.SINGLE else complex
+    shared = {
+        'kpt1': kpts['kpt1'],
+        'kpt2': kpts['kpt2'],
+        'glist': g_vec_list,
+        'rt': rt_mtrx_half,
+        'tmat': tmat,
+        'tmat_solve': tmat.astype(dtype)
+    }
+
+    return (kmesh, kline, shared)
+
+
+def _iter_kpnts(kmesh: np.ndarray, shared: dict, params: dict):
+    """solve the k points in order, one at a time
+
+    Yields:
+        tuple: (k index, k vector, result of `_solve_kpnt`)
+    """
+
+    for (i, k_vec) in enumerate(kmesh):
+        print("k sampling process, counter:", i+1)
+        yield (i, k_vec, _solve_kpnt(shared, k_vec, params))
+
+
+def iter_bands(n_moire: int,
+               n_g: int,
+               n_k: int,
+               disp: bool = True,
+               valley: int = 1,
+               backend: str = None,
+               precision=PrecisionType.DOUBLE,
+               n_eig: int = 10,
+               n_refine: int = 0,
+               vec: bool = True):
+    """
+    generator of the bands of `cont_solver`, one k point at a time, yields
+    (k index, k vector, eigenvalues, eigenvectors or None if not `vec`).
+    `moire_parallel.collect_bands` writes them into preallocated arrays.
+    """
+
+    (kmesh, _, shared) = _set_cont_problem(n_moire, n_g, n_k, disp, valley, precision)
+    params = {'valley': valley, 'backend': backend, 'precision': precision, 'n_eig': n_eig, 'n_refine': n_refine}
+    for (i, k_vec, ret_k) in _iter_kpnts(kmesh, shared, params):
+        yield (i, k_vec, ret_k['emesh'], ret_k['dmesh'] if vec else None)
+
+
+def cont_solver(n_moire: int,
+                n_g: int,
+                n_k: int,
+                disp: bool = True,
+                valley: int = 1,
+                backend: str = None,
+                precision=PrecisionType.DOUBLE,
+                n_eig: int = 10,
+                n_refine: int = 0,
+                n_proc: int = None,
+                n_thread: int = None,
+                shard: tuple = None,
+                kmesh: np.ndarray = None) -> dict:
+    """
+    continuum model solver for TBG system, `backend` is an eigen solver registered in
+    `moire_eigen` ('auto' for autotuning), None for numpy. With PrecisionType.SINGLE the
+    hamiltonian is diagonalized in complex64, the `n_eig` bands around charge neutrality are
+    refined by `n_refine` double precision steps and their residuals are returned as 'resid'.
+    The k points are solved by `n_proc` processes with `n_thread` BLAS threads each, both are
+    chosen by `moire_parallel.set_schedule` if None. With `shard` = (i, n) only the i-th of n
+    contiguous shards of the k points is solved, see `moire_shard`. `kmesh` replaces the k points of
+    `n_k` and `disp`, 'kline' is then 0.
+    """
 
-    return {'emesh': np.array(emesh), 'dmesh': np.array(dmesh), 'kline': kline}
+    (kmesh, kline, shared) = _set_cont_problem(n_moire, n_g, n_k, disp, valley, precision, kmesh)
+    if shard is not None:
+        kmesh = kmesh[mpar.set_shard(kmesh.shape[0], shard)]
+    params = {'valley': valley, 'backend': backend, 'precision': precision, 'n_eig': n_eig, 'n_refine': n_refine}
+    schedule = mpar.set_schedule(2*shared['tmat'].shape[0], kmesh.shape[0], mpar.N_PROC if n_proc is None else n_proc,
+                                 mpar.N_THREAD if n_thread is None else n_thread)
+    print("processes x BLAS threads:", schedule['n_proc'], "x", schedule['n_thread'], "on", schedule['n_core'], "cores")
+
+    with threadpool_limits(limits=schedule['n_thread']):
+        if schedule['n_proc']>1:
+            ret_k = mpar.parallel_kmesh(_solve_kpnt,
+                                        kmesh,
+                                        shared,
+                                        params,
+                                        schedule['n_proc'],
+                                        n_thread=schedule['n_thread'])
+        else:
+            # written into arrays allocated at the first k point
+            ret_k = mpar.collect_kmesh(((i, ret) for (i, _, ret) in _iter_kpnts(kmesh, shared, params)), kmesh.shape[0])
+
+    ret = {'emesh': ret_k['emesh'], 'dmesh': ret_k['dmesh'], 'kline': kline}
+    if precision == PrecisionType.SINGLE:
+        ret['resid'] = ret_k['resid']
+
+    return ret
 
 
 def cont_potential(n_moire: int, n_g: int, valley: int = 1):
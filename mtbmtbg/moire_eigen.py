@@ -0,0 +1,463 @@
+import os
+import json
+import time
+import hashlib
+import functools
+import platform
+import numpy as np
+import scipy.linalg as sla
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from threadpoolctl import threadpool_info
+
+# registered eigen solver backends: name -> {'func', 'sparse', 'generalized'}
+EIGEN_BACKENDS = {}
+# winners of the autotuning: problem key -> backend name
+_TUNE_TABLE = {}
+# on-disk cache of the autotuning results
+TUNE_CACHE_PATH = os.environ.get('MTBMTBG_TUNE_CACHE',
+                                 os.path.join(os.path.expanduser('~'), '.cache', 'mtbmtbg', 'eigen_tune.json'))
+
+
+def _set_shift_invert(hamk, smat, sigma: float):
+    """factorize (H-sigma*S) once and return its solver
+
+    Args:
+        hamk: hamiltonian, dense np.ndarray or scipy sparse matrix
+        smat: overlap matrix, None for a standard eigenvalue problem
+        sigma (float): shift
+
+    Returns:
+        callable: x -> (H-sigma*S)^-1 x
+    """
+
+    if sp.issparse(hamk):
+        smat = sp.identity(hamk.shape[0], format='csc') if smat is None else sp.csc_matrix(smat)
+        lu = spla.splu(sp.csc_matrix(hamk-sigma*smat))
+        return lu.solve
+    else:
+        smat = np.identity(hamk.shape[0]) if smat is None else smat
+        lu = sla.lu_factor(hamk-sigma*smat, check_finite=False)
+        return lambda x: sla.lu_solve(lu, x, check_finite=False)
+
+
+def _orth_against(vecs: np.ndarray, basis: np.ndarray, s_dot, drop_tol: float = 1e-10) -> np.ndarray:
+    """S-orthonormalize `vecs` against an S-orthonormal `basis` and among themselves
+
+    Args:
+        vecs (np.ndarray): new directions, shape (n, m)
+        basis (np.ndarray): S-orthonormal basis, shape (n, l)
+        s_dot (callable): x -> S x
+        drop_tol (float, optional): drop directions whose remaining norm is below. Defaults to 1e-10.
+
+    Returns:
+        np.ndarray: S-orthonormal new directions, shape (n, m') with m' <= m
+    """
+
+    vecs = vecs/np.linalg.norm(vecs, axis=0)
+    # classical Gram-Schmidt twice is enough to keep the basis orthonormal
+    for _ in range(2):
+        vecs = vecs-basis@(s_dot(basis).conj().T@vecs)
+    gram = vecs.conj().T@s_dot(vecs)
+    val, vec = np.linalg.eigh((gram+gram.conj().T)/2)
+    keep = val>drop_tol*np.max(val, initial=1.0)
+
+    return (vecs@vec[:, keep])/np.sqrt(val[keep])
+
+
+def _set_jacobi(hamk, smat, sigma: float):
+    """diagonal preconditioner x -> x/diag(H-sigma*S)
+
+    Args:
+        hamk: hamiltonian with a `diagonal` method
+        smat: overlap matrix, None for a standard eigenvalue problem
+        sigma (float): shift
+
+    Returns:
+        callable: x -> diag(H-sigma*S)^-1 x
+    """
+
+    diag = np.real(hamk.diagonal())-sigma*(1.0 if smat is None else np.real(smat.diagonal()))
+    diag = np.where(np.abs(diag)<1e-6, 1e-6, diag)
+
+    return lambda x: x/diag[:, np.newaxis]
+
+
+def davidson_eigh(hamk,
+                  x0: np.ndarray,
+                  sigma: float,
+                  smat=None,
+                  precond=None,
+                  n_eig: int = None,
+                  tol: float = 1e-6,
+                  max_iter: int = 30,
+                  max_dim: int = None) -> tuple:
+    """block Davidson solver for the eigenpairs of H x = e S x closest to `sigma`
+
+    The search space is seeded by `x0` (typically the eigenvectors of a neighbouring
+    k point) and expanded by the preconditioned residuals. Only products `hamk@X` are needed, so
+    `hamk` can be a `LinearOperator`. The wanted vectors are extracted by harmonic Ritz values
+    of (H-sigma*S), which, unlike the plain Ritz values, do not produce spurious interior
+    eigenvalues near `sigma`.
+
+    Args:
+        hamk: hamiltonian, dense np.ndarray, scipy sparse matrix or LinearOperator
+        x0 (np.ndarray): initial guess, shape (n, n_eig)
+        sigma (float): target energy, the n_eig eigenvalues closest to it are computed
+        smat (optional): overlap matrix for generalized problems. Defaults to None.
+        precond (callable, optional): approximation of x -> (H-sigma*S)^-1 x, e.g. the factorization
+            of a nearby k point. Defaults to None, the diagonal of `hamk`.
+        n_eig (int, optional): number of wanted eigenpairs, the other columns of `x0` are guard
+            vectors which speed up the convergence but are not converged. Defaults to None, all columns.
+        tol (float, optional): residual tolerance, the eigenvalue error is of order tol^2. Defaults to 1e-6.
+        max_iter (int, optional): maximal number of iterations. Defaults to 30.
+        max_dim (int, optional): restart size of the search space. Defaults to 6*n_eig.
+
+    Returns:
+        tuple: (v, w, converged, n_iter) eigenvalues of the whole block in ascending order, eigenvectors,
+        convergence flag of the wanted ones, number of iterations
+    """
+
+    n_dim, n_block = x0.shape
+    n_eig = n_block if n_eig is None else n_eig
+    max_dim = min(n_dim, 6*n_block if max_dim is None else max_dim)
+    n_keep = min(2*n_block, max_dim//2)
+    s_dot = (lambda x: x) if smat is None else (lambda x: smat@x)
+    precond = _set_jacobi(hamk, smat, sigma) if precond is None else precond
+
+    basis = _orth_against(np.asarray(x0, dtype=complex), np.zeros((n_dim, 0), complex), s_dot)
+    # (H-sigma*S) applied to the basis
+    a_basis = hamk@basis-sigma*s_dot(basis)
+    v = w = None
+
+    for n_iter in range(1, max_iter+1):
+        # harmonic Ritz pairs: W^H S V y = (1/nu) W^H W y with W = (H-sigma*S) V, largest |1/nu|
+        g_sub = a_basis.conj().T@a_basis
+        b_sub = a_basis.conj().T@s_dot(basis)
+        mu, y = sla.eig(b_sub, (g_sub+g_sub.conj().T)/2)
+        y = y[:, np.argsort(-np.abs(mu))]
+        # S-orthonormalize the wanted harmonic vectors, the basis is S-orthonormal
+        c_sub = y[:, :n_block]
+        val, vec = np.linalg.eigh(c_sub.conj().T@c_sub)
+        c_sub = (c_sub@vec)/np.sqrt(val)
+        # Rayleigh-Ritz of H in the wanted subspace, H W = (H-sigma*S) W+sigma*S W
+        w = basis@c_sub
+        s_w = s_dot(w)
+        h_w = a_basis@c_sub+sigma*s_w
+        h_sub = w.conj().T@h_w
+        v, z = np.linalg.eigh((h_sub+h_sub.conj().T)/2)
+        w = w@z
+        res = h_w@z-(s_w@z)*v
+        res_norm = np.linalg.norm(res, axis=0)
+        unconv = res_norm>tol*np.maximum(1.0, np.abs(v))
+        if not np.any(unconv[np.argsort(np.abs(v-sigma))[:n_eig]]):
+            return (v, w, True, n_iter)
+        corr = precond(res[:, unconv])
+        if basis.shape[1]+corr.shape[1]>max_dim:
+            # thick restart keeping the leading harmonic vectors
+            basis = _orth_against(basis@y[:, :n_keep], np.zeros((n_dim, 0), complex), s_dot)
+            a_basis = hamk@basis-sigma*s_dot(basis)
+        corr = _orth_against(corr, basis, s_dot)
+        if corr.shape[1] == 0:
+            break
+        basis = np.hstack((basis, corr))
+        a_basis = np.hstack((a_basis, hamk@corr-sigma*s_dot(corr)))
+
+    return (v, w, False, n_iter)
+
+
+def refine_eigh(h_dot, v_low: np.ndarray, w_low: np.ndarray, n_eig: int, s_dot=None, n_iter: int = 2) -> tuple:
+    """refine the `n_eig` eigenpairs around half filling of a low precision solve in double precision
+
+    Each step corrects the residual with the low precision spectral decomposition,
+    x <- x - sum_j w_j (w_j^H r)/(v_j-e) over the eigenpairs j outside the window, followed by a
+    double precision Rayleigh-Ritz within the window. A step gains roughly the digits of the
+    low precision solve, `n_iter=0` only evaluates the residual.
+
+    Args:
+        h_dot (callable): x -> H x in double precision
+        v_low (np.ndarray): low precision eigenvalues in ascending order
+        w_low (np.ndarray): low precision S-orthonormal eigenvectors
+        n_eig (int): number of refined eigenpairs
+        s_dot (callable, optional): x -> S x in double precision, None for a standard problem. Defaults to None.
+        n_iter (int, optional): number of correction steps. Defaults to 2.
+
+    Returns:
+        tuple: (v, w, resid) eigenvalues in double precision with the window refined, eigenvectors with
+        the window replaced (complex128 if refined, else in the precision of `w_low`), residual
+        |H x - e S x| of the window
+    """
+
+    s_dot = (lambda x: x) if s_dot is None else s_dot
+    n_band = v_low.shape[0]
+    idx = np.arange(n_band//2-n_eig//2, n_band//2-n_eig//2+n_eig)
+    x = np.asarray(w_low[:, idx], dtype=complex)
+
+    for i in range(n_iter+1):
+        if i>0:
+            # the correction is relative to the residual, so the low precision is enough here
+            coef = w_low.conj().T@res.astype(w_low.dtype)
+            denom = v_low[:, np.newaxis]-v[np.newaxis, :]
+            denom[idx] = np.inf
+            x = x-w_low@(coef/denom).astype(w_low.dtype)
+        x = _orth_against(x, np.zeros((x.shape[0], 0), complex), s_dot)
+        h_x = h_dot(x)
+        h_sub = x.conj().T@h_x
+        v, z = np.linalg.eigh((h_sub+h_sub.conj().T)/2)
+        x = x@z
+        res = h_x@z-s_dot(x)*v
+
+    v_full = np.array(v_low, dtype=float)
+    v_full[idx] = v
+    # refined vectors keep their double precision
+    w_full = np.array(w_low, dtype=complex if n_iter>0 else w_low.dtype)
+    w_full[:, idx] = x
+
+    return (v_full, w_full, np.linalg.norm(res, axis=0))
+
+
+def _select_window(v: np.ndarray, w: np.ndarray, n_eig=None, sigma=None) -> tuple:
+    """select eigenpairs from a full spectrum
+
+    Args:
+        v (np.ndarray): eigenvalues in ascending order
+        w (np.ndarray): eigenvectors
+        n_eig (int, optional): number of eigenpairs, None for all. Defaults to None.
+        sigma (float, optional): target energy, None for the bands around half filling. Defaults to None.
+
+    Returns:
+        tuple: (v, w)
+    """
+
+    if n_eig is None:
+        return (v, w)
+    if sigma is None:
+        n_band = v.shape[0]
+        idx = np.arange(n_band//2-n_eig//2, n_band//2-n_eig//2+n_eig)
+    else:
+        idx = np.sort(np.argsort(np.abs(v-sigma))[:n_eig])
+
+    return (v[idx], w[:, idx])
+
+
+def register_backend(name: str, sparse: bool = False, generalized: bool = True):
+    """decorator registering an eigen solver backend
+
+    A backend is called as func(hamk, smat=None, n_eig=None, sigma=None) -> (v, w) and returns
+    all eigenpairs (n_eig None), the n_eig ones around half filling (sigma None) or the
+    n_eig ones closest to sigma, in ascending order.
+
+    Args:
+        name (str): name of the backend
+        sparse (bool, optional): whether it works on scipy sparse matrices. Defaults to False.
+        generalized (bool, optional): whether it supports an overlap matrix. Defaults to True.
+    """
+
+    def decorator(func):
+        EIGEN_BACKENDS[name] = {'func': func, 'sparse': sparse, 'generalized': generalized}
+        return func
+
+    return decorator
+
+
+@register_backend('numpy', generalized=False)
+def _eigh_numpy(hamk, smat=None, n_eig=None, sigma=None):
+    v, w = np.linalg.eigh(hamk)
+    return _select_window(v, w, n_eig, sigma)
+
+
+def _eigh_scipy(hamk, smat, n_eig, sigma, driver):
+    if n_eig is not None and sigma is None and driver in ('evx', 'gvx'):
+        n_band = hamk.shape[0]
+        lo = n_band//2-n_eig//2
+        return sla.eigh(hamk, b=smat, driver=driver, subset_by_index=[lo, lo+n_eig-1], check_finite=False)
+    v, w = sla.eigh(hamk, b=smat, driver=driver, check_finite=False)
+    return _select_window(v, w, n_eig, sigma)
+
+
+@register_backend('scipy_evd', generalized=False)
+def _eigh_scipy_evd(hamk, smat=None, n_eig=None, sigma=None):
+    return _eigh_scipy(hamk, None, n_eig, sigma, 'evd')
+
+
+@register_backend('scipy_evr', generalized=False)
+def _eigh_scipy_evr(hamk, smat=None, n_eig=None, sigma=None):
+    return _eigh_scipy(hamk, None, n_eig, sigma, 'evr')
+
+
+@register_backend('scipy_evx', generalized=False)
+def _eigh_scipy_evx(hamk, smat=None, n_eig=None, sigma=None):
+    return _eigh_scipy(hamk, None, n_eig, sigma, 'evx')
+
+
+@register_backend('scipy_gvd')
+def _eigh_scipy_gvd(hamk, smat=None, n_eig=None, sigma=None):
+    if smat is None:
+        return _eigh_scipy(hamk, None, n_eig, sigma, 'evd')
+    return _eigh_scipy(hamk, smat, n_eig, sigma, 'gvd')
+
+
+@register_backend('scipy_gvx')
+def _eigh_scipy_gvx(hamk, smat=None, n_eig=None, sigma=None):
+    if smat is None:
+        return _eigh_scipy(hamk, None, n_eig, sigma, 'evx')
+    return _eigh_scipy(hamk, smat, n_eig, sigma, 'gvx')
+
+
+@register_backend('eigsh', sparse=True)
+def _eigh_eigsh(hamk, smat=None, n_eig=None, sigma=None):
+    if n_eig is None or sigma is None:
+        raise ValueError("eigsh backend needs both n_eig and sigma.")
+    v, w = spla.eigsh(hamk, k=n_eig, M=smat, sigma=sigma)
+    idx = np.argsort(v)
+    return (v[idx], w[:, idx])
+
+
+@functools.lru_cache(maxsize=None)
+def _machine_fingerprint() -> str:
+    """short identity of the node type: cpu model, core count and BLAS library
+
+    The tuning cache usually lives in a home directory shared by different node types, whose
+    winners differ.
+    """
+
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    blas = sorted("{}-{}-{}".format(info.get('internal_api'), info.get('version'), info.get('architecture'))
+                  for info in threadpool_info()
+                  if info.get('user_api') == 'blas')
+    ident = "|".join([platform.machine(), cpu, str(os.cpu_count())]+blas)
+
+    return hashlib.sha1(ident.encode()).hexdigest()[:12]
+
+
+def _set_tune_key(hamk, smat, n_eig, sigma) -> str:
+    """key of a problem class on this node type in the autotuning table"""
+
+    return "{}-{}-{}-{}-{}-{}-{}".format(_machine_fingerprint(), 'sparse' if sp.issparse(hamk) else 'dense',
+                                         hamk.shape[0], 'all' if n_eig is None else n_eig,
+                                         'mid' if sigma is None else 'sigma',
+                                         np.dtype(hamk.dtype).name, 'std' if smat is None else 'gen')
+
+
+def _read_tune_cache(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_tune_cache(path: str, key: str, name: str):
+    table = _read_tune_cache(path)
+    table[key] = name
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path+".tmp"+str(os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(table, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def candidate_backends(hamk, smat=None, n_eig=None, sigma=None) -> list:
+    """backends able to solve the given problem
+
+    Returns:
+        list: names of the backends
+    """
+
+    is_sparse = sp.issparse(hamk)
+    names = []
+    for (name, info) in EIGEN_BACKENDS.items():
+        if info['sparse'] != is_sparse:
+            continue
+        if smat is not None and not info['generalized']:
+            continue
+        if is_sparse and (n_eig is None or sigma is None):
+            continue
+        names.append(name)
+
+    return names
+
+
+def autotune_backend(hamk,
+                     smat=None,
+                     n_eig=None,
+                     sigma=None,
+                     cache_path: str = None,
+                     n_repeat: int = 3) -> str:
+    """pick the fastest backend for this class of problems
+
+    The candidates are timed on `hamk` per (node type, matrix size, requested bands, dtype),
+    after a warm-up call, as the best of `n_repeat` runs. The winner is cached in memory and in
+    a json file, so later runs on the same node type skip the benchmark.
+
+    Args:
+        hamk: hamiltonian used for benchmarking
+        smat (optional): overlap matrix. Defaults to None.
+        n_eig (int, optional): number of requested eigenpairs. Defaults to None.
+        sigma (float, optional): target energy. Defaults to None.
+        cache_path (str, optional): json cache, Defaults to TUNE_CACHE_PATH.
+        n_repeat (int, optional): timed runs of each candidate. Defaults to 3.
+
+    Raises:
+        Exception: no backend can solve the problem.
+
+    Returns:
+        str: name of the backend
+    """
+
+    cache_path = TUNE_CACHE_PATH if cache_path is None else cache_path
+    key = _set_tune_key(hamk, smat, n_eig, sigma)
+    if key in _TUNE_TABLE:
+        return _TUNE_TABLE[key]
+    name = _read_tune_cache(cache_path).get(key)
+    if name in EIGEN_BACKENDS:
+        _TUNE_TABLE[key] = name
+        return name
+
+    timing = {}
+    for name in candidate_backends(hamk, smat, n_eig, sigma):
+        func = EIGEN_BACKENDS[name]['func']
+        try:
+            # warm-up, the first call pays for loading and workspace allocation
+            func(hamk, smat, n_eig, sigma)
+        except (ValueError, np.linalg.LinAlgError, sla.LinAlgError):
+            continue
+        best = np.inf
+        for _ in range(n_repeat):
+            start = time.perf_counter()
+            func(hamk, smat, n_eig, sigma)
+            best = min(best, time.perf_counter()-start)
+        timing[name] = best
+    if not timing:
+        raise Exception("no eigen solver backend can solve {}.".format(key))
+    name = min(timing, key=timing.get)
+    print("autotune eigen solver".ljust(30), ":", key, "->", name)
+    _TUNE_TABLE[key] = name
+    _write_tune_cache(cache_path, key, name)
+
+    return name
+
+
+def eigh(hamk, smat=None, n_eig=None, sigma=None, backend: str = 'auto') -> tuple:
+    """solve a hermitian eigenvalue problem with a registered backend
+
+    Args:
+        hamk: hamiltonian, dense np.ndarray or scipy sparse matrix
+        smat (optional): overlap matrix. Defaults to None.
+        n_eig (int, optional): number of eigenpairs, None for all. Defaults to None.
+        sigma (float, optional): target energy, None for the bands around half filling. Defaults to None.
+        backend (str, optional): name of the backend, 'auto' for autotuning. Defaults to 'auto'.
+
+    Returns:
+        tuple: (v, w)
+    """
+
+    if backend == 'auto':
+        backend = autotune_backend(hamk, smat, n_eig, sigma)
+
+    return EIGEN_BACKENDS[backend]['func'](hamk, smat, n_eig, sigma)
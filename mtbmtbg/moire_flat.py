@@ -1,5 +1,5 @@
-import mtbmtbg.moire_tb as mtb
-from mtbmtbg.config import DataType, ValleyType
+import mtbmtbg.moire_valley as mval
+from mtbmtbg.config import DataType
 
 import numpy as np
 
@@ -13,11 +13,9 @@ def _cal_flatband_var(emesh):
 
 
 def cal_flatness(n_moire: int, n_g: int, datatype=DataType.CORRU):
-    ret = mtb.tb_solver(n_moire, n_g, 10, disp=False, datatype=datatype, valley=ValleyType.VALLEYK1)
-    emesh = ret['emesh']
-    v1_flatness = _cal_flatband_var(emesh)
-    ret = mtb.tb_solver(n_moire, n_g, 10, disp=False, datatype=datatype, valley=ValleyType.VALLEYK2)
-    emesh = ret['emesh']
-    v2_flatness = _cal_flatband_var(emesh)
+    # VALLEYK2 is mapped from VALLEYK1 by time reversal
+    ret = mval.valley_solver(n_moire, n_g, 10, disp=False, datatype=datatype)
+    v1_flatness = _cal_flatband_var(ret['emesh'])
+    v2_flatness = _cal_flatband_var(ret['emesh_k2'])
 
     return (v1_flatness, v2_flatness)
@@ -1,24 +1,53 @@
 import numpy as np
 
 from itertools import product
-from scipy.linalg import block_diag
 
 
-def set_g_vec_list(n_g: int, m_basis_vecs: dict) -> np.ndarray:
+def set_g_int_list(n_g: int, shell: bool = False, m_basis_vecs: dict = None) -> np.ndarray:
+    """integer coordinates (i, j) of the Glist G = i*mg1+j*mg2
+
+    The default order starts with G[0] = 0, then the i, j >= 0 sector and the two other sectors
+    of the hexagon, which is the layout `moire_shuffle` and the saved Glists assume.
+
+    Args:
+        n_g (int): an integer to descirbe the glist area size
+        shell (bool, optional): order the G vectors by shells of |G|, G[0] = 0 stays first. Defaults to False.
+        m_basis_vecs (dict, optional): moire basis vectors dictionary, needed by `shell`. Defaults to None.
+
+    Returns:
+        np.ndarray: coordinates, one row per G vector
+    """
+
+    (i, j) = np.meshgrid(np.arange(n_g), np.arange(n_g), indexing='ij')
+    (i1, j1) = (i[:, 1:].ravel(), j[:, 1:].ravel())
+    (i2, j2) = (i[1:, 1:].ravel(), j[1:, 1:].ravel())
+    g_coords = np.concatenate([
+        np.stack([i.ravel(), j.ravel()], axis=1),
+        np.stack([-j1, i1-j1], axis=1),
+        np.stack([j2-i2, -i2], axis=1),
+    ])
+
+    if shell:
+        g_vec_list = g_coords@np.array([m_basis_vecs['mg1'], m_basis_vecs['mg2']])
+        g_norm = np.sum(g_vec_list**2, axis=1)/np.dot(m_basis_vecs['mg1'], m_basis_vecs['mg1'])
+        # rounded so that the G vectors of a shell keep the default order
+        g_coords = g_coords[np.argsort(np.round(g_norm, 6), kind='stable')]
+
+    return g_coords
+
+
+def set_g_vec_list(n_g: int, m_basis_vecs: dict, shell: bool = False) -> np.ndarray:
     """generate G list
 
     Args:
         n_g (int): an integer to descirbe the glist area size
         m_basis_vecs (dict): moire basis vectors dictionary
+        shell (bool, optional): order the G vectors by shells of |G|, see `set_g_int_list`. Defaults to False.
 
     Returns:
         np.ndarray: glist
     """
 
-    m_g_unitvec_1 = m_basis_vecs['mg1']
-    m_g_unitvec_2 = m_basis_vecs['mg2']
-    g_vec_list = []
-
     #construct a hexagon area by using three smallest g vectors (with symmetry)
     # g_3 = -m_g_unitvec_1-m_g_unitvec_2
 
@@ -32,19 +61,9 @@ def set_g_vec_list(n_g: int, m_basis_vecs: dict) -> np.ndarray:
     #     for j in range(1, n_g):
     #         g_vec_list.append(j*g_3+i*m_g_unitvec_2)
 
-    for i in range(n_g):
-        for j in range(n_g):
-            g_vec_list.append(i*m_g_unitvec_1+j*m_g_unitvec_2)
+    g_coords = set_g_int_list(n_g, shell, m_basis_vecs)
 
-    for i in range(n_g):
-        for j in range(1, n_g):
-            g_vec_list.append(-j*m_g_unitvec_1+(i-j)*m_g_unitvec_2)
-
-    for i in range(1, n_g):
-        for j in range(1, n_g):
-            g_vec_list.append(-i*m_g_unitvec_2+(j-i)*m_g_unitvec_1)
-
-    return np.array(g_vec_list)
+    return g_coords@np.array([m_basis_vecs['mg1'], m_basis_vecs['mg2']])
 
 
 def set_kmesh(n_k: int, m_basis_vecs: dict) -> np.ndarray:
@@ -86,6 +105,51 @@ def set_kmesh_dos(n_k: int, m_basis_vecs: dict) -> np.ndarray:
     return np.array(kmesh)
 
 
+def set_c3_mtrx(m_basis_vecs: dict) -> np.ndarray:
+    """C3z rotation acting on the integer coordinates (i, j) of i*mg1+j*mg2
+
+    Args:
+        m_basis_vecs (dict): moire basis vectors dictionary
+
+    Returns:
+        np.ndarray: integer matrix, the rotated coordinates are c3_mtrx@(i, j)
+    """
+
+    basis = np.array([m_basis_vecs['mg1'], m_basis_vecs['mg2']]).T
+    c3 = np.array([[-1/2, -np.sqrt(3)/2], [np.sqrt(3)/2, -1/2]])
+
+    return np.rint(np.linalg.solve(basis, c3@basis)).astype(int)
+
+
+def set_kmesh_irreducible(n_k: int, m_basis_vecs: dict) -> dict:
+    """C3z irreducible k points of `set_kmesh`
+
+    The p-th point of `set_kmesh` is the point kmap[p] of the irreducible kmesh rotated rot[p]
+    times by C3z, up to a moire reciprocal vector.
+
+    Args:
+        n_k (int): number of kpts of the full kmesh should be n_k**2.
+        m_basis_vecs (dict): moire basis vectors dictionary
+
+    Returns:
+        dict: {kmesh, weight: number of full kmesh points of each irreducible one, kmap, rot,
+            kidx: indices of the irreducible points in the full kmesh}
+    """
+
+    c3_inv = np.linalg.matrix_power(set_c3_mtrx(m_basis_vecs), 2)
+    coords = np.array(list(product(range(n_k), range(n_k))))
+    # orbit[r, p]: index of the p-th point rotated back r times, the smallest one represents the orbit
+    orbit = []
+    for r in range(3):
+        orbit.append((coords[:, 0] % n_k)*n_k+coords[:, 1] % n_k)
+        coords = coords@c3_inv.T
+    orbit = np.array(orbit)
+    rot = np.argmin(orbit, axis=0)
+    (kidx, kmap, weight) = np.unique(orbit[rot, np.arange(n_k*n_k)], return_inverse=True, return_counts=True)
+
+    return {'kmesh': set_kmesh(n_k, m_basis_vecs)[kidx], 'weight': weight, 'kmap': kmap, 'rot': rot, 'kidx': kidx}
+
+
 def set_tb_disp_kmesh(n_k: int, high_symm_pnts: dict) -> tuple:
     """setup kpath along high symmetry points in moire B.Z.
 
@@ -129,8 +193,98 @@ def set_tb_disp_kmesh(n_k: int, high_symm_pnts: dict) -> tuple:
     return (kline, kmesh)
 
 
+def set_g_coords(g_vec_list: np.ndarray, m_basis_vecs: dict) -> np.ndarray:
+    """integer coordinates (i, j) of the G vectors i*mg1+j*mg2
+
+    Args:
+        g_vec_list (np.ndarray): Glist
+        m_basis_vecs (dict): moire basis vectors dictionary
+
+    Returns:
+        np.ndarray: coordinates, one row per G vector
+    """
+
+    basis = np.array([m_basis_vecs['mg1'], m_basis_vecs['mg2']]).T
+
+    return np.rint(np.linalg.solve(basis, g_vec_list.T).T).astype(int)
+
+
+def set_g_table(g_coords: np.ndarray) -> tuple:
+    """lookup table of the Glist over the box of its integer coordinates
+
+    Args:
+        g_coords (np.ndarray): coordinates of the Glist, see `set_g_coords`
+
+    Returns:
+        tuple: (table, lo), table[i-lo[0], j-lo[1]] is the index of the G vector (i, j), -1 if it is
+            not in the Glist
+    """
+
+    lo = g_coords.min(axis=0)
+    table = np.full(tuple(g_coords.max(axis=0)-lo+1), -1, dtype=int)
+    table[tuple((g_coords-lo).T)] = np.arange(g_coords.shape[0])
+
+    return (table, lo)
+
+
+def find_g_coords(g_table: tuple, coords: np.ndarray) -> np.ndarray:
+    """indices of integer coordinates in the Glist, -1 for the ones outside it
+
+    Args:
+        g_table (tuple): returned by `set_g_table`
+        coords (np.ndarray): coordinates searched, (..., 2)
+
+    Returns:
+        np.ndarray: indices, coords.shape[:-1]
+    """
+
+    (table, lo) = g_table
+    coords = coords-lo
+    inside = np.all((coords >= 0) & (coords<table.shape), axis=-1)
+    coords = np.where(inside[..., None], coords, 0)
+
+    return np.where(inside, table[coords[..., 0], coords[..., 1]], -1)
+
+
+def set_g_shift(g_vec_list: np.ndarray, m_basis_vecs: dict, shift: tuple) -> np.ndarray:
+    """index map of the G vectors shifted by shift[0]*mg1+shift[1]*mg2
+
+    Multiplying the bands by the transposed 0/1 shift matrix of each of the 4 sublattice blocks
+    is the gather bands[shift_map] with the -1 rows set to zero.
+
+    Args:
+        g_vec_list (np.ndarray): Glist
+        m_basis_vecs (dict): moire basis vectors dictionary
+        shift (tuple): integer shift (i, j)
+
+    Returns:
+        np.ndarray: index of G_i+shift for each G_i, -1 if it is outside the Glist
+    """
+
+    g_coords = set_g_coords(g_vec_list, m_basis_vecs)
+
+    return find_g_coords(set_g_table(g_coords), g_coords+np.array(shift))
+
+
+def set_neighbor_map(g_vec_list: np.ndarray, m_basis_vecs: dict) -> np.ndarray:
+    """indices of the G vectors G_m+i*mg1+j*mg2 for i, j in (0, 1)
+
+    Args:
+        g_vec_list (np.ndarray): Glist
+        m_basis_vecs (dict): moire basis vectors dictionary
+
+    Returns:
+        np.ndarray: neighbor_map[m, i, j], -1 if it is outside the Glist
+    """
+
+    g_coords = set_g_coords(g_vec_list, m_basis_vecs)
+    shifts = np.array([[[0, 0], [0, 1]], [[1, 0], [1, 1]]])
+
+    return find_g_coords(set_g_table(g_coords), g_coords[:, None, None, :]+shifts)
+
+
 def set_kmesh_neighbour(n_g: int, m_basis_vecs: dict, g_vec_list: np.ndarray) -> tuple:
-    """hard to describe.....
+    """index maps of the Glist shifted by each of its G vectors and by the moire reciprocal vectors
 
     Args:
         n_g (int): an integer describing the size of G list
@@ -138,39 +292,12 @@ def set_kmesh_neighbour(n_g: int, m_basis_vecs: dict, g_vec_list: np.ndarray) ->
         g_vec_list (np.ndarray): Glist
 
     Returns:
-        tuple: (transmat_list, neighbor_map)
+        tuple: (shift_list, neighbor_map), shift_list[m] is the index map of the G vectors shifted by
+            G_m, see `set_g_shift`, and neighbor_map[m, i, j] the index of G_m+i*mg1+j*mg2
     """
     assert np.allclose(g_vec_list[0], np.array([0.0, 0.0]))
 
-    m_g_unitvec_1 = m_basis_vecs['mg1']
-    m_g_unitvec_2 = m_basis_vecs['mg2']
+    g_coords = set_g_coords(g_vec_list, m_basis_vecs)
+    shift_list = find_g_coords(set_g_table(g_coords), g_coords[:, None, :]+g_coords[None, :, :])
 
-    num_g = g_vec_list.shape[0]
-    # searching tolerance
-    err = 0.02*np.dot(m_g_unitvec_1, m_g_unitvec_1)
-
-    transmat_list = []
-    for m in range(num_g):
-        mat = np.zeros((num_g, num_g), float)
-        q_vec = g_vec_list[m]
-        for (i, j) in product(range(num_g), range(num_g)):
-            diff_vec = g_vec_list[i]+q_vec-g_vec_list[j]
-            diff = np.sqrt(np.dot(diff_vec, diff_vec))
-            if diff<err:
-                mat[j, i] = 1.0
-        transmat = block_diag(mat, mat, mat, mat)
-        transmat_list.append(transmat)
-
-    neighbor_map = np.zeros((num_g, 2, 2), int)
-    for m in range(num_g):
-        q_vec = g_vec_list[m]
-        for (i, j) in product(range(2), range(2)):
-            neighbor_map[m, i, j] = -1
-            neighbor_vec = i*m_g_unitvec_1+j*m_g_unitvec_2+q_vec
-            for n in range(num_g):
-                diff_vec = g_vec_list[n]-neighbor_vec
-                diff = np.sqrt(np.dot(diff_vec, diff_vec))
-                if diff<err:
-                    neighbor_map[m, i, j] = n
-
-    return (np.array(transmat_list), neighbor_map)
+    return (shift_list, set_neighbor_map(g_vec_list, m_basis_vecs))
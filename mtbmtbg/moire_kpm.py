@@ -0,0 +1,212 @@
+import time
+import numpy as np
+from scipy import sparse
+
+import mtbmtbg.moire_setup as mset
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_gk as mgk
+import mtbmtbg.moire_io as mio
+from mtbmtbg.config import DataType, EngineType
+
+# atoms in a moire unit cell are arranged as (A1, B1, A2, B2)
+SUBLATTICES = ('A1', 'B1', 'A2', 'B2')
+LAYERS = {'layer1': ('A1', 'B1'), 'layer2': ('A2', 'B2')}
+
+
+def _set_spectral_bounds(hamk, eps: float = 0.01) -> tuple:
+    """bound the spectrum by the Gershgorin circles, O(nnz)
+
+    Args:
+        hamk: sparse hermitian hamiltonian
+        eps (float, optional): relative padding keeping the rescaled spectrum inside (-1, 1). Defaults to 0.01.
+
+    Returns:
+        tuple: (a, b) with the rescaled hamiltonian (H-b)/a
+    """
+
+    diag = np.real(hamk.diagonal())
+    radius = np.asarray(abs(hamk).sum(axis=1)).ravel()-np.abs(diag)
+    emax = np.max(diag+radius)
+    emin = np.min(diag-radius)
+
+    return ((emax-emin)/(2-eps), (emax+emin)/2)
+
+
+def _jackson_kernel(n_moments: int) -> np.ndarray:
+    """Jackson damping factors removing the Gibbs oscillations of the truncated Chebyshev series
+
+    Args:
+        n_moments (int): number of moments
+
+    Returns:
+        np.ndarray: damping factors g_n
+    """
+
+    n = np.arange(n_moments)
+    q = np.pi/(n_moments+1)
+
+    return ((n_moments-n+1)*np.cos(q*n)+np.sin(q*n)/np.tan(q))/(n_moments+1)
+
+
+def cal_kpm_moments(hamk,
+                    n_moments: int,
+                    group_idx: np.ndarray,
+                    n_group: int,
+                    a: float,
+                    b: float,
+                    n_random: int = 16,
+                    n_batch: int = 16,
+                    rng=None) -> np.ndarray:
+    """Chebyshev moments of the orbital resolved density of states by stochastic trace estimation
+
+    mu_n[g] = sum_{i in g} <r|i><i|T_n(H')|r>, averaged over random phase vectors r, where
+    H' = (H-b)/a. The random vectors are propagated in blocks of `n_batch` columns, so the memory
+    is O(N*n_batch) and the time O(nnz*n_moments*n_random).
+
+    Args:
+        hamk: sparse hermitian hamiltonian
+        n_moments (int): number of moments
+        group_idx (np.ndarray): group of each orbital
+        n_group (int): number of groups
+        a (float): half width of the spectrum
+        b (float): center of the spectrum
+        n_random (int, optional): number of random vectors. Defaults to 16.
+        n_batch (int, optional): random vectors propagated together. Defaults to 16.
+        rng (optional): numpy random generator. Defaults to None.
+
+    Returns:
+        np.ndarray: moments, shape (n_group, n_moments), normalized per orbital of each group
+    """
+
+    rng = np.random.default_rng() if rng is None else rng
+    n_dim = hamk.shape[0]
+    hamk = sparse.csr_matrix((hamk-b*sparse.identity(n_dim))/a)
+    # orbital -> group summation
+    proj = sparse.csr_matrix((np.ones(n_dim), (group_idx, np.arange(n_dim))), shape=(n_group, n_dim))
+    moments = np.zeros((n_group, n_moments))
+
+    for start in range(0, n_random, n_batch):
+        n_vec = min(n_batch, n_random-start)
+        r_vec = np.exp(2j*np.pi*rng.random((n_dim, n_vec)))
+        r_conj = r_vec.conj()
+        # Chebyshev recursion T_{n+1} = 2H'T_n-T_{n-1}
+        (t0, t1) = (r_vec, hamk@r_vec)
+        moments[:, 0] += proj@np.real(np.sum(r_conj*t0, axis=1))
+        for n in range(1, n_moments):
+            moments[:, n] += proj@np.real(np.sum(r_conj*t1, axis=1))
+            (t0, t1) = (t1, 2*(hamk@t1)-t0)
+
+    return moments/(n_random*np.asarray(proj.sum(axis=1)))
+
+
+def cal_kpm_density(moments: np.ndarray, energy: np.ndarray, a: float, b: float) -> np.ndarray:
+    """reconstruct densities from Jackson damped Chebyshev moments
+
+    Args:
+        moments (np.ndarray): moments, shape (..., n_moments)
+        energy (np.ndarray): energies (eV), the densities vanish outside the spectrum (b-a, b+a)
+        a (float): half width of the spectrum
+        b (float): center of the spectrum
+
+    Returns:
+        np.ndarray: densities (states/eV per orbital), shape (..., n_energy)
+    """
+
+    n_moments = moments.shape[-1]
+    coef = moments*_jackson_kernel(n_moments)
+    coef[..., 1:] *= 2
+    x = (np.asarray(energy)-b)/a
+    inside = np.abs(x)<1
+    # T_n(x) for the energies inside the spectrum, shape (n_moments, n_inside)
+    cheb = np.cos(np.arange(n_moments)[:, np.newaxis]*np.arccos(x[inside]))
+    density = np.zeros(moments.shape[:-1]+x.shape)
+    density[..., inside] = (coef@cheb)/(np.pi*np.sqrt(1-x[inside]**2)*a)
+
+    return density
+
+
+def kpm_solver(n_moire: int,
+               n_k: int = 1,
+               n_moments: int = 1024,
+               n_random: int = 16,
+               n_energy: int = 2000,
+               e_range: tuple = None,
+               datatype=DataType.CORRU,
+               n_batch: int = 16,
+               seed: int = None) -> dict:
+    """density of states of the full tight binding hamiltonian by the kernel polynomial method
+
+    The sparse `hr_mtrx` is never diagonalized, the cost is O(nnz*n_moments*n_random) per k point.
+
+    Args:
+        n_moire (int): an integer describing the size of commensurate TBG systems
+        n_k (int, optional): kmesh is n_k*n_k, n_k = 1 for the Gamma point only. Defaults to 1.
+        n_moments (int, optional): number of Chebyshev moments, the energy resolution is about the
+            band width/n_moments. Defaults to 1024.
+        n_random (int, optional): number of random vectors per k point. Defaults to 16.
+        n_energy (int, optional): number of energies. Defaults to 2000.
+        e_range (tuple, optional): (emin, emax) of the energies, None for the whole spectrum. The densities
+            are zero outside the spectral bounds. Defaults to None.
+        datatype (DataType, optional): atom data type. Defaults to DataType.CORRU.
+        n_batch (int, optional): random vectors propagated together. Defaults to 16.
+        seed (int, optional): seed of the random vectors. Defaults to None.
+
+    Returns:
+        dict:
+        'energy': energies,
+        'dos': total density of states per atom,
+        'ldos': {'A1', 'B1', 'A2', 'B2', 'layer1', 'layer2'} density of states per atom of each group,
+        'moments': averaged moments of each sublattice
+    """
+    start_time = time.process_time()
+    rng = np.random.default_rng(seed)
+
+    # load atom data
+    atom_pstn_list = mio.read_atom_pstn_list(n_moire, datatype)
+    # construct moire info
+    (_, m_basis_vecs, _) = mset._set_moire(n_moire)
+    (all_nns, enlarge_atom_pstn_list) = mset.set_atom_neighbour_list(atom_pstn_list, m_basis_vecs)
+    (npair_dict, ndist_dict) = mset.set_relative_dis_ndarray(atom_pstn_list, enlarge_atom_pstn_list, all_nns)
+    n_atom = atom_pstn_list.shape[0]
+    hopping = mtb._sk_integral(ndist_dict)
+    tr_mtrx = sparse.csr_matrix((hopping, (npair_dict['r'], npair_dict['c'])), shape=(n_atom, n_atom))
+    # no plane wave projection in the full tight binding hamiltonian
+    const_mtrx_dict = {'gr': None, 'tr': tr_mtrx}
+    kmesh = mgk.set_kmesh(n_k, m_basis_vecs)
+    group_idx = np.repeat(np.arange(4), n_atom//4)
+
+    print("="*100)
+    print("num of atoms".ljust(30), ":", n_atom)
+    print("num of kpoints".ljust(30), ":", kmesh.shape[0])
+    print("num of moments".ljust(30), ":", n_moments)
+    print("num of random vectors".ljust(30), ":", n_random)
+    print("="*100)
+    setup_time = time.process_time()
+
+    # |H(k)_ij| <= sum of |t| over the images, so one bound holds for all k points
+    abs_mtrx = sparse.csr_matrix((np.abs(hopping), (npair_dict['r'], npair_dict['c'])), shape=(n_atom, n_atom))
+    (a, b) = _set_spectral_bounds(abs_mtrx)
+    (emax, emin) = (b+a, b-a)
+
+    moments = np.zeros((4, n_moments))
+    for (count, k_vec) in enumerate(kmesh):
+        print("k sampling process, counter:", count+1)
+        hamk = mtb._cal_hamiltonian_k(ndist_dict, npair_dict, const_mtrx_dict, k_vec, n_atom, EngineType.TBSPARSE)
+        moments += cal_kpm_moments(hamk, n_moments, group_idx, 4, a, b, n_random, n_batch, rng)
+    moments /= kmesh.shape[0]
+    comp_time = time.process_time()
+
+    if e_range is None:
+        e_range = (b-a*0.99, b+a*0.99)
+    energy = np.linspace(e_range[0], e_range[1], n_energy)
+    density = cal_kpm_density(moments, energy, a, b)
+    ldos = dict(zip(SUBLATTICES, density))
+    for (layer, sublattices) in LAYERS.items():
+        ldos[layer] = np.mean([ldos[s] for s in sublattices], axis=0)
+
+    print("="*100)
+    print("emax =", emax, "emin =", emin)
+    print("set up time:", setup_time-start_time, "comp time:", comp_time-setup_time)
+    print("="*100)
+
+    return {'energy': energy, 'dos': np.mean(density, axis=0), 'ldos': ldos, 'moments': moments}
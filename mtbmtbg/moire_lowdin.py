@@ -0,0 +1,258 @@
+import time
+import numpy as np
+import scipy.linalg as sla
+
+import mtbmtbg.moire_setup as mset
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_gk as mgk
+import mtbmtbg.moire_io as mio
+from mtbmtbg.config import DataType, EngineType, ValleyType, Structure
+
+# largest spectral radius of the Neumann series in `lowdin_fold`, above it the series converges too slowly
+NEUMANN_RHO = 0.5
+
+
+def _set_lowdin_partition(g_vec_list: np.ndarray, m_basis_vecs: dict, g_cut: float) -> tuple:
+    """split the TBPLW basis into low energy (P) and high energy (Q) plane waves
+
+    A plane wave belongs to P if |G-K| < g_cut*|mg1|, where K is the atomic K point
+    of the valley. The Q indices are arranged G by G, so the 4x4 (layer, sublattice)
+    blocks of each high energy plane wave are contiguous.
+
+    Args:
+        g_vec_list (np.ndarray): Glist moved to the valley
+        m_basis_vecs (dict): moire basis vectors dictionary
+        g_cut (float): cutoff radius in unit of |mg1|
+
+    Returns:
+        tuple: (p_idx, q_idx) indices in the TBPLW basis
+    """
+
+    n_g = g_vec_list.shape[0]
+    mg = np.linalg.norm(m_basis_vecs['mg1'])
+    # distance to the closest atomic K point, works for combined valleys as well
+    dis = np.minimum(np.linalg.norm(g_vec_list-Structure.ATOM_K_1, axis=1),
+                     np.linalg.norm(g_vec_list-Structure.ATOM_K_2, axis=1))
+    g_low = np.nonzero(dis<g_cut*mg)[0]
+    g_high = np.nonzero(dis >= g_cut*mg)[0]
+    # TBPLW basis is arranged as (A1[Gi], B1[Gi], A2[Gi], B2[Gi])
+    p_idx = (np.arange(4).reshape(4, 1)*n_g+g_low).ravel()
+    q_idx = (g_high.reshape(-1, 1)+np.arange(4)*n_g).ravel()
+
+    return (p_idx, q_idx)
+
+
+def _set_lowdin_blocks(hr_mtrx, gr_p: np.ndarray, gr_q: np.ndarray) -> dict:
+    """assemble the PP, PQ and QQ blocks of the TBPLW hamiltonian H = gr@hr@gr^H
+
+    H_XY = gr_X@(hr@gr_Y^H) with the row slices gr_X of gr, the QP block is never formed.
+
+    Args:
+        hr_mtrx: sparse hamiltonian in the atomic basis
+        gr_p (np.ndarray): low energy rows of gr
+        gr_q (np.ndarray): high energy rows of gr
+
+    Returns:
+        dict: {pp, pq, qq}
+    """
+
+    hr_gr_q = hr_mtrx@gr_q.conj().T
+
+    return {'pp': gr_p@(hr_mtrx@gr_p.conj().T), 'pq': gr_p@hr_gr_q, 'qq': gr_q@hr_gr_q}
+
+
+def lowdin_fold(hamk_blocks: dict, smat_blocks: dict, e_ref: float, order=2) -> tuple:
+    """fold the TBPLW hamiltonian into the low energy space around `e_ref`
+
+    With A(E) = H-E*S, the exact condition for an eigenvalue E is
+    [A_PP - A_PQ A_QQ^-1 A_QP](E) x_P = 0. It is linearized around `e_ref`, which gives
+    a generalized problem H_eff x_P = E S_eff x_P, whose eigenvalues are accurate up to
+    O((E-e_ref)^2). A_QQ^-1 is approximated by a Neumann series around its 4x4 diagonal
+    blocks (one per high energy plane wave), truncated at `order`. The norm ratio of the last two
+    terms estimates the spectral radius of the series, if it is above NEUMANN_RHO the exact
+    inverse is used instead.
+
+    Args:
+        hamk_blocks (dict): {pp, pq, qq} blocks of the TBPLW hamiltonian, see `_set_lowdin_blocks`
+        smat_blocks (dict): {pp, pq, qq} blocks of the overlap matrix, None for a standard eigenvalue problem
+        e_ref (float): reference energy
+        order (int, optional): order of the Neumann series, None for the exact inverse. Defaults to 2.
+
+    Returns:
+        tuple: (h_eff, s_eff, y) with x_Q = -y@x_P
+    """
+
+    if smat_blocks is None:
+        (n_p, n_q) = hamk_blocks['pq'].shape
+        smat_blocks = {'pp': np.identity(n_p), 'pq': np.zeros((n_p, n_q)), 'qq': np.identity(n_q)}
+    a_pq = hamk_blocks['pq']-e_ref*smat_blocks['pq']
+    a_qq = hamk_blocks['qq']-e_ref*smat_blocks['qq']
+    (s_pp, s_pq, s_qq) = (smat_blocks['pp'], smat_blocks['pq'], smat_blocks['qq'])
+
+    y = None
+    if order is not None:
+        n_high = a_qq.shape[0]//4
+        blocks = a_qq.reshape(n_high, 4, n_high, 4)[np.arange(n_high), :, np.arange(n_high), :]
+        r0_blocks = np.linalg.inv(blocks)
+        v_qq = a_qq.copy()
+        v_qq.reshape(n_high, 4, n_high, 4)[np.arange(n_high), :, np.arange(n_high), :] = 0
+
+        def r0_dot(x):
+            return np.einsum('gij,gjn->gin', r0_blocks, x.reshape(n_high, 4, -1)).reshape(4*n_high, -1)
+
+        term = r0_dot(a_pq.conj().T)
+        y = term
+        rho = 0.0
+        for _ in range(order):
+            norm = np.linalg.norm(term)
+            term = -r0_dot(v_qq@term)
+            y = y+term
+            rho = np.linalg.norm(term)/norm
+        if rho>NEUMANN_RHO:
+            print("neumann series of order {} not converged (spectral radius ~ {:.3f}), use the exact inverse.".format(
+                order, rho))
+            y = None
+    if y is None:
+        y = sla.solve(a_qq, a_pq.conj().T, assume_a='her')
+
+    s_eff = s_pp-s_pq@y-(s_pq@y).conj().T+y.conj().T@(s_qq@y)
+    h_eff = hamk_blocks['pp']-e_ref*s_pp-a_pq@y+e_ref*s_eff
+
+    return ((h_eff+h_eff.conj().T)/2, (s_eff+s_eff.conj().T)/2, y)
+
+
+def _cal_lowdin_residual(hamk_blocks: dict, smat_blocks: dict, v: np.ndarray, w: np.ndarray,
+                         y: np.ndarray) -> np.ndarray:
+    """residual |H x - E S x|/|x| of the folded eigenpairs lifted back to the full basis
+
+    There is always an exact eigenvalue within the residual of each folded one. H_QP = H_PQ^H,
+    so the blocks of `_set_lowdin_blocks` are enough.
+
+    Returns:
+        np.ndarray: residual of each band
+    """
+
+    x_p = w
+    x_q = -y@w
+    (h_pp, h_pq, h_qq) = (hamk_blocks['pp'], hamk_blocks['pq'], hamk_blocks['qq'])
+    res_p = h_pp@x_p+h_pq@x_q
+    res_q = h_pq.conj().T@x_p+h_qq@x_q
+    if smat_blocks is None:
+        (res_p, res_q) = (res_p-x_p*v, res_q-x_q*v)
+    else:
+        (s_pp, s_pq, s_qq) = (smat_blocks['pp'], smat_blocks['pq'], smat_blocks['qq'])
+        res_p = res_p-(s_pp@x_p+s_pq@x_q)*v
+        res_q = res_q-(s_pq.conj().T@x_p+s_qq@x_q)*v
+    norm = np.sqrt(np.linalg.norm(x_p, axis=0)**2+np.linalg.norm(x_q, axis=0)**2)
+
+    return np.sqrt(np.linalg.norm(res_p, axis=0)**2+np.linalg.norm(res_q, axis=0)**2)/norm
+
+
+def lowdin_solver(n_moire: int,
+                  n_g: int,
+                  n_k: int,
+                  g_cut: float = 2.0,
+                  order=2,
+                  disp: bool = True,
+                  datatype=DataType.CORRU,
+                  valley=ValleyType.VALLEYK1,
+                  e_ref: float = None,
+                  cal_resid: bool = False) -> dict:
+    """TBPLW solver with the high energy plane waves folded into an effective hamiltonian
+
+    Only the PP, PQ and QQ blocks of the TBPLW hamiltonian are assembled on each k point.
+
+    Args:
+        n_moire (int): an integer describing the size of commensurate TBG systems
+        n_g (int): Glist size, n_g = 5 for MATBG
+        n_k (int): n_k
+        g_cut (float, optional): low energy plane waves satisfy |G-K| < g_cut*|mg1|. Defaults to 2.0.
+        order (int, optional): order of the Neumann series, None for the exact Schur complement. Defaults to 2.
+        disp (bool, optional): whether calculate dispersion. Defaults to True.
+        datatype (DataType, optional): atom data type. Defaults to DataType.CORRU.
+        valley (ValleyType, optional): valley concerned. Defaults to ValleyType.VALLEYK1.
+        e_ref (float, optional): reference energy of the folding, None for the charge neutrality
+            point solved directly at the first k point. Defaults to None.
+        cal_resid (bool, optional): whether calculate the residual of each band in the full TBPLW
+            problem. Defaults to False.
+
+    Returns:
+        dict:
+        'emesh': eigenvalues of the effective hamiltonian,
+        'dmesh': eigenvectors in the low energy space,
+        'resid': residual of each band in the full TBPLW problem (`cal_resid` only),
+        'kline': kline,
+        'pidx': low energy basis indices
+    """
+    start_time = time.process_time()
+    dmesh = []
+    emesh = []
+    resid = []
+    kline = 0
+    count = 1
+
+    # load atom data
+    atom_pstn_list = mio.read_atom_pstn_list(n_moire, datatype)
+    # construct moire info
+    (_, m_basis_vecs, high_symm_pnts) = mset._set_moire(n_moire)
+    (all_nns, enlarge_atom_pstn_list) = mset.set_atom_neighbour_list(atom_pstn_list, m_basis_vecs)
+    (npair_dict, ndist_dict) = mset.set_relative_dis_ndarray(atom_pstn_list, enlarge_atom_pstn_list, all_nns)
+    # set up g list
+    o_g_vec_list = mgk.set_g_vec_list(n_g, m_basis_vecs)
+    # move to specific valley or combined valley
+    g_vec_list = mtb._set_g_vec_list_valley(n_moire, o_g_vec_list, m_basis_vecs, valley)
+    # constant matrix dictionary
+    const_mtrx_dict = mtb._set_const_mtrx(n_moire, npair_dict, ndist_dict, m_basis_vecs, g_vec_list, atom_pstn_list)
+    (p_idx, q_idx) = _set_lowdin_partition(g_vec_list, m_basis_vecs, g_cut)
+    smat = const_mtrx_dict['sr'] if datatype == DataType.RELAX else None
+    # row slices of gr, H_XY = gr_X@(hr@gr_Y^H)
+    (gr_p, gr_q) = (const_mtrx_dict['gr'][p_idx], const_mtrx_dict['gr'][q_idx])
+    smat_blocks = None
+    if smat is not None:
+        smat_blocks = {
+            'pp': smat[np.ix_(p_idx, p_idx)],
+            'pq': smat[np.ix_(p_idx, q_idx)],
+            'qq': smat[np.ix_(q_idx, q_idx)]
+        }
+
+    if disp:
+        (kline, kmesh) = mgk.set_tb_disp_kmesh(n_k, high_symm_pnts)
+    else:
+        kmesh = mgk.set_kmesh(n_k, m_basis_vecs)
+
+    n_atom = atom_pstn_list.shape[0]
+    print("="*100)
+    print("num of atoms".ljust(30), ":", n_atom)
+    print("num of kpoints".ljust(30), ":", kmesh.shape[0])
+    print("num of bands".ljust(30), ":", p_idx.shape[0], "/", p_idx.shape[0]+q_idx.shape[0])
+    print("="*100)
+    setup_time = time.process_time()
+
+    for k_vec in kmesh:
+        print("k sampling process, counter:", count)
+        count += 1
+        if e_ref is None:
+            # the full hamiltonian is only assembled once, for the reference energy
+            hamk = mtb._cal_hamiltonian_k(ndist_dict, npair_dict, const_mtrx_dict, k_vec, n_atom, EngineType.TBPLW)
+            (_, _, e_ref) = mtb._cal_eigen_window(hamk, smat, 2)
+            print("reference energy of folding:", e_ref)
+            del hamk
+        hr_mtrx = mtb._cal_hamiltonian_k(ndist_dict, npair_dict, const_mtrx_dict, k_vec, n_atom, EngineType.TBSPARSE)
+        hamk_blocks = _set_lowdin_blocks(hr_mtrx, gr_p, gr_q)
+        (h_eff, s_eff, y) = lowdin_fold(hamk_blocks, smat_blocks, e_ref, order)
+        eigen_val, eigen_vec = sla.eigh(h_eff, b=s_eff)
+        emesh.append(eigen_val)
+        dmesh.append(eigen_vec)
+        if cal_resid:
+            resid.append(_cal_lowdin_residual(hamk_blocks, smat_blocks, eigen_val, eigen_vec, y))
+    comp_time = time.process_time()
+
+    print("="*100)
+    print("set up time:", setup_time-start_time, "comp time:", comp_time-setup_time)
+    print("="*100)
+
+    ret = {'emesh': np.array(emesh), 'dmesh': np.array(dmesh), 'kline': kline, 'pidx': p_idx}
+    if cal_resid:
+        ret['resid'] = np.array(resid)
+
+    return ret
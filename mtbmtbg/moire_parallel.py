@@ -0,0 +1,421 @@
+import os
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from scipy import sparse
+from threadpoolctl import threadpool_limits
+
+# default number of worker processes of the k point loops, None lets `set_schedule` choose
+N_PROC = int(os.environ['MTBMTBG_NPROC']) if 'MTBMTBG_NPROC' in os.environ else None
+# default BLAS threads per process, None lets `set_schedule` choose
+N_THREAD = int(os.environ['MTBMTBG_NTHREAD']) if 'MTBMTBG_NTHREAD' in os.environ else None
+# a dense eigenvalue problem keeps about dim/BLAS_MIN_DIM BLAS threads busy, smaller ones are best
+# solved with a single thread and the cores spent on other k points
+BLAS_MIN_DIM = 1000
+
+# arrays attached by a worker process: name -> np.ndarray or scipy sparse matrix
+_SHARED = {}
+# shared memory blocks kept alive in a worker process
+_SHM_LIST = []
+# k point solver and its parameters in a worker process
+_WORKER = {}
+
+
+def _set_core_count() -> int:
+    """number of cores available to this process"""
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def set_schedule(n_dim: int, n_kpts: int, n_proc: int = None, n_thread: int = None, n_core: int = None) -> dict:
+    """split the cores between k point worker processes and BLAS threads of each process
+
+    Large dense diagonalizations (TBFULL) keep a multithreaded BLAS busy, while small ones
+    (TBPLW, continuum) scale much better over the k points. The BLAS threads of a process are
+    about n_dim/BLAS_MIN_DIM, the remaining cores solve other k points, and the cores left over
+    when there are fewer k points than processes go back to BLAS. Given values are kept.
+
+    Args:
+        n_dim (int): dimension of the dense matrices diagonalized on each k point, 0 for sparse solvers
+        n_kpts (int): number of k points
+        n_proc (int, optional): number of worker processes. Defaults to None, chosen.
+        n_thread (int, optional): BLAS threads of each process. Defaults to None, chosen.
+        n_core (int, optional): number of cores. Defaults to None, the cores available to this process.
+
+    Returns:
+        dict: {n_proc, n_thread, n_core}
+    """
+
+    n_core = _set_core_count() if n_core is None else n_core
+    if n_proc is None:
+        n_blas = max(1, min(n_core, n_dim//BLAS_MIN_DIM)) if n_thread is None else n_thread
+        n_proc = max(1, min(n_kpts, n_core//n_blas))
+    if n_thread is None:
+        n_thread = max(1, n_core//n_proc)
+
+    return {'n_proc': n_proc, 'n_thread': n_thread, 'n_core': n_core}
+
+
+def set_shard(n_item: int, shard: tuple) -> np.ndarray:
+    """indices of a shard of k points or jobs, the shards are contiguous and deterministic
+
+    Args:
+        n_item (int): number of k points or jobs
+        shard (tuple): (i, n), the i-th of n shards, 0 <= i < n
+
+    Raises:
+        Exception: i is not in [0, n).
+
+    Returns:
+        np.ndarray: indices of the shard
+    """
+
+    (i, n) = shard
+    if not 0 <= i<n:
+        raise Exception("shard "+str(i)+"/"+str(n)+" is not in [0, "+str(n)+").")
+
+    return np.array_split(np.arange(n_item), n)[i]
+
+
+def _share_array(arr: np.ndarray, shm_list: list) -> dict:
+    """copy an array into a new shared memory block
+
+    Args:
+        arr (np.ndarray): array
+        shm_list (list): shared memory blocks created, for the cleanup
+
+    Returns:
+        dict: {name, shape, dtype} to attach the block
+    """
+
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    shm_list.append(shm)
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+
+    return {'name': shm.name, 'shape': arr.shape, 'dtype': arr.dtype.str}
+
+
+def _share_empty(shape: tuple, dtype, shm_list: list) -> dict:
+    """allocate a zero filled array in a new shared memory block
+
+    Args:
+        shape (tuple): shape of the array
+        dtype: data type of the array
+        shm_list (list): shared memory blocks created, for the cleanup
+
+    Returns:
+        dict: {name, shape, dtype} to attach the block
+    """
+
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape))*dtype.itemsize, 1))
+    shm_list.append(shm)
+    np.ndarray(shape, dtype=dtype, buffer=shm.buf)[...] = 0
+
+    return {'name': shm.name, 'shape': tuple(shape), 'dtype': dtype.str}
+
+
+def _open_file(path: str, shape: tuple, dtype, keep: bool = False) -> np.memmap:
+    """create a .npy file of the given shape mapped into memory, the k points are the leading axis,
+    so the result of a single k point is a contiguous chunk of the file
+
+    Args:
+        path (str): path of the .npy file
+        shape (tuple): shape of the array
+        dtype: data type of the array
+        keep (bool, optional): reopen an existing file of the same shape and data type, e.g. a
+            checkpoint. Defaults to False.
+
+    Returns:
+        np.memmap: writable array backed by the file
+    """
+
+    if keep and os.path.exists(path):
+        arr = np.load(path, mmap_mode='r+')
+        if arr.shape == tuple(shape) and arr.dtype == np.dtype(dtype):
+            return arr
+        del arr
+
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.dtype(dtype), shape=tuple(shape))
+
+
+def _mark_done(done_file: str, k_index):
+    """mark k points as done in a checkpoint, after their results are flushed
+
+    Args:
+        done_file (str): path of the .npy file of the finished k points
+        k_index: indices of the k points
+    """
+
+    done = np.load(done_file, mmap_mode='r+')
+    done[np.asarray(k_index, dtype=int)] = 1
+    done.flush()
+
+
+def _attach_array(spec: dict) -> np.ndarray:
+    """attach an array in shared memory without copying
+
+    Args:
+        spec (dict): {name, shape, dtype} returned by `_share_array`, or {file} of a .npy file
+
+    Returns:
+        np.ndarray: array backed by the shared memory block or the file
+    """
+
+    if 'file' in spec:
+        return np.load(spec['file'], mmap_mode='r+')
+
+    shm = shared_memory.SharedMemory(name=spec['name'])
+    _SHM_LIST.append(shm)
+
+    return np.ndarray(spec['shape'], dtype=np.dtype(spec['dtype']), buffer=shm.buf)
+
+
+def _share_const(const_dict: dict, shm_list: list) -> dict:
+    """place constant arrays in shared memory, csr matrices are shared by their components
+
+    Args:
+        const_dict (dict): name -> np.ndarray, scipy sparse matrix or None
+        shm_list (list): shared memory blocks created, for the cleanup
+
+    Returns:
+        dict: name -> spec of the shared arrays
+    """
+
+    spec_dict = {}
+    for (name, value) in const_dict.items():
+        if value is None:
+            spec_dict[name] = None
+        elif sparse.issparse(value):
+            value = sparse.csr_matrix(value)
+            spec_dict[name] = {
+                'csr': [_share_array(arr, shm_list) for arr in (value.data, value.indices, value.indptr)],
+                'shape': value.shape
+            }
+        else:
+            spec_dict[name] = _share_array(value, shm_list)
+
+    return spec_dict
+
+
+def _init_worker(spec_dict: dict, out_spec_dict: dict, solve_k, params: dict, n_thread: int, done_file: str):
+    """attach the shared arrays once per worker process and limit its BLAS threads
+    """
+
+    # n_proc workers with a full size BLAS thread pool each would oversubscribe the cores
+    threadpool_limits(limits=n_thread)
+    _SHARED.clear()
+    for (name, spec) in spec_dict.items():
+        if spec is None:
+            _SHARED[name] = None
+        elif 'csr' in spec:
+            _SHARED[name] = sparse.csr_matrix(tuple(_attach_array(s) for s in spec['csr']), shape=spec['shape'])
+        else:
+            _SHARED[name] = _attach_array(spec)
+    _WORKER['out'] = {name: _attach_array(spec) for (name, spec) in out_spec_dict.items()}
+    _WORKER['solve_k'] = solve_k
+    _WORKER['params'] = params
+    _WORKER['done'] = done_file
+
+
+def _solve_chunk(chunk: tuple) -> int:
+    """solve a chunk of k points and write the results into the shared output arrays
+
+    Args:
+        chunk (tuple): (k indices, kmesh chunk)
+
+    Returns:
+        int: number of k points solved
+    """
+
+    (k_index, kmesh) = chunk
+    out = _WORKER['out']
+    for (i, k_vec) in zip(k_index, kmesh):
+        ret = _WORKER['solve_k'](_SHARED, k_vec, _WORKER['params'])
+        for (name, value) in ret.items():
+            out[name][i] = value
+    for arr in out.values():
+        if isinstance(arr, np.memmap):
+            arr.flush()
+    if _WORKER['done'] is not None:
+        _mark_done(_WORKER['done'], k_index)
+
+    return kmesh.shape[0]
+
+
+def collect_kmesh(results, n_kpts: int, out_file: dict = None, done_file: str = None, n_save: int = 1) -> dict:
+    """write the results of single k points into arrays allocated once, at the first k point
+
+    Unlike appending to lists and stacking at the end, the results are never held twice. The
+    results named in `out_file` go to memory mapped .npy files, so their memory stays bounded
+    whatever the number of k points. With a `done_file` the files are a checkpoint: existing
+    files are reopened, and every `n_save` k points they are flushed and the k points marked done.
+
+    Args:
+        results: iterable of (k index, {name: value})
+        n_kpts (int): number of k points
+        out_file (dict, optional): name -> path of a .npy file. Defaults to None.
+        done_file (str, optional): path of the .npy file of the finished k points, all results
+            should be in `out_file`. Defaults to None.
+        n_save (int, optional): k points between two checkpoints. Defaults to 1.
+
+    Returns:
+        dict: name -> results of all k points, shape (n_kpts, *shape), read only np.memmap for `out_file`
+    """
+
+    out_file = {} if out_file is None else out_file
+    keep = done_file is not None
+    out = {}
+    pending = []
+    for (i, ret) in results:
+        if not out:
+            for (name, value) in ret.items():
+                (shape, dtype) = ((n_kpts,)+np.shape(value), np.asarray(value).dtype)
+                out[name] = _open_file(out_file[name], shape, dtype, keep) if name in out_file else np.empty(
+                    shape, dtype)
+        for (name, value) in ret.items():
+            out[name][i] = value
+        if keep:
+            pending.append(i)
+        if len(pending) >= n_save:
+            for name in out_file:
+                out[name].flush()
+            _mark_done(done_file, pending)
+            pending = []
+    for name in out:
+        if name in out_file:
+            out[name].flush()
+    if pending:
+        _mark_done(done_file, pending)
+    for (name, path) in out_file.items():
+        # all k points of a resumed checkpoint may be done already
+        if name in out or os.path.exists(path):
+            out[name] = np.load(path, mmap_mode='r')
+
+    return out
+
+
+def collect_bands(bands, n_kpts: int) -> dict:
+    """collect the bands yielded by `moire_tb.iter_bands` or `moire_cont.iter_bands` into preallocated arrays
+
+    Args:
+        bands: iterable of (k index, k vector, eigenvalues, eigenvectors or None)
+        n_kpts (int): number of k points, 3*n_k+1 on the dispersion path or n_k*n_k on the kmesh
+
+    Returns:
+        dict: {emesh, kmesh}, and {dmesh} if the eigenvectors are yielded
+    """
+
+    def to_dict(band):
+        (i, k_vec, eigen_val, eigen_vec) = band
+        ret = {'kmesh': k_vec, 'emesh': eigen_val}
+        if eigen_vec is not None:
+            ret['dmesh'] = eigen_vec
+        return (i, ret)
+
+    return collect_kmesh(map(to_dict, bands), n_kpts)
+
+
+def parallel_kmesh(solve_k,
+                   kmesh: np.ndarray,
+                   const_dict: dict,
+                   params: dict,
+                   n_proc: int,
+                   out_dict: dict = None,
+                   n_thread: int = 1,
+                   chunk_size: int = None,
+                   out_file: dict = None,
+                   k_index: np.ndarray = None,
+                   done_file: str = None) -> dict:
+    """solve the k points on a process pool with the constant matrices in shared memory
+
+    The constant arrays are copied into shared memory once and attached by every worker without
+    copying. Each worker solves contiguous chunks of the kmesh and writes straight into the
+    preallocated output arrays, so the results are in k order.
+
+    Args:
+        solve_k (callable): module level function (shared, k_vec, params) -> {name: value}
+        kmesh (np.ndarray): k points
+        const_dict (dict): name -> np.ndarray, scipy sparse matrix or None shared by all k points
+        params (dict): small picklable parameters of `solve_k`
+        n_proc (int): number of worker processes
+        out_dict (dict, optional): name -> (shape, dtype) of the result of a single k point, None to
+            take them from the first k point solved in the parent process. Defaults to None.
+        n_thread (int, optional): BLAS threads of each worker. Defaults to 1.
+        chunk_size (int, optional): k points per task. Defaults to about 4 tasks per worker.
+        out_file (dict, optional): name -> path of a .npy file the workers write the results into
+            instead of shared memory. Defaults to None.
+        k_index (np.ndarray, optional): indices of the k points solved. Defaults to None, all.
+        done_file (str, optional): path of the .npy file of the finished k points, marked by the
+            workers after each chunk, all results should be in `out_file`. Defaults to None.
+
+    Returns:
+        dict: name -> results of all k points, shape (n_k, *shape), read only np.memmap for `out_file`
+    """
+
+    n_kpts = kmesh.shape[0]
+    out_file = {} if out_file is None else out_file
+    k_index = np.arange(n_kpts) if k_index is None else np.asarray(k_index, dtype=int)
+    keep = done_file is not None
+    if k_index.size == 0:
+        return {name: np.load(path, mmap_mode='r') for (name, path) in out_file.items() if os.path.exists(path)}
+    n_first = 0
+    if out_dict is None:
+        # the outputs depend on the engine and the eigen solver, so take them from a real solve
+        ret_first = solve_k(const_dict, kmesh[k_index[0]], params)
+        out_dict = {name: (np.shape(value), np.asarray(value).dtype) for (name, value) in ret_first.items()}
+        n_first = 1
+    n_todo = k_index.size-n_first
+    n_proc = max(1, min(n_proc, n_todo))
+    chunk_size = max(1, -(-n_todo//(4*n_proc))) if chunk_size is None else chunk_size
+    shm_list = []
+    try:
+        spec_dict = _share_const(const_dict, shm_list)
+        out_spec_dict = {}
+        for (name, (shape, dtype)) in out_dict.items():
+            if name in out_file:
+                arr = _open_file(out_file[name], (n_kpts,)+tuple(shape), dtype, keep)
+                if n_first:
+                    arr[k_index[0]] = ret_first[name]
+                arr.flush()
+                del arr
+                out_spec_dict[name] = {'file': out_file[name]}
+            else:
+                out_spec_dict[name] = _share_empty((n_kpts,)+tuple(shape), dtype, shm_list)
+        if n_first:
+            for (name, value) in ret_first.items():
+                spec = out_spec_dict[name]
+                if 'file' in spec:
+                    continue
+                shm = shared_memory.SharedMemory(name=spec['name'])
+                np.ndarray(spec['shape'], dtype=np.dtype(spec['dtype']), buffer=shm.buf)[k_index[0]] = value
+                shm.close()
+        if n_first and keep:
+            _mark_done(done_file, k_index[:1])
+        chunks = [(k_index[start:start+chunk_size], kmesh[k_index[start:start+chunk_size]])
+                  for start in range(n_first, k_index.size, chunk_size)]
+        with mp.get_context().Pool(n_proc,
+                                   initializer=_init_worker,
+                                   initargs=(spec_dict, out_spec_dict, solve_k, params, n_thread, done_file)) as pool:
+            count = n_first
+            for n_done in pool.imap_unordered(_solve_chunk, chunks):
+                count += n_done
+                print("k sampling process, counter:", count)
+        ret = {}
+        for (name, spec) in out_spec_dict.items():
+            if 'file' in spec:
+                ret[name] = np.load(spec['file'], mmap_mode='r')
+                continue
+            shm = shared_memory.SharedMemory(name=spec['name'])
+            ret[name] = np.array(np.ndarray(spec['shape'], dtype=np.dtype(spec['dtype']), buffer=shm.buf))
+            shm.close()
+    finally:
+        for shm in shm_list:
+            shm.close()
+            shm.unlink()
+
+    return ret
@@ -0,0 +1,131 @@
+import numpy as np
+
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_parallel as mpar
+from mtbmtbg.config import DataType, ValleyType
+
+
+def _solve_path(problem: dict, kmesh: np.ndarray, datatype, band_range: tuple) -> dict:
+    """eigenvalues and the eigenvectors of `band_range` of k points, see `moire_service._solve_batch`"""
+
+    problem = dict(problem, kmesh=kmesh)
+    kpnts = mtb._iter_kpnts(problem, datatype, band_range=band_range)
+
+    return mpar.collect_kmesh(((i, ret) for (i, _, ret) in kpnts), kmesh.shape[0])
+
+
+def set_refine_score(kline: np.ndarray,
+                     emesh: np.ndarray,
+                     dmesh: np.ndarray,
+                     corner: np.ndarray,
+                     tol: float = 1e-3,
+                     ovl_tol: float = 0.9) -> np.ndarray:
+    """refinement score of each interval of a k path, intervals scored above 1 are bisected
+
+    The curvature of the bands is measured at each point as the distance of the energies to the
+    line through the neighbours, in units of `tol`, and charged to both intervals around the point.
+    The path changes direction at the corners, which are not measured. The band character is
+    measured on each interval as the overlap of the eigenvectors of the same band at both ends,
+    which drops at crossings, avoided crossings and degeneracies.
+
+    Args:
+        kline (np.ndarray): increasing positions of the k points on the path
+        emesh (np.ndarray): eigenvalues of the bands checked, one row per k point
+        dmesh (np.ndarray): eigenvectors of the same bands, one per k point
+        corner (np.ndarray): whether the k points are corners of the path
+        tol (float, optional): curvature tolerance (eV). Defaults to 1e-3.
+        ovl_tol (float, optional): overlap tolerance. Defaults to 0.9.
+
+    Returns:
+        np.ndarray: score of each of the len(kline)-1 intervals
+    """
+
+    score = np.zeros(kline.size-1)
+    # deviation of the middle point from the line through the neighbours
+    x = (kline[1:-1]-kline[:-2])/(kline[2:]-kline[:-2])
+    dev = np.max(np.abs(emesh[1:-1]-(1-x[:, None])*emesh[:-2]-x[:, None]*emesh[2:]), axis=1)/tol
+    dev[corner[1:-1]] = 0
+    score[:-1] = np.maximum(score[:-1], dev)
+    score[1:] = np.maximum(score[1:], dev)
+    # overlap of the same band on both ends of each interval
+    ovl = np.min(np.abs(np.einsum('kgb,kgb->kb', dmesh[:-1].conj(), dmesh[1:])), axis=1)
+
+    return np.maximum(score, (1-ovl)/(1-ovl_tol))
+
+
+def adaptive_path_solver(n_moire: int,
+                         n_g: int,
+                         n_k: int = 5,
+                         datatype=DataType.CORRU,
+                         valley=ValleyType.VALLEYK1,
+                         bands: int = 2,
+                         tol: float = 1e-3,
+                         ovl_tol: float = 0.9,
+                         max_kpts: int = 200,
+                         max_level: int = 5,
+                         session=None) -> dict:
+    """TBPLW bands on the K1 - Gamma - M - K2 path, refined where the bands need it
+
+    The path starts with `n_k` points per segment, see `moire_gk.set_tb_disp_kmesh`. Each round
+    the intervals scored above 1 by `set_refine_score` on the `bands` bands above and below charge
+    neutrality are bisected, the highest scores first, until no interval is flagged, `max_kpts`
+    k points are solved or the intervals are `max_level` times bisected. The bands are plotted with
+    the corners of the path:
+
+        ret = adaptive_path_solver(30, 5)
+        band_plot_module(ax, ret['kline'], ret['emesh'], 0, 2, corners=ret['corners'])
+
+    Args:
+        n_moire (int): an integer describing the size of commensurate TBG systems
+        n_g (int): Glist size
+        n_k (int, optional): initial number of k points on each segment. Defaults to 5.
+        datatype (DataType, optional): atom data type. Defaults to DataType.CORRU.
+        valley (ValleyType, optional): valley. Defaults to ValleyType.VALLEYK1.
+        bands (int, optional): number of bands above or below charge neutrality checked. Defaults to 2.
+        tol (float, optional): curvature tolerance (eV), see `set_refine_score`. Defaults to 1e-3.
+        ovl_tol (float, optional): overlap tolerance, see `set_refine_score`. Defaults to 0.9.
+        max_kpts (int, optional): budget of k points. Defaults to 200.
+        max_level (int, optional): maximum number of bisections of an initial interval. Defaults to 5.
+        session (MoireSession, optional): session of `n_moire` and `datatype`. Defaults to None.
+
+    Returns:
+        dict: {emesh, dmesh: eigenvectors of the checked bands, kline, kmesh, corners: indices of
+            K1, Gamma, M and K2 in kline}
+    """
+
+    structure = None if session is None else session.get_structure(n_moire, datatype)
+    problem = mtb._set_tb_problem(n_moire, n_g, n_k, True, datatype, valley, structure=structure)
+    n_band = problem['n_band']
+    band_range = (n_band//2-bands, n_band//2+bands)
+
+    (kline, kmesh) = (problem['kline'], problem['kmesh'])
+    corner = np.zeros(kline.size, dtype=bool)
+    corner[::n_k] = True
+    min_dk = np.min(np.diff(kline))/2**max_level
+    ret = _solve_path(problem, kmesh, datatype, band_range)
+    (emesh, dmesh) = (ret['emesh'], ret['dmesh'])
+    n_round = 0
+    while kline.size<max_kpts:
+        score = set_refine_score(kline, emesh[:, band_range[0]:band_range[1]], dmesh, corner, tol, ovl_tol)
+        score[np.diff(kline)<2*min_dk] = 0
+        flagged = np.flatnonzero(score>1)
+        if flagged.size == 0:
+            break
+        flagged = np.sort(flagged[np.argsort(-score[flagged], kind='stable')][:max_kpts-kline.size])
+        new_k = (kmesh[flagged]+kmesh[flagged+1])/2
+        ret = _solve_path(problem, new_k, datatype, band_range)
+        # the midpoint of the interval i goes after the point i
+        pos = flagged+1
+        kline = np.insert(kline, pos, (kline[flagged]+kline[flagged+1])/2)
+        kmesh = np.insert(kmesh, pos, new_k, axis=0)
+        corner = np.insert(corner, pos, False)
+        emesh = np.insert(emesh, pos, ret['emesh'], axis=0)
+        dmesh = np.insert(dmesh, pos, ret['dmesh'], axis=0)
+        n_round += 1
+
+    print("="*100)
+    print("num of kpoints".ljust(30), ":", kline.size)
+    print("num of refinement rounds".ljust(30), ":", n_round)
+    print("="*100)
+
+    return {'emesh': emesh, 'dmesh': dmesh, 'kline': kline, 'kmesh': kmesh, 'corners': np.flatnonzero(corner)}
@@ -8,6 +8,9 @@ import matplotlib.pyplot as plt
 
 import mtbmtbg.moire_setup as mset
 import mtbmtbg.moire_gk as mgk
+import mtbmtbg.moire_eigen as meig
+import mtbmtbg.moire_parallel as mpar
+from threadpoolctl import threadpool_limits
 from mtbmtbg.config import EngineType, ValleyType, Phonon
 
 
@@ -159,10 +162,12 @@ def _cal_dynamic_k(k_vec: np.ndarray,
         return dynamic_k.todense()
 
 
-def _cal_eigen_dynamick(dynamic_k, engine=EngineType.TBPLW):
+def _cal_eigen_dynamick(dynamic_k, engine=EngineType.TBPLW, backend=None):
 
     w = 0
-    if engine == EngineType.TBFULL:
+    if backend is not None:
+        v, w = meig.eigh(np.asarray(dynamic_k), backend=backend)
+    elif engine == EngineType.TBFULL:
         v, _ = np.linalg.eigh(dynamic_k)
     elif engine == EngineType.TBPLW:
         v, w = np.linalg.eigh(dynamic_k)
@@ -170,7 +175,14 @@ def _cal_eigen_dynamick(dynamic_k, engine=EngineType.TBPLW):
     return v, w
 
 
-def phonon_solver(n_moire: int, n_g: int, n_k: int, engine=EngineType.TBPLW, valley=ValleyType.VALLEYK1):
+def phonon_solver(n_moire: int,
+                  n_g: int,
+                  n_k: int,
+                  engine=EngineType.TBPLW,
+                  valley=ValleyType.VALLEYK1,
+                  backend=None,
+                  n_thread: int = None,
+                  shard: tuple = None):
 
     atom_pstn_list = np.loadtxt('rigid_atom6_origin.csv')
 
@@ -183,16 +195,26 @@ def phonon_solver(n_moire: int, n_g: int, n_k: int, engine=EngineType.TBPLW, val
     ndist_dict = _set_relative_dis(atom_pstn_list, m_basis_vecs, npair_dict)
     gr_mtrx = _set_gr_mtrx(n_moire, npair_dict, g_vec_list, atom_pstn_list)
     kline, kmesh = mgk.set_tb_disp_kmesh(n_k, high_symm_pnts)
+    if shard is not None:
+        kmesh = kmesh[mpar.set_shard(kmesh.shape[0], shard)]
 
     n_atom = atom_pstn_list.shape[0]
     emesh = []
-
-    for k_vec in kmesh:
-        print(k_vec.shape)
-        dynamick = _cal_dynamic_k(k_vec, ndist_dict, npair_dict, n_atom, fc, gr_mtrx, engine)
-        eig_val, eig_vec = np.linalg.eigh(dynamick)
-        print(eig_val)
-        emesh.append(np.sqrt(eig_val)*Phonon.VaspToTHz)
+    # the k points are solved in this process, all cores go to BLAS unless `n_thread` is given
+    n_dim = gr_mtrx.shape[0] if engine == EngineType.TBPLW else 3*n_atom
+    schedule = mpar.set_schedule(n_dim, kmesh.shape[0], 1, mpar.N_THREAD if n_thread is None else n_thread)
+    print("processes x BLAS threads:", schedule['n_proc'], "x", schedule['n_thread'], "on", schedule['n_core'], "cores")
+
+    with threadpool_limits(limits=schedule['n_thread']):
+        for k_vec in kmesh:
+            print(k_vec.shape)
+            dynamick = _cal_dynamic_k(k_vec, ndist_dict, npair_dict, n_atom, fc, gr_mtrx, engine)
+            if backend is None:
+                eig_val, eig_vec = np.linalg.eigh(dynamick)
+            else:
+                eig_val, eig_vec = _cal_eigen_dynamick(dynamick, engine, backend)
+            print(eig_val)
+            emesh.append(np.sqrt(eig_val)*Phonon.VaspToTHz)
 
     return kline, np.array(emesh)
 
@@ -2,6 +2,8 @@ import mtbmtbg.moire_tb as mtb
 import mtbmtbg.moire_cont as mcont
 import mtbmtbg.moire_setup as mset
 import mtbmtbg.moire_analysis as manal
+import mtbmtbg.moire_cache as mcache
+import mtbmtbg.moire_valley as mval
 from mtbmtbg.config import DataType, EngineType, ValleyType
 
 import matplotlib.pyplot as plt
@@ -10,6 +12,32 @@ import numpy as np
 import pybinding as pb
 
 
+def _cached_bands(solver, *args, **kwargs) -> dict:
+    """bands of a solver call, cached by `moire_cache` without the eigenvectors
+
+    Returns:
+        dict: {emesh, kline}
+    """
+
+    return mcache.cached_call(solver, *args, keep=('emesh', 'kline'), **kwargs)
+
+
+def _cached_sepv_bands(n_moire: int, n_g: int, n_k: int, datatype: str) -> dict:
+    """TBPLW bands of both valleys from a single VALLEYK1 solve, see `moire_valley.valley_solver`
+
+    Returns:
+        dict: {emesh, emesh_k2, kline}
+    """
+
+    return mcache.cached_call(mval.valley_solver,
+                              n_moire,
+                              n_g,
+                              n_k,
+                              True,
+                              datatype,
+                              keep=('emesh', 'emesh_k2', 'kline'))
+
+
 def chemical_potential(emesh: np.ndarray) -> float:
     """determine the feimi energy for an insulator
 
@@ -37,7 +65,8 @@ def band_plot_module(ax: plt.axes,
                      color: str = "blue",
                      alpha: float = 1,
                      figname: str = "",
-                     mu: bool = False):
+                     mu: bool = False,
+                     corners: tuple = None):
     """plot module for TBG
 
     Args:
@@ -48,16 +77,17 @@ def band_plot_module(ax: plt.axes,
         bands (int): number of bands plotted above or below fermi energy
         shape (str, optional): shape. Defaults to "-".
         color (str, optional): color. Defaults to "blue".
+        corners (tuple, optional): indices of K, Gamma, M and K' in kline, e.g. of a non uniform path
+            of `moire_path.adaptive_path_solver`. Defaults to None, (0, n_k, 2*n_k, 3*n_k).
     """
 
-    ax.set_xticks([kline[0], kline[n_k], kline[2*n_k], kline[3*n_k]])
+    corners = (0, n_k, 2*n_k, 3*n_k) if corners is None else corners
+    ax.set_xticks([kline[i] for i in corners])
     ax.set_xticklabels([r"$\bar{K}$", r"$\bar{\Gamma}$", r"$\bar{M}$", r"$\bar{K}^\prime$"])
     ax.set_xlim(0, kline[-1])
     ax.set_ylabel("Engergy (eV)")
-    ax.axvline(x=kline[0], color="black")
-    ax.axvline(x=kline[n_k], color="black")
-    ax.axvline(x=kline[2*n_k], color="black")
-    ax.axvline(x=kline[3*n_k], color="black")
+    for i in corners:
+        ax.axvline(x=kline[i], color="black")
 
     n_band = emesh[0].shape[0]
     for i in range(bands):
@@ -97,7 +127,7 @@ def glist_plot_module(ax: plt.axes, glist: np.ndarray, val: np.ndarray, figname:
 
 def tb_plot_sparsetb(n_moire: int, n_g: int, n_k: int, bands: int, datatype: str, pathname="./", figname="", mu=False):
     fig, ax = plt.subplots()
-    ret = mtb.tb_solver(n_moire, n_g, n_k, True, datatype, engine=EngineType.TBSPARSE)
+    ret = _cached_bands(mtb.tb_solver, n_moire, n_g, n_k, True, datatype, engine=EngineType.TBSPARSE)
     emesh = ret['emesh']
     kline = ret['kline']
     band_plot_module(ax, kline, emesh, n_k, bands, shape='.', figname=figname, mu=mu)
@@ -108,7 +138,7 @@ def tb_plot_sparsetb(n_moire: int, n_g: int, n_k: int, bands: int, datatype: str
 
 def tb_plot_fulltb(n_moire: int, n_g: int, n_k: int, bands: int, datatype: str, pathname="./", figname="", mu=False):
     fig, ax = plt.subplots()
-    ret = mtb.tb_solver(n_moire, n_g, n_k, True, datatype, engine=EngineType.TBFULL)
+    ret = _cached_bands(mtb.tb_solver, n_moire, n_g, n_k, True, datatype, engine=EngineType.TBFULL)
     emesh = ret['emesh']
     kline = ret['kline']
     band_plot_module(ax, kline, emesh, n_k, bands, figname=figname, mu=mu)
@@ -120,14 +150,10 @@ def tb_plot_fulltb(n_moire: int, n_g: int, n_k: int, bands: int, datatype: str,
 def tb_plot_tbplw_sepv(n_moire: int, n_g: int, n_k: int, bands: int, datatype: str, pathname="./", figname="",
                        mu=False):
     fig, ax = plt.subplots()
-    ret = mtb.tb_solver(n_moire, n_g, n_k, True, datatype, valley=ValleyType.VALLEYK1)
-    emesh = ret['emesh']
-    kline = ret['kline']
-    band_plot_module(ax, kline, emesh, n_k, bands, figname=figname, mu=mu)
-    ret = mtb.tb_solver(n_moire, n_g, n_k, True, datatype, valley=ValleyType.VALLEYK2)
-    emesh = ret['emesh']
+    ret = _cached_sepv_bands(n_moire, n_g, n_k, datatype)
     kline = ret['kline']
-    band_plot_module(ax, kline, emesh, n_k, bands, figname=figname, mu=mu)
+    band_plot_module(ax, kline, ret['emesh'], n_k, bands, figname=figname, mu=mu)
+    band_plot_module(ax, kline, ret['emesh_k2'], n_k, bands, figname=figname, mu=mu)
     plt.tight_layout()
     plt.savefig(pathname+"moire_"+str(n_moire)+"_"+datatype+"_tbplw_sepv.png", dpi=500)
     plt.close()
@@ -142,7 +168,7 @@ def tb_plot_tbplw_combv(n_moire: int,
                         figname="",
                         mu=False):
     fig, ax = plt.subplots()
-    ret = mtb.tb_solver(n_moire, n_g, n_k, True, datatype, valley=ValleyType.VALLEYC)
+    ret = _cached_bands(mtb.tb_solver, n_moire, n_g, n_k, True, datatype, valley=ValleyType.VALLEYC)
     emesh = ret['emesh']
     kline = ret['kline']
     band_plot_module(ax, kline, emesh, n_k, bands, figname=figname, mu=mu)
@@ -161,15 +187,11 @@ def fulltb_sepv_cmp(n_moire: int,
                     pathname="./",
                     figname=""):
     fig, ax = plt.subplots()
-    ret = mtb.tb_solver(n_moire, n_g, n_k1, True, datatype, valley=ValleyType.VALLEYK1)
-    emesh = ret['emesh']
-    kline = ret['kline']
-    band_plot_module(ax, kline, emesh, n_k1, band1, figname=figname)
-    ret = mtb.tb_solver(n_moire, n_g, n_k1, True, datatype, valley=ValleyType.VALLEYK2)
-    emesh = ret['emesh']
+    ret = _cached_sepv_bands(n_moire, n_g, n_k1, datatype)
     kline = ret['kline']
-    band_plot_module(ax, kline, emesh, n_k1, band1, figname=figname)
-    ret = mtb.tb_solver(n_moire, n_g, n_k2, True, datatype, engine=EngineType.TBFULL)
+    band_plot_module(ax, kline, ret['emesh'], n_k1, band1, figname=figname)
+    band_plot_module(ax, kline, ret['emesh_k2'], n_k1, band1, figname=figname)
+    ret = _cached_bands(mtb.tb_solver, n_moire, n_g, n_k2, True, datatype, engine=EngineType.TBFULL)
     emesh = ret['emesh']
     kline = ret['kline']
     band_plot_module(ax, kline, emesh, n_k2, band2, shape='.', color='red', alpha=0.5, figname=figname)
@@ -188,11 +210,11 @@ def fulltb_combv_cmp(n_moire: int,
                      pathname="./",
                      figname=""):
     fig, ax = plt.subplots()
-    ret = mtb.tb_solver(n_moire, n_g, n_k1, True, datatype, valley=ValleyType.VALLEYC)
+    ret = _cached_bands(mtb.tb_solver, n_moire, n_g, n_k1, True, datatype, valley=ValleyType.VALLEYC)
     emesh = ret['emesh']
     kline = ret['kline']
     band_plot_module(ax, kline, emesh, n_k1, band1, figname=figname)
-    ret = mtb.tb_solver(n_moire, n_g, n_k2, True, datatype, engine=EngineType.TBFULL)
+    ret = _cached_bands(mtb.tb_solver, n_moire, n_g, n_k2, True, datatype, engine=EngineType.TBFULL)
     emesh = ret['emesh']
     kline = ret['kline']
     band_plot_module(ax, kline, emesh, n_k2, band2, shape='.', color='red', alpha=0.5, figname=figname)
@@ -211,15 +233,11 @@ def sparsetb_sepv_cmp(n_moire: int,
                       pathname="./",
                       figname=""):
     fig, ax = plt.subplots()
-    ret = mtb.tb_solver(n_moire, n_g, n_k1, True, datatype, valley=ValleyType.VALLEYK1)
-    emesh = ret['emesh']
+    ret = _cached_sepv_bands(n_moire, n_g, n_k1, datatype)
     kline = ret['kline']
-    band_plot_module(ax, kline, emesh, n_k1, band1, figname=figname)
-    ret = mtb.tb_solver(n_moire, n_g, n_k1, True, datatype, valley=ValleyType.VALLEYK2)
-    emesh = ret['emesh']
-    kline = ret['kline']
-    band_plot_module(ax, kline, emesh, n_k1, band1, figname=figname)
-    ret = mtb.tb_solver(n_moire, n_g, n_k2, True, datatype, engine=EngineType.TBSPARSE)
+    band_plot_module(ax, kline, ret['emesh'], n_k1, band1, figname=figname)
+    band_plot_module(ax, kline, ret['emesh_k2'], n_k1, band1, figname=figname)
+    ret = _cached_bands(mtb.tb_solver, n_moire, n_g, n_k2, True, datatype, engine=EngineType.TBSPARSE)
     emesh = ret['emesh']
     kline = ret['kline']
     band_plot_module(ax, kline, emesh, n_k2, band2, shape='.', color='red', alpha=0.5, figname=figname)
@@ -238,11 +256,11 @@ def sparsetb_combv_cmp(n_moire: int,
                        pathname="./",
                        figname=""):
     fig, ax = plt.subplots()
-    ret = mtb.tb_solver(n_moire, n_g, n_k1, True, datatype, valley=ValleyType.VALLEYC)
+    ret = _cached_bands(mtb.tb_solver, n_moire, n_g, n_k1, True, datatype, valley=ValleyType.VALLEYC)
     emesh = ret['emesh']
     kline = ret['kline']
     band_plot_module(ax, kline, emesh, n_k1, band1, figname=figname)
-    ret = mtb.tb_solver(n_moire, n_g, n_k2, True, datatype, engine=EngineType.TBSPARSE)
+    ret = _cached_bands(mtb.tb_solver, n_moire, n_g, n_k2, True, datatype, engine=EngineType.TBSPARSE)
     emesh = ret['emesh']
     kline = ret['kline']
     band_plot_module(ax, kline, emesh, n_k2, band2, shape='.', color='red', alpha=0.5, figname=figname)
@@ -304,14 +322,11 @@ def cont_plot_combv(
         figname="",
 ):
     fig, ax = plt.subplots()
-    ret = mcont.cont_solver(n_moire, n_g, n_k, valley=1)
-    emesh = ret['emesh']
-    kline = ret['kline']
-    band_plot_module(ax, kline, emesh, n_k, bands, figname=figname)
-    ret = mcont.cont_solver(n_moire, n_g, n_k, valley=-1)
-    emesh = ret['emesh']
+    # the valley -1 is mapped from the valley 1 by time reversal
+    ret = mcache.cached_call(mval.cont_valley_solver, n_moire, n_g, n_k, keep=('emesh', 'emesh_k2', 'kline'))
     kline = ret['kline']
-    band_plot_module(ax, kline, emesh, n_k, bands, figname=figname)
+    band_plot_module(ax, kline, ret['emesh'], n_k, bands, figname=figname)
+    band_plot_module(ax, kline, ret['emesh_k2'], n_k, bands, figname=figname)
     plt.savefig(pathname+"moire_"+str(n_moire)+"_"+"_cont_combv.png", dpi=500)
     plt.close()
 
@@ -0,0 +1,223 @@
+import json
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import mtbmtbg.moire_gk as mgk
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_parallel as mpar
+from mtbmtbg.moire_session import MoireSession
+from mtbmtbg.config import DataType, ValleyType
+
+
+def _solve_batch(session: MoireSession, n_g: int, valley, kmesh: np.ndarray) -> np.ndarray:
+    """TBPLW eigenvalues of arbitrary k points of a session structure
+
+    Args:
+        session (MoireSession): warm structure
+        n_g (int): Glist size
+        valley (ValleyType): valley
+        kmesh (np.ndarray): k points
+
+    Returns:
+        np.ndarray: eigenvalues, one row per k point
+    """
+
+    structure = session.get_structure(session.n_moire, session.datatype)
+    problem = mtb._set_tb_problem(session.n_moire, n_g, 1, False, session.datatype, valley, structure=structure)
+    problem['kmesh'] = kmesh
+    kpnts = mtb._iter_kpnts(problem, session.datatype, band_range=(0, 0))
+
+    return mpar.collect_kmesh(((i, ret) for (i, _, ret) in kpnts), kmesh.shape[0])['emesh']
+
+
+class MoireService:
+    """long-lived asyncio front end of the TBPLW solvers
+
+    The setups of the structures used last are kept warm as `MoireSession`s, the numeric work
+    runs in an executor, and the `bands` requests of the same structure made while a batch is
+    being collected are solved together as one k point list:
+
+        service = MoireService()
+        (ret1, ret2) = await asyncio.gather(service.bands(30, 5, kpnts1), service.bands(30, 5, kpnts2))
+        dos = await service.dos(30, 5, 20)
+        mpot = await service.run(manalysis.analyze_moire_potential, 30, 5)
+    """
+
+    def __init__(self, max_sessions: int = 4, max_workers: int = 1, batch_delay: float = 0.0):
+        """
+        Args:
+            max_sessions (int, optional): number of structures kept warm. Defaults to 4.
+            max_workers (int, optional): executor threads. Defaults to 1.
+            batch_delay (float, optional): seconds a batch waits for more requests, 0 collects
+                the requests of the same event loop iteration, e.g. of one `asyncio.gather`. Defaults to 0.0.
+        """
+
+        self.max_sessions = max_sessions
+        self.batch_delay = batch_delay
+        self.executor = ThreadPoolExecutor(max_workers)
+        # (n_moire, datatype) -> MoireSession, the least recently used first
+        self.sessions = OrderedDict()
+        # (n_moire, datatype, n_g, valley) -> [(kmesh, future)] of the batch being collected
+        self._pending = {}
+        # number of batches solved
+        self.n_batch = 0
+
+    def get_session(self, n_moire: int, n_g: int, datatype=DataType.CORRU, valley=ValleyType.VALLEYK1) -> MoireSession:
+        """warm session of a structure, the least recently used one is dropped beyond `max_sessions`
+
+        Returns:
+            MoireSession: session of (n_moire, datatype)
+        """
+
+        key = (n_moire, datatype)
+        if key in self.sessions:
+            self.sessions.move_to_end(key)
+        else:
+            self.sessions[key] = MoireSession(n_moire, n_g, datatype, valley)
+            if len(self.sessions)>self.max_sessions:
+                self.sessions.popitem(last=False)
+
+        return self.sessions[key]
+
+    async def run(self, func, n_moire: int, n_g: int, *args, datatype=DataType.CORRU, **kwargs):
+        """run a solver or analysis function taking `session` in the executor
+
+        Args:
+            func (callable): e.g. `moire_tb.tb_solver` or `moire_analysis.analyze_moire_potential`
+            n_moire (int): an integer describing the size of commensurate TBG systems
+            n_g (int): Glist size
+            args, kwargs: other arguments of `func`
+            datatype (DataType, optional): atom data type. Defaults to DataType.CORRU.
+
+        Returns:
+            the result of `func`
+        """
+
+        session = self.get_session(n_moire, n_g, datatype)
+        call = lambda: func(n_moire, n_g, *args, datatype=datatype, session=session, **kwargs)
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    async def bands(self,
+                    n_moire: int,
+                    n_g: int,
+                    kpnts: np.ndarray,
+                    datatype=DataType.CORRU,
+                    valley=ValleyType.VALLEYK1) -> np.ndarray:
+        """TBPLW eigenvalues of k points, batched with the concurrent requests of the same structure
+
+        Args:
+            n_moire (int): an integer describing the size of commensurate TBG systems
+            n_g (int): Glist size
+            kpnts (np.ndarray): k points, one per row
+            datatype (DataType, optional): atom data type. Defaults to DataType.CORRU.
+            valley (ValleyType, optional): valley. Defaults to ValleyType.VALLEYK1.
+
+        Returns:
+            np.ndarray: eigenvalues, one row per k point
+        """
+
+        key = (n_moire, datatype, n_g, valley)
+        future = asyncio.get_running_loop().create_future()
+        if key not in self._pending:
+            self._pending[key] = []
+            asyncio.ensure_future(self._flush(key))
+        self._pending[key].append((np.atleast_2d(np.asarray(kpnts, dtype=float)), future))
+
+        return await future
+
+    async def _flush(self, key: tuple):
+        """solve a batch of `bands` requests as one k point list"""
+
+        await asyncio.sleep(self.batch_delay)
+        batch = self._pending.pop(key)
+        (n_moire, datatype, n_g, valley) = key
+        kmesh = np.concatenate([kpnts for (kpnts, _) in batch])
+        session = self.get_session(n_moire, n_g, datatype, valley)
+        self.n_batch += 1
+        try:
+            emesh = await asyncio.get_running_loop().run_in_executor(self.executor, _solve_batch, session, n_g, valley,
+                                                                     kmesh)
+        except Exception as err:
+            for (_, future) in batch:
+                future.set_exception(err)
+            return
+        start = 0
+        for (kpnts, future) in batch:
+            future.set_result(emesh[start:start+kpnts.shape[0]])
+            start += kpnts.shape[0]
+
+    async def dos(self,
+                  n_moire: int,
+                  n_g: int,
+                  n_k: int,
+                  datatype=DataType.CORRU,
+                  valley=ValleyType.VALLEYK1,
+                  n_bin: int = 100) -> dict:
+        """density of states from the bands of an n_k*n_k mesh, see `moire_gk.set_kmesh_dos`
+
+        Args:
+            n_moire (int): an integer describing the size of commensurate TBG systems
+            n_g (int): Glist size
+            n_k (int): n_k*n_k k points
+            datatype (DataType, optional): atom data type. Defaults to DataType.CORRU.
+            valley (ValleyType, optional): valley. Defaults to ValleyType.VALLEYK1.
+            n_bin (int, optional): number of energy bins. Defaults to 100.
+
+        Returns:
+            dict: {energy: bin centers, dos: normalized histogram of the eigenvalues}
+        """
+
+        session = self.get_session(n_moire, n_g, datatype, valley)
+        kmesh = mgk.set_kmesh_dos(n_k, session.structure['m_basis_vecs'])
+        emesh = await self.bands(n_moire, n_g, kmesh, datatype, valley)
+        (dos, edges) = np.histogram(emesh.ravel(), bins=n_bin, density=True)
+
+        return {'energy': (edges[1:]+edges[:-1])/2, 'dos': dos}
+
+    async def _handle(self, reader, writer):
+        """answer the json requests of a connection, one per line"""
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                job = request.pop('job')
+                if job == 'bands':
+                    ret = {'emesh': await self.bands(**request)}
+                elif job == 'dos':
+                    ret = await self.dos(**request)
+                else:
+                    raise Exception("unknown job "+str(job)+", use bands or dos.")
+                reply = {name: np.asarray(value).tolist() for (name, value) in ret.items()}
+            except Exception as err:
+                reply = {'error': str(err)}
+            writer.write((json.dumps(reply)+'\n').encode())
+            await writer.drain()
+        writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 0):
+        """expose `bands` and `dos` on a local socket, one json request per line, e.g.
+
+            {"job": "bands", "n_moire": 30, "n_g": 5, "kpnts": [[0.0, 0.0]]}
+
+        is answered by {"emesh": [[...]]}, and a failed request by {"error": message}.
+
+        Args:
+            host (str, optional): host. Defaults to '127.0.0.1'.
+            port (int, optional): port. Defaults to 0, a free one.
+
+        Returns:
+            asyncio.Server: the server, its port is server.sockets[0].getsockname()[1]
+        """
+
+        return await asyncio.start_server(self._handle, host, port)
+
+    def close(self):
+        """shut the executor down"""
+
+        self.executor.shutdown()
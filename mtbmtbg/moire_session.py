@@ -0,0 +1,71 @@
+import mtbmtbg.moire_tb as mtb
+from mtbmtbg.config import DataType, ValleyType, PrecisionType
+
+
+class MoireSession:
+    """setup of a moire structure shared by solver and analysis calls
+
+    The atoms, the neighbour pairs and the constant matrices of each (n_g, valley) are built
+    on first use and kept, so computing bands, moire potentials and chern numbers of one
+    structure pays for the setup once:
+
+        session = MoireSession(30, 5)
+        ret = mtb.tb_solver(30, 5, 10, session=session)
+        mpot = manalysis.analyze_moire_potential(30, 5, session=session)
+    """
+
+    def __init__(self, n_moire: int, n_g: int, datatype=DataType.CORRU, valley=ValleyType.VALLEYK1):
+        """
+        Args:
+            n_moire (int): an integer describing the size of commensurate TBG systems
+            n_g (int): default Glist size of the constant matrices
+            datatype (DataType, optional): atom data type. Defaults to DataType.CORRU.
+            valley (ValleyType, optional): default valley of the constant matrices. Defaults to ValleyType.VALLEYK1.
+        """
+
+        self.n_moire = n_moire
+        self.n_g = n_g
+        self.datatype = datatype
+        self.valley = valley
+        self._structure = None
+
+    @property
+    def structure(self) -> dict:
+        """atoms and pairs, see `moire_tb._set_tb_structure`"""
+
+        if self._structure is None:
+            self._structure = mtb._set_tb_structure(self.n_moire, self.datatype)
+
+        return self._structure
+
+    def get_structure(self, n_moire: int, datatype) -> dict:
+        """structure of a call for `n_moire` and `datatype`
+
+        Raises:
+            Exception: the session is built for another structure.
+
+        Returns:
+            dict: atoms and pairs
+        """
+
+        if (n_moire, datatype) != (self.n_moire, self.datatype):
+            raise Exception("session of "+str((self.n_moire, self.datatype))+" used for "+str((n_moire, datatype))+".")
+
+        return self.structure
+
+    def get_const(self, n_g: int = None, valley=None, precision=PrecisionType.DOUBLE) -> dict:
+        """constant matrices, see `moire_tb._set_tb_const`
+
+        Args:
+            n_g (int, optional): Glist size. Defaults to None, the one of the session.
+            valley (ValleyType, optional): valley. Defaults to None, the one of the session.
+            precision (PrecisionType, optional): precision. Defaults to PrecisionType.DOUBLE.
+
+        Returns:
+            dict: {const, nbmap, glist, o_glist, n_band}
+        """
+
+        n_g = self.n_g if n_g is None else n_g
+        valley = self.valley if valley is None else valley
+
+        return mtb._set_tb_const(self.structure, self.n_moire, n_g, valley, precision)
@@ -0,0 +1,181 @@
+import ast
+import argparse
+import importlib
+import numpy as np
+
+import mtbmtbg.moire_parallel as mpar
+import mtbmtbg.moire_checkpoint as mckpt
+
+# solvers split by k points: name -> (module, function), imported when a shard is run
+SHARD_SOLVERS = {
+    'tb': ('mtbmtbg.moire_tb', 'tb_solver'),
+    'cont': ('mtbmtbg.moire_cont', 'cont_solver'),
+    'phonon': ('mtbmtbg.moire_phonon', 'phonon_solver'),
+}
+# results with one row per k point, the other results are the same in all shards
+KMESH_RESULTS = ('emesh', 'dmesh', 'resid', 'coupling')
+# phonon_solver returns (kline, emesh)
+TUPLE_RESULTS = {'phonon': ('kline', 'emesh')}
+
+
+def parse_shard(text: str) -> tuple:
+    """parse a shard 'i/n'
+
+    Args:
+        text (str): 'i/n', the i-th of n shards
+
+    Returns:
+        tuple: (i, n)
+    """
+
+    (i, n) = text.split('/')
+
+    return (int(i), int(n))
+
+
+def shard_jobs(jobs: list, shard: tuple) -> list:
+    """jobs of a parameter grid run by a shard
+
+    Args:
+        jobs (list): all jobs, in the same order on every shard
+        shard (tuple): (i, n), the i-th of n shards
+
+    Returns:
+        list: jobs of the shard
+    """
+
+    return [jobs[i] for i in mpar.set_shard(len(jobs), shard)]
+
+
+def _set_n_kpts(solver: str, kwargs: dict) -> int:
+    """number of k points of a solver call, 3*n_k+1 on the dispersion path or n_k*n_k on the kmesh"""
+
+    n_k = kwargs['n_k']
+    if solver == 'phonon' or kwargs.get('disp', True):
+        return 3*n_k+1
+
+    return n_k*n_k
+
+
+def run_shard(solver: str, shard: tuple, path: str, **kwargs) -> dict:
+    """run a shard of the k points of a solver and save it for `merge_shards`
+
+    Args:
+        solver (str): name in SHARD_SOLVERS
+        shard (tuple): (i, n), the i-th of n shards
+        path (str): .npz file of the shard
+        kwargs: arguments of the solver
+
+    Returns:
+        dict: results of the shard
+    """
+
+    (module, func) = SHARD_SOLVERS[solver]
+    ret = getattr(importlib.import_module(module), func)(shard=shard, **kwargs)
+    if solver in TUPLE_RESULTS:
+        ret = dict(zip(TUPLE_RESULTS[solver], ret))
+    n_kpts = _set_n_kpts(solver, kwargs)
+    key = mckpt.set_input_key(dict(kwargs, solver=solver))
+    np.savez(path,
+             key=key,
+             shard=np.array(shard),
+             n_kpts=n_kpts,
+             kidx=mpar.set_shard(n_kpts, shard),
+             solver=solver,
+             **ret)
+
+    return ret
+
+
+def _merge_shards(paths: list) -> tuple:
+    """merge the shards saved by `run_shard`
+
+    Raises:
+        Exception: the shards were run with other inputs.
+        Exception: shards are missing or repeated.
+
+    Returns:
+        tuple: (solver name, merged results)
+    """
+
+    shards = [dict(np.load(path)) for path in paths]
+    shards.sort(key=lambda ret: int(ret['shard'][0]))
+    first = shards[0]
+    for ret in shards:
+        if str(ret['key']) != str(first['key']):
+            raise Exception("shards were run with other inputs: "+str(ret['key'])+" != "+str(first['key'])+".")
+    n_shard = int(first['shard'][1])
+    if [tuple(ret['shard']) for ret in shards] != [(i, n_shard) for i in range(n_shard)]:
+        raise Exception("shards are missing or repeated, found "+str([tuple(ret['shard']) for ret in shards])+".")
+
+    n_kpts = int(first['n_kpts'])
+    names = [name for name in first if name not in ('key', 'shard', 'n_kpts', 'kidx', 'solver')]
+    merged = {}
+    for name in names:
+        if name in KMESH_RESULTS:
+            value = first[name]
+            merged[name] = np.empty((n_kpts,)+value.shape[1:], dtype=value.dtype)
+            for ret in shards:
+                merged[name][ret['kidx']] = ret[name]
+        else:
+            # scalars such as kline = 0 come back as 0-d arrays
+            merged[name] = first[name].item() if first[name].ndim == 0 else first[name]
+
+    return (str(first['solver']), merged)
+
+
+def merge_shards(paths: list):
+    """merge the shards saved by `run_shard` into the result of a single solver call
+
+    Args:
+        paths (list): .npz files of all shards, in any order
+
+    Raises:
+        Exception: the shards were run with other inputs.
+        Exception: shards are missing or repeated.
+
+    Returns:
+        the result of the solver, a dict or a tuple for phonon_solver
+    """
+
+    (solver, merged) = _merge_shards(paths)
+    if solver in TUPLE_RESULTS:
+        return tuple(merged[name] for name in TUPLE_RESULTS[solver])
+
+    return merged
+
+
+def _parse_value(text: str):
+    """python literal of a command line value, the string itself otherwise, e.g. DataType values"""
+
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def main(argv: list = None):
+    """command line entry
+
+        python -m mtbmtbg.moire_shard tb --shard 0/4 --out shard0.npz n_moire=30 n_g=5 n_k=10 disp=False
+        python -m mtbmtbg.moire_shard merge shard0.npz shard1.npz shard2.npz shard3.npz --out tb.npz
+    """
+
+    parser = argparse.ArgumentParser(prog="python -m mtbmtbg.moire_shard")
+    parser.add_argument('solver', choices=list(SHARD_SOLVERS)+['merge'])
+    parser.add_argument('args', nargs='*', help="key=value arguments of the solver, or the shard files to merge")
+    parser.add_argument('--shard', type=parse_shard, help="i/n, the i-th of n shards")
+    parser.add_argument('--out', required=True, help=".npz file of the shard or of the merged result")
+    args = parser.parse_intermixed_args(argv)
+
+    if args.solver == 'merge':
+        np.savez(args.out, **_merge_shards(args.args)[1])
+    else:
+        if args.shard is None:
+            parser.error("--shard i/n is required to run a solver")
+        kwargs = {key: _parse_value(value) for (key, value) in (arg.split('=', 1) for arg in args.args)}
+        run_shard(args.solver, args.shard, args.out, **kwargs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import os
+import time
+import multiprocessing as mp
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+import mtbmtbg.moire_setup as mset
+import mtbmtbg.moire_gk as mgk
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_parallel as mpar
+from mtbmtbg.config import ValleyType
+
+
+def set_job_name(job: tuple) -> str:
+    """file name of a sweep job
+
+    Args:
+        job (tuple): (n_moire, datatype, valley, n_g, n_k)
+
+    Returns:
+        str: name of the job
+    """
+
+    (n_moire, datatype, valley, n_g, n_k) = job
+
+    return "moire"+str(n_moire)+"_"+datatype+"_"+valley+"_g"+str(n_g)+"_k"+str(n_k)
+
+
+def _set_n_atom(n_moire: int) -> int:
+    """number of atoms in the commensurate moire unit cell"""
+
+    return 4*(3*n_moire*n_moire+3*n_moire+1)
+
+
+def _set_n_band(n_moire: int, n_g: int, valley) -> int:
+    """number of TBPLW bands"""
+
+    (_, m_basis_vecs, _) = mset._set_moire(n_moire)
+    n_band = 4*mgk.set_g_vec_list(n_g, m_basis_vecs).shape[0]
+
+    return 2*n_band if valley == ValleyType.VALLEYC else n_band
+
+
+def estimate_cost(job: tuple, disp: bool = True) -> float:
+    """relative cost of a sweep job from its atom and band counts
+
+    The setup projects the atoms on the plane waves, O(n_atom*n_band), and each k point
+    projects the hamiltonian, O(n_atom*n_band^2), and diagonalizes it, O(n_band^3).
+
+    Args:
+        job (tuple): (n_moire, datatype, valley, n_g, n_k)
+        disp (bool, optional): k path or kmesh. Defaults to True.
+
+    Returns:
+        float: estimated cost
+    """
+
+    (n_moire, _, valley, n_g, n_k) = job
+    n_atom = _set_n_atom(n_moire)
+    n_band = _set_n_band(n_moire, n_g, valley)
+    n_kpts = 3*n_k+1 if disp else n_k*n_k
+
+    return float(n_atom*n_band+n_kpts*(n_atom*n_band**2+n_band**3))
+
+
+def _set_groups(jobs: list, disp: bool = True) -> list:
+    """group the jobs sharing a structure, the most expensive group first
+
+    Args:
+        jobs (list): (n_moire, datatype, valley, n_g, n_k) jobs
+        disp (bool, optional): k path or kmesh. Defaults to True.
+
+    Returns:
+        list: lists of jobs of the same (n_moire, datatype)
+    """
+
+    groups = {}
+    for job in jobs:
+        groups.setdefault((job[0], job[1]), []).append(job)
+    # the constant matrices of the same (n_g, valley) are reused within a group
+    groups = [sorted(group, key=lambda job: (job[3], job[2], job[4])) for group in groups.values()]
+
+    return sorted(groups, key=lambda group: -sum(estimate_cost(job, disp) for job in group))
+
+
+def _run_group(task: tuple) -> list:
+    """solve the jobs of a structure, the atoms and pairs are set up once
+
+    Args:
+        task (tuple): (jobs, disp, out_dir, vec, n_thread)
+
+    Returns:
+        list: (job name, .npz file) of the jobs solved
+    """
+
+    (jobs, disp, out_dir, vec, n_thread) = task
+    ret = []
+    with threadpool_limits(limits=n_thread):
+        structure = mtb._set_tb_structure(jobs[0][0], jobs[0][1])
+        for job in jobs:
+            (n_moire, datatype, valley, n_g, n_k) = job
+            start_time = time.perf_counter()
+            problem = mtb._set_tb_problem(n_moire, n_g, n_k, disp, datatype, valley, structure=structure)
+            kpnts = mtb._iter_kpnts(problem, datatype)
+            bands = mpar.collect_kmesh(((i, band) for (i, _, band) in kpnts), problem['kmesh'].shape[0])
+            name = set_job_name(job)
+            path = os.path.join(out_dir, name+".npz")
+            result = {'emesh': bands['emesh'], 'kline': problem['kline'], 'kmesh': problem['kmesh']}
+            if vec:
+                result['dmesh'] = bands['dmesh']
+            # written as soon as the job is done
+            np.savez(path, **result)
+            print("job", name, "done in", time.perf_counter()-start_time, "s")
+            ret.append((name, path))
+
+    return ret
+
+
+def sweep_solver(jobs: list,
+                 out_dir: str,
+                 disp: bool = True,
+                 vec: bool = False,
+                 n_proc: int = None,
+                 n_thread: int = None) -> dict:
+    """solve TBPLW bands of many twist angles, data types, valleys and meshes
+
+    The jobs of the same (n_moire, datatype) share the atoms, the neighbour pairs and, for the
+    same (n_g, valley), the constant matrices. These groups are run by a process pool, the
+    most expensive first by `estimate_cost`, and every job is saved to `out_dir` as
+    <set_job_name(job)>.npz with {emesh, kline, kmesh}, and {dmesh} if `vec`, when it finishes.
+
+    Args:
+        jobs (list): (n_moire, datatype, valley, n_g, n_k) jobs
+        out_dir (str): directory of the results
+        disp (bool, optional): k path or kmesh. Defaults to True.
+        vec (bool, optional): whether save the eigenvectors. Defaults to False.
+        n_proc (int, optional): number of worker processes. Defaults to None, chosen by
+            `moire_parallel.set_schedule`.
+        n_thread (int, optional): BLAS threads of each process. Defaults to None, chosen.
+
+    Returns:
+        dict: job name -> .npz file
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+    groups = _set_groups(jobs, disp)
+    n_dim = max(_set_n_band(job[0], job[3], job[2]) for job in jobs)
+    schedule = mpar.set_schedule(n_dim, len(groups), mpar.N_PROC if n_proc is None else n_proc,
+                                 mpar.N_THREAD if n_thread is None else n_thread)
+    print("="*100)
+    print("num of jobs".ljust(30), ":", len(jobs))
+    print("num of structures".ljust(30), ":", len(groups))
+    print("processes x BLAS threads".ljust(30), ":", schedule['n_proc'], "x", schedule['n_thread'])
+    print("="*100)
+
+    tasks = [(group, disp, out_dir, vec, schedule['n_thread']) for group in groups]
+    ret = {}
+    if schedule['n_proc']>1:
+        # one task per structure, so a worker never sets up a structure twice
+        with mp.get_context().Pool(schedule['n_proc']) as pool:
+            for paths in pool.imap_unordered(_run_group, tasks):
+                ret.update(paths)
+    else:
+        for task in tasks:
+            ret.update(_run_group(task))
+
+    return ret
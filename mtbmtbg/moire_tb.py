@@ -1,16 +1,31 @@
+import os
 import time
 import numpy as np
 import scipy.linalg as sla
+from itertools import product
 from scipy import sparse
+from scipy.sparse import linalg as spla
+from threadpoolctl import threadpool_limits
 
 import mtbmtbg.moire_setup as mset
 import mtbmtbg.moire_gk as mgk
 import mtbmtbg.moire_io as mio
-from mtbmtbg.config import TBInfo, DataType, EngineType, ValleyType
+import mtbmtbg.moire_eigen as meig
+import mtbmtbg.moire_parallel as mpar
+import mtbmtbg.moire_checkpoint as mckpt
+from mtbmtbg.config import TBInfo, DataType, EngineType, ValleyType, SolverType, PrecisionType
 
 VPI_0 = TBInfo.VPI_0
 VSIGMA_0 = TBInfo.VSIGMA_0
 R_RANGE = TBInfo.R_RANGE
+# shift used by sparse solvers to pick up bands near charge neutrality (eV)
+SIGMA_SPARSE = 0.78
+# guard vectors added to the davidson block, they speed up the convergence of the wanted bands
+DAVIDSON_GUARD = 4
+# iterations after which davidson renews the factorization used as preconditioner
+DAVIDSON_REFACTOR_ITER = 10
+# offset of the preconditioner shift from the target energy, which can be an eigenvalue at the Dirac points (eV)
+DAVIDSON_SHIFT = 5e-3
 
 
 def _set_g_vec_list_valley(n_moire: int, g_vec_list: np.ndarray, m_basis_vecs: dict,
@@ -135,7 +150,36 @@ def _set_const_mtrx(
     return const_mtrx_dict
 
 
-def _cal_eigen_hamk(hamk, smat, datatype=DataType.CORRU, engine=EngineType.TBPLW) -> tuple:
+def _set_const_mtrx_single(const_mtrx_dict: dict) -> dict:
+    """cast the constant matrices of TBPLW to single precision
+
+    The double precision matrices are kept as {gr_ref, tr_ref, sr_ref}, the residuals and the
+    refinement are always measured against the double precision hamiltonian.
+
+    Args:
+        const_mtrx_dict (dict): const matrix dictionary in double precision
+
+    Returns:
+        dict: {gr_mtrx, tr_mtrx, sr_mtrx} in complex64 (float32 for the hopping) and the double precision ones
+    """
+
+    single_mtrx_dict = {}
+    single_mtrx_dict['gr'] = const_mtrx_dict['gr'].astype(np.complex64)
+    single_mtrx_dict['tr'] = const_mtrx_dict['tr'].astype(np.float32)
+    single_mtrx_dict['sr'] = const_mtrx_dict['sr'].astype(np.complex64)
+    single_mtrx_dict['gr_ref'] = const_mtrx_dict['gr']
+    single_mtrx_dict['tr_ref'] = const_mtrx_dict['tr']
+    single_mtrx_dict['sr_ref'] = const_mtrx_dict['sr']
+
+    return single_mtrx_dict
+
+
+def _cal_eigen_hamk(hamk,
+                    smat,
+                    datatype=DataType.CORRU,
+                    engine=EngineType.TBPLW,
+                    backend=None,
+                    n_eig: int = None) -> tuple:
     """solve the eigenvalue problem using different engine according to engine and datatype
 
     Args:
@@ -143,16 +187,28 @@ def _cal_eigen_hamk(hamk, smat, datatype=DataType.CORRU, engine=EngineType.TBPLW
         smat (_type_): _description_
         datatype (_type_, optional): structure of input atoms. Defaults to DataType.CORRU.
         engine (_type_, optional): differnet TB engines. Defaults to EngineType.TBPLW.
+        backend (str, optional): eigen solver backend registered in `moire_eigen`, 'auto' for 
+            autotuning. Defaults to None, the default solver of each engine.
+        n_eig (int, optional): number of bands around charge neutrality solved by `backend`, None for
+            all bands (10 bands for EngineType.TBSPARSE). Defaults to None.
 
     Returns:
         tuple: (v, w)
     """
     w = 0
 
+    if backend is not None:
+        if engine == EngineType.TBSPARSE:
+            return meig.eigh(hamk, n_eig=10 if n_eig is None else n_eig, sigma=SIGMA_SPARSE, backend=backend)
+        smat = smat if (engine == EngineType.TBPLW and datatype == DataType.RELAX) else None
+        v, w = meig.eigh(hamk, smat, n_eig=n_eig, backend=backend)
+        # eigenvectors of the full TB hamiltonian are not kept, as with the default solver
+        return (v, 0 if engine == EngineType.TBFULL else w)
+
     if engine == EngineType.TBFULL:
         v, _ = np.linalg.eigh(hamk)
     elif engine == EngineType.TBSPARSE:
-        v, _ = sparse.linalg.eigs(hamk, k=10, sigma=0.78)
+        v, _ = sparse.linalg.eigs(hamk, k=10, sigma=SIGMA_SPARSE)
         v = np.real(v)
     else:  # default using TBPLW
         if datatype == DataType.RELAX:
@@ -163,6 +219,239 @@ def _cal_eigen_hamk(hamk, smat, datatype=DataType.CORRU, engine=EngineType.TBPLW
     return (v, w)
 
 
+def _cal_eigen_window(hamk, smat, n_eig: int, sigma=None, engine=EngineType.TBPLW) -> tuple:
+    """directly solve the `n_eig` eigenpairs closest to sigma
+
+    Args:
+        hamk: hamiltonian, sparse for EngineType.TBSPARSE
+        smat: overlap matrix, None for a standard eigenvalue problem
+        n_eig (int): number of eigenpairs
+        sigma (float, optional): target energy, None for the charge neutrality point. Defaults to None.
+        engine (EngineType, optional): differnet TB engines. Defaults to EngineType.TBPLW.
+
+    Returns:
+        tuple: (v, w, sigma)
+    """
+
+    if engine == EngineType.TBSPARSE:
+        sigma = SIGMA_SPARSE if sigma is None else sigma
+        v, w = spla.eigsh(hamk, k=n_eig, M=smat, sigma=sigma)
+        idx = np.argsort(v)
+        return (v[idx], w[:, idx], sigma)
+
+    if smat is None:
+        v, w = np.linalg.eigh(hamk)
+    else:
+        v, w = sla.eigh(hamk, b=smat)
+    if sigma is None:
+        # half filling
+        n_band = v.shape[0]
+        sigma = (v[n_band//2-1]+v[n_band//2])/2
+    idx = np.sort(np.argsort(np.abs(v-sigma))[:n_eig])
+
+    return (v[idx], w[:, idx], sigma)
+
+
+def _set_hamk_operator(ndist_dict: dict,
+                       npair_dict: dict,
+                       const_mtrx_dict: dict,
+                       k_vec: np.ndarray,
+                       n_atom: int,
+                       engine=EngineType.TBPLW):
+    """hamiltonian which only supports `hamk@x`
+
+    The TBPLW hamiltonian is applied as gr@(hr@(gr^H@x)) and never assembled, which costs
+    O(n_band*n_atom) per vector instead of the O(n_band^2*n_atom) assembly.
+
+    Returns:
+        LinearOperator for EngineType.TBPLW, the sparse hamiltonian for the full TB engines
+    """
+
+    hr_mtrx = _cal_hamiltonian_k(ndist_dict, npair_dict, const_mtrx_dict, k_vec, n_atom, EngineType.TBSPARSE)
+    if engine != EngineType.TBPLW:
+        return hr_mtrx
+    gr_mtrx = const_mtrx_dict['gr']
+    n_band = gr_mtrx.shape[0]
+    # gr^H x = (gr^T x^*)^*, gr^T is a view and gr is not copied
+    h_dot = lambda x: gr_mtrx@(hr_mtrx@np.conj(gr_mtrx.T@np.conj(x)))
+
+    return spla.LinearOperator((n_band, n_band), matvec=h_dot, matmat=h_dot, dtype=complex)
+
+
+def _cal_eigen_hamk_seeded(hamk,
+                           assemble,
+                           smat,
+                           state: dict,
+                           n_eig: int,
+                           datatype=DataType.CORRU,
+                           engine=EngineType.TBPLW) -> tuple:
+    """solve the `n_eig` eigenpairs closest to sigma, seeded by eigenvectors of a nearby k point
+
+    The block is seeded by the `n_eig` eigenvectors plus DAVIDSON_GUARD guard vectors of the previous
+    k point and preconditioned by the factorization of (H-sigma*S) at an earlier k point. The
+    factorization is renewed once davidson needs more than DAVIDSON_REFACTOR_ITER iterations. Falls back
+    to `_cal_eigen_window` if there is no seed or davidson does not converge.
+
+    Args:
+        hamk: hamiltonian operator, see `_set_hamk_operator`
+        assemble (callable): () -> assembled hamiltonian, only called for a new factorization
+        smat: overlap matrix in TBPLW
+        state (dict): {vec, sigma, solve} carried along the k path, updated in place
+        n_eig (int): number of eigenpairs
+        datatype (DataType, optional): structure of input atoms. Defaults to DataType.CORRU.
+        engine (EngineType, optional): differnet TB engines. Defaults to EngineType.TBPLW.
+
+    Returns:
+        tuple: (v, w) of the `n_eig` eigenpairs in ascending order
+    """
+
+    smat = smat if (engine == EngineType.TBPLW and datatype == DataType.RELAX) else None
+    n_block = n_eig+DAVIDSON_GUARD
+
+    if state.get('vec') is not None:
+        sigma = state['sigma']
+        v, w, converged, n_iter = meig.davidson_eigh(hamk, state['vec'], sigma, smat, state['solve'], n_eig)
+        if converged:
+            state['vec'] = w
+            if n_iter>DAVIDSON_REFACTOR_ITER:
+                state['solve'] = meig._set_shift_invert(assemble(), smat, sigma+DAVIDSON_SHIFT)
+            idx = np.sort(np.argsort(np.abs(v-sigma))[:n_eig])
+            return (v[idx], w[:, idx])
+        print("davidson not converged, fall back to direct solver.")
+
+    hamk = assemble()
+    v, w, sigma = _cal_eigen_window(hamk, smat, n_block, state.get('sigma'), engine)
+    state.update(vec=w, sigma=sigma, solve=meig._set_shift_invert(hamk, smat, sigma+DAVIDSON_SHIFT))
+    idx = np.sort(np.argsort(np.abs(v-sigma))[:n_eig])
+
+    return (v[idx], w[:, idx])
+
+
+def _cal_eigen_hamk_refined(ndist_dict: dict,
+                            npair_dict: dict,
+                            const_mtrx_dict: dict,
+                            k_vec: np.ndarray,
+                            n_atom: int,
+                            eigen_val: np.ndarray,
+                            eigen_vec: np.ndarray,
+                            n_eig: int,
+                            n_refine: int,
+                            datatype=DataType.CORRU) -> tuple:
+    """refine the single precision TBPLW eigenpairs around charge neutrality in double precision
+
+    The double precision hamiltonian is only applied to the `n_eig` refined vectors, it is never
+    assembled. The residual is always measured against the double precision hamiltonian, also
+    without refinement (`n_refine=0`).
+
+    Args:
+        ndist_dict (dict): neighbour distance dictionary
+        npair_dict (dict): neighbour pair dictionary
+        const_mtrx_dict (dict): const matrix dictionary of `_set_const_mtrx_single`
+        k_vec (np.ndarray): kpoint
+        n_atom (int): number of atoms in a moire unit cell
+        eigen_val (np.ndarray): single precision eigenvalues in ascending order
+        eigen_vec (np.ndarray): single precision eigenvectors
+        n_eig (int): number of refined bands around charge neutrality
+        n_refine (int): number of double precision refinement steps
+        datatype (DataType, optional): structure of input atoms. Defaults to DataType.CORRU.
+
+    Returns:
+        tuple: (v, w, resid)
+    """
+
+    gr_mtrx = const_mtrx_dict['gr_ref']
+    ref_mtrx_dict = {'gr': gr_mtrx, 'tr': const_mtrx_dict['tr_ref']}
+    hr_mtrx = _cal_hamiltonian_k(ndist_dict, npair_dict, ref_mtrx_dict, k_vec, n_atom, EngineType.TBSPARSE)
+    h_dot = lambda x: gr_mtrx@(hr_mtrx@(gr_mtrx.conj().T@x))
+    smat = const_mtrx_dict['sr_ref'] if datatype == DataType.RELAX else None
+    s_dot = None if smat is None else (lambda x: smat@x)
+
+    return meig.refine_eigh(h_dot, eigen_val, eigen_vec, n_eig, s_dot, n_refine)
+
+
+def _set_valley_index(n_band: int) -> tuple:
+    """rows of the two valleys in the VALLEYC basis, each of the 4 sublattice blocks is the K1 Glist
+    followed by the K2 Glist
+
+    Args:
+        n_band (int): number of VALLEYC bands
+
+    Returns:
+        tuple: (rows of VALLEYK1, rows of VALLEYK2)
+    """
+
+    n_g = n_band//8
+    idx = (np.arange(4)[:, None]*2*n_g+np.arange(n_g)).ravel()
+
+    return (idx, idx+n_g)
+
+
+def _cal_eigen_decoupled(ndist_dict: dict,
+                         npair_dict: dict,
+                         const_mtrx_dict: dict,
+                         k_vec: np.ndarray,
+                         n_atom: int,
+                         datatype=DataType.CORRU,
+                         backend: str = None,
+                         n_eig: int = None) -> tuple:
+    """solve the two valley blocks of the VALLEYC hamiltonian independently
+
+    Each block is the hamiltonian of a single valley, the two of them are diagonalized at a
+    quarter and projected at half of the cost of the combined hamiltonian. The intervalley block
+    is left out, its size is measured on the `n_eig` (10 if None) bands around charge neutrality
+    of both valleys as the largest matrix element between them, which estimates the first order
+    shift of the bands.
+
+    Args:
+        ndist_dict (dict): neighbour distance dictionary
+        npair_dict (dict): neighbour pair dictionary
+        const_mtrx_dict (dict): const matrix dictionary of VALLEYC
+        k_vec (np.ndarray): kpoint
+        n_atom (int): number of atoms in a moire unit cell
+        datatype (DataType, optional): structure of input atoms. Defaults to DataType.CORRU.
+        backend (str, optional): eigen solver backend, see `_cal_eigen_hamk`. Defaults to None.
+        n_eig (int, optional): number of bands around charge neutrality, None for all. Defaults to None.
+
+    Returns:
+        tuple: (v, w, coupling), the bands of both valleys sorted as the VALLEYC ones
+    """
+
+    gr_mtrx = const_mtrx_dict['gr']
+    sr_mtrx = const_mtrx_dict['sr']
+    hr_mtrx = _cal_hamiltonian_k(ndist_dict, npair_dict, const_mtrx_dict, k_vec, n_atom, EngineType.TBSPARSE)
+    n_band = gr_mtrx.shape[0]
+    valley_idx = _set_valley_index(n_band)
+    n_window = 10 if n_eig is None else n_eig
+
+    (v_list, w_list, window) = ([], [], [])
+    for idx in valley_idx:
+        gr_valley = gr_mtrx[idx]
+        hamk = gr_valley@(hr_mtrx@(gr_valley.conj().T))
+        v, w = _cal_eigen_hamk(hamk, sr_mtrx[np.ix_(idx, idx)], datatype, EngineType.TBPLW, backend, n_eig)
+        v_list.append(v)
+        w_list.append(w)
+        band_idx = np.arange(v.size//2-n_window//2, v.size//2-n_window//2+n_window)
+        window.append((v[band_idx], w[:, band_idx], gr_valley.conj().T@w[:, band_idx]))
+
+    # <K1 i|H-E S|K2 j> with E the mean energy of the pair, S is only used for DataType.RELAX
+    ((v1, w1, gw1), (v2, w2, gw2)) = window
+    inter_mtrx = gw1.conj().T@(hr_mtrx@gw2)
+    if datatype == DataType.RELAX:
+        inter_mtrx -= (v1[:, None]+v2[None, :])/2*(w1.conj().T@(sr_mtrx[np.ix_(*valley_idx)]@w2))
+    coupling = np.max(np.abs(inter_mtrx))
+
+    eigen_val = np.concatenate(v_list)
+    eigen_vec = np.zeros((n_band, eigen_val.size), dtype=np.result_type(*w_list))
+    eigen_vec[valley_idx[0], :v_list[0].size] = w_list[0]
+    eigen_vec[valley_idx[1], v_list[0].size:] = w_list[1]
+    order = np.argsort(eigen_val, kind='stable')
+    if n_eig is not None:
+        # the n_eig bands around charge neutrality of both valleys together
+        order = order[n_eig-n_eig//2:n_eig-n_eig//2+n_eig]
+
+    return (eigen_val[order], eigen_vec[:, order], coupling)
+
+
 def _cal_hamiltonian_k(ndist_dict: dict,
                        npair_dict: dict,
                        const_mtrx_dict: dict,
@@ -192,7 +481,8 @@ def _cal_hamiltonian_k(ndist_dict: dict,
     tr_mtrx = const_mtrx_dict['tr']
     dr = ndist_dict['dr']
 
-    tk_data = np.exp(-1j*np.dot(dr, k_vec))
+    # follow the precision of the constant matrices
+    tk_data = np.exp(-1j*np.dot(dr, k_vec)).astype(np.result_type(tr_mtrx.dtype, np.complex64), copy=False)
     kr_mtrx = sparse.csr_matrix((tk_data, (row, col)), shape=(n_atom, n_atom))
     kr_mtrx_cc = (kr_mtrx.transpose()).conjugate()
     kr_mtrx_delta = kr_mtrx-kr_mtrx_cc
@@ -218,13 +508,457 @@ def _cal_hamiltonian_k(ndist_dict: dict,
         return gr_mtrx@(hr_mtrx@(gr_mtrx.conj().T))
 
 
+def _set_band_range(eigen_vec, band_range: tuple = None):
+    """keep the eigenvectors of the bands in `band_range`
+
+    Args:
+        eigen_vec: eigenvectors of a k point, or 0 if they are not kept
+        band_range (tuple, optional): (start, stop) columns of the eigenvectors. Defaults to None, all.
+
+    Returns:
+        eigenvectors of the bands in `band_range`
+    """
+
+    if band_range is None or np.ndim(eigen_vec) != 2:
+        return eigen_vec
+
+    return np.ascontiguousarray(eigen_vec[:, band_range[0]:band_range[1]])
+
+
+def _solve_kpnt(shared: dict, k_vec: np.ndarray, params: dict) -> dict:
+    """solve a single k point in a worker process of `moire_parallel.parallel_kmesh`
+
+    Args:
+        shared (dict): pair table {r, c}, distances {dr} and constant matrices in shared memory
+        k_vec (np.ndarray): k point
+        params (dict): {n_atom, datatype, engine, backend, precision, n_eig, n_refine, band_range, decouple}
+
+    Returns:
+        dict: {emesh, dmesh}, {resid} for PrecisionType.SINGLE and {coupling} for `decouple`
+    """
+
+    npair_dict = {'r': shared['r'], 'c': shared['c']}
+    ndist_dict = {'dr': shared['dr']}
+    n_atom = params['n_atom']
+    single = params['precision'] == PrecisionType.SINGLE
+    ret = {}
+    if params.get('decouple', False):
+        eigen_val, eigen_vec, ret['coupling'] = _cal_eigen_decoupled(ndist_dict, npair_dict, shared, k_vec, n_atom,
+                                                                     params['datatype'], params['backend'],
+                                                                     params['n_eig'])
+    else:
+        hamk = _cal_hamiltonian_k(ndist_dict, npair_dict, shared, k_vec, n_atom, params['engine'])
+        # the refinement needs the whole low precision spectrum
+        eigen_val, eigen_vec = _cal_eigen_hamk(hamk, shared['sr'], params['datatype'], params['engine'],
+                                               params['backend'], None if single else params['n_eig'])
+    if single:
+        n_eig = 10 if params['n_eig'] is None else params['n_eig']
+        eigen_val, eigen_vec, ret['resid'] = _cal_eigen_hamk_refined(ndist_dict, npair_dict, shared, k_vec, n_atom,
+                                                                     eigen_val, eigen_vec, n_eig, params['n_refine'],
+                                                                     params['datatype'])
+    ret['emesh'] = eigen_val
+    ret['dmesh'] = _set_band_range(eigen_vec, params['band_range'])
+
+    return ret
+
+
+def _check_solver(engine, solver, backend, precision, valley=ValleyType.VALLEYK1, decouple: bool = False):
+    """check the combination of eigen solver options
+
+    Raises:
+        Exception: single precision is only implemented for dense TBPLW.
+        Exception: eigen solver backend is only used by SolverType.DENSE.
+        Exception: decoupled valleys are only implemented for dense double precision TBPLW VALLEYC.
+    """
+
+    if precision == PrecisionType.SINGLE and (engine != EngineType.TBPLW or solver != SolverType.DENSE):
+        raise Exception("single precision is only implemented for dense TBPLW.")
+    if backend is not None and solver != SolverType.DENSE:
+        raise Exception("eigen solver backend is only used by SolverType.DENSE.")
+    if decouple and (valley != ValleyType.VALLEYC or engine != EngineType.TBPLW or solver != SolverType.DENSE or
+                     precision != PrecisionType.DOUBLE):
+        raise Exception("decoupled valleys are only implemented for dense double precision TBPLW VALLEYC.")
+
+
+def _set_tb_structure(n_moire: int, datatype=DataType.CORRU) -> dict:
+    """set up the atoms and the neighbour pairs of a moire structure
+
+    Args:
+        n_moire (int): an integer describing the size of commensurate TBG systems
+        datatype (DataType, optional): atom data type. Defaults to DataType.CORRU.
+
+    Returns:
+        dict: {atoms, m_basis_vecs, high_symm_pnts, npair, ndist, const}, 'const' caches the constant
+        matrices of each (n_g, valley, precision)
+    """
+
+    # load atom data
+    atom_pstn_list = mio.read_atom_pstn_list(n_moire, datatype)
+    # construct moire info
+    (_, m_basis_vecs, high_symm_pnts) = mset._set_moire(n_moire)
+    (all_nns, enlarge_atom_pstn_list) = mset.set_atom_neighbour_list(atom_pstn_list, m_basis_vecs)
+    (npair_dict, ndist_dict) = mset.set_relative_dis_ndarray(atom_pstn_list, enlarge_atom_pstn_list, all_nns)
+
+    return {
+        'atoms': atom_pstn_list,
+        'm_basis_vecs': m_basis_vecs,
+        'high_symm_pnts': high_symm_pnts,
+        'npair': npair_dict,
+        'ndist': ndist_dict,
+        'const': {}
+    }
+
+
+def _set_tb_const(structure: dict,
+                  n_moire: int,
+                  n_g: int,
+                  valley=ValleyType.VALLEYK1,
+                  precision=PrecisionType.DOUBLE) -> dict:
+    """constant matrices of a structure, cached in it for each (n_g, valley, precision)
+
+    Args:
+        structure (dict): returned by `_set_tb_structure`
+        other arguments: see `tb_solver`
+
+    Returns:
+        dict: {const, nbmap, glist, o_glist, n_band}
+    """
+
+    key = (n_g, valley, precision)
+    if key not in structure['const']:
+        (atom_pstn_list, m_basis_vecs) = (structure['atoms'], structure['m_basis_vecs'])
+        # set up g list
+        o_g_vec_list = mgk.set_g_vec_list(n_g, m_basis_vecs)
+        # move to specific valley or combined valley
+        g_vec_list = _set_g_vec_list_valley(n_moire, o_g_vec_list, m_basis_vecs, valley)
+        # constant matrix dictionary
+        const_mtrx_dict = _set_const_mtrx(n_moire, structure['npair'], structure['ndist'], m_basis_vecs, g_vec_list,
+                                          atom_pstn_list)
+        if precision == PrecisionType.SINGLE:
+            const_mtrx_dict = _set_const_mtrx_single(const_mtrx_dict)
+        # the shift maps of the chern links are built by `moire_chern` when needed
+        neighbor_map = mgk.set_neighbor_map(o_g_vec_list, m_basis_vecs)
+        structure['const'][key] = {
+            'const': const_mtrx_dict,
+            'nbmap': neighbor_map,
+            'glist': g_vec_list,
+            'o_glist': o_g_vec_list,
+            'n_band': g_vec_list.shape[0]*4
+        }
+
+    return structure['const'][key]
+
+
+def _set_tb_problem(n_moire: int,
+                    n_g: int,
+                    n_k: int,
+                    disp: bool = True,
+                    datatype=DataType.CORRU,
+                    valley=ValleyType.VALLEYK1,
+                    precision=PrecisionType.DOUBLE,
+                    structure: dict = None,
+                    irreducible: bool = False,
+                    kmesh: np.ndarray = None) -> dict:
+    """set up the atoms, constant matrices and k points shared by all k points
+
+    Args:
+        structure (dict, optional): returned by `_set_tb_structure` for `n_moire` and `datatype`, its
+            atoms and pairs are reused and the constant matrices cached. Defaults to None.
+        irreducible (bool, optional): solve the C3z irreducible kmesh, see `_set_tb_unfold`. Defaults to False.
+        kmesh (np.ndarray, optional): k points solved instead of the ones of `n_k`. Defaults to None.
+        other arguments: see `tb_solver`
+
+    Raises:
+        Exception: the irreducible kmesh needs disp=False, a single valley and the kmesh of n_k.
+
+    Returns:
+        dict: {npair, ndist, const, kmesh, kline, nbmap, n_atom, n_band}, and {unfold} for `irreducible`
+    """
+
+    kline = 0
+    structure = _set_tb_structure(n_moire, datatype) if structure is None else structure
+    tb_const = _set_tb_const(structure, n_moire, n_g, valley, precision)
+
+    if irreducible and (disp or valley == ValleyType.VALLEYC or kmesh is not None):
+        raise Exception("irreducible kmesh is only implemented for disp=False, a single valley and the kmesh of n_k.")
+    unfold = None
+    if kmesh is not None:
+        kmesh = np.asarray(kmesh)
+    elif disp:
+        (kline, kmesh) = mgk.set_tb_disp_kmesh(n_k, structure['high_symm_pnts'])
+    elif irreducible:
+        unfold = _set_tb_unfold(structure, tb_const['o_glist'], n_moire, n_k, valley)
+        kmesh = unfold.pop('kmesh')
+    else:
+        kmesh = mgk.set_kmesh(n_k, structure['m_basis_vecs'])
+
+    problem = {
+        'npair': structure['npair'],
+        'ndist': structure['ndist'],
+        'const': tb_const['const'],
+        'kmesh': kmesh,
+        'kline': kline,
+        'nbmap': tb_const['nbmap'],
+        'n_atom': structure['atoms'].shape[0],
+        'n_band': tb_const['n_band']
+    }
+    if unfold is not None:
+        problem['unfold'] = unfold
+
+    return problem
+
+
+def _set_tb_unfold(structure: dict,
+                   o_g_vec_list: np.ndarray,
+                   n_moire: int,
+                   n_k: int,
+                   valley=ValleyType.VALLEYK1) -> dict:
+    """C3z irreducible kmesh and the maps unfolding it to the full kmesh
+
+    C3z maps the basis k+G+K of the valley K onto R(k+G+K) = Rk+(RK-K)+RG+K, so the hamiltonian
+    at Rk+RK-K is the one at k with the Glist rotated. The full kmesh point p = R^r q+(R^r K-K)+G_p,
+    with G_p a moire reciprocal vector, is then reached by the atomic phases exp(-i G_p.r), exact
+    in the atomic basis, and projected back onto the plane waves of p.
+
+    Args:
+        structure (dict): returned by `_set_tb_structure`
+        o_g_vec_list (np.ndarray): Glist around the origin
+        other arguments: see `tb_solver`
+
+    Raises:
+        Exception: the Glist is not C3z symmetric.
+
+    Returns:
+        dict: {kmesh, weight, kmap, rot, kidx: see `moire_gk.set_kmesh_irreducible`, gmap: gmap[r] is
+            the index of R^-r G in the Glist, gshift: coordinates of G_p, mg: moire reciprocal vectors,
+            pstn: atom positions}
+    """
+
+    m_basis_vecs = structure['m_basis_vecs']
+    irr = mgk.set_kmesh_irreducible(n_k, m_basis_vecs)
+    c3_list = [np.linalg.matrix_power(mgk.set_c3_mtrx(m_basis_vecs), r) for r in range(3)]
+
+    g_coords = mgk.set_g_coords(o_g_vec_list, m_basis_vecs)
+    g_table = mgk.set_g_table(g_coords)
+    gmap = np.array([mgk.find_g_coords(g_table, g_coords@c3_list[(3-r) % 3].T) for r in range(3)])
+    if np.any(gmap<0):
+        raise Exception("Glist is not C3z symmetric.")
+
+    # K = +-(n_moire, n_moire) in moire reciprocal coordinates
+    k_coords = (-1 if valley == ValleyType.VALLEYK2 else 1)*np.array([n_moire, n_moire])
+    p_coords = np.array(list(product(range(n_k), range(n_k))))
+    q_coords = p_coords[irr['kidx']][irr['kmap']]
+    gshift = np.empty_like(p_coords)
+    for r in range(3):
+        p_rot = irr['rot'] == r
+        # p-R^r q is a multiple of n_k, the points are i/n_k*mg1+j/n_k*mg2
+        gshift[p_rot] = (p_coords[p_rot]-q_coords[p_rot]@c3_list[r].T)//n_k-(c3_list[r]@k_coords-k_coords)
+
+    irr.update({
+        'gmap': gmap,
+        'gshift': gshift,
+        'mg': np.array([m_basis_vecs['mg1'], m_basis_vecs['mg2']]),
+        'pstn': structure['atoms'][:, :2]
+    })
+
+    return irr
+
+
+def _set_shift_mtrx(const_mtrx_dict: dict, sr_cho: tuple, atom_pstn: np.ndarray, g_vec: np.ndarray) -> np.ndarray:
+    """matrix moving the plane wave coefficients of states at k to k+G
+
+    The atomic phases exp(-i G.r) are exact in the atomic basis for a moire reciprocal vector G,
+    the shifted states are projected back onto the plane waves, S^-1 gr exp(-i G.r) gr^H.
+
+    Args:
+        const_mtrx_dict (dict): const matrix dictionary, the double precision ones are used
+        sr_cho (tuple): cholesky factor of the overlap matrix, `scipy.linalg.cho_factor`
+        atom_pstn (np.ndarray): in plane atom positions
+        g_vec (np.ndarray): moire reciprocal vector G
+
+    Returns:
+        np.ndarray: shift matrix
+    """
+
+    gr_mtrx = const_mtrx_dict.get('gr_ref', const_mtrx_dict['gr'])
+    phase = np.exp(-1j*(atom_pstn@g_vec))
+
+    return sla.cho_solve(sr_cho, gr_mtrx@(phase[:, None]*gr_mtrx.conj().T))
+
+
+def _unfold_kmesh(problem: dict, ret_k: dict, dmesh_file: str = None) -> dict:
+    """unfold the results of the irreducible kmesh to the full kmesh, see `_set_tb_unfold`
+
+    Args:
+        problem (dict): returned by `_set_tb_problem` with `irreducible`
+        ret_k (dict): {emesh, dmesh} and {resid} of the irreducible k points
+        dmesh_file (str, optional): .npy file the unfolded eigenvectors are written into. Defaults to None.
+
+    Returns:
+        dict: {emesh, dmesh} and {resid} of the full kmesh
+    """
+
+    unfold = problem['unfold']
+    kmap = unfold['kmap']
+    ret = {name: np.asarray(value)[kmap] for (name, value) in ret_k.items() if name != 'dmesh'}
+    dmesh_irr = ret_k['dmesh']
+    if np.ndim(dmesh_irr) != 3:
+        ret['dmesh'] = np.asarray(dmesh_irr)[kmap]
+        return ret
+
+    const = problem['const']
+    # the projection is done in double precision
+    sr_cho = sla.cho_factor(const.get('sr_ref', const['sr']))
+    n_g = unfold['gmap'].shape[1]
+    shape = (kmap.size,)+dmesh_irr.shape[1:]
+    if dmesh_file is None:
+        dmesh = np.empty(shape, dtype=dmesh_irr.dtype)
+    else:
+        dmesh = mpar._open_file(dmesh_file, shape, dmesh_irr.dtype)
+    (gshift, p_group) = np.unique(unfold['gshift'], axis=0, return_inverse=True)
+    for (i, g_coords) in enumerate(gshift):
+        # computed once for each G_p
+        unfold_mtrx = None
+        if np.any(g_coords):
+            unfold_mtrx = _set_shift_mtrx(const, sr_cho, unfold['pstn'], g_coords@unfold['mg'])
+        for p in np.flatnonzero(p_group.ravel() == i):
+            vec = np.reshape(dmesh_irr[kmap[p]], (4, n_g, -1))[:, unfold['gmap'][unfold['rot'][p]]]
+            vec = vec.reshape(shape[1:])
+            dmesh[p] = vec if unfold_mtrx is None else unfold_mtrx@vec
+    if dmesh_file is not None:
+        dmesh.flush()
+        dmesh = np.load(dmesh_file, mmap_mode='r')
+    ret['dmesh'] = dmesh
+
+    return ret
+
+
+def _iter_kpnts(problem: dict,
+                datatype=DataType.CORRU,
+                engine=EngineType.TBPLW,
+                solver=SolverType.DENSE,
+                n_eig: int = None,
+                backend: str = None,
+                precision=PrecisionType.DOUBLE,
+                n_refine: int = 0,
+                band_range: tuple = None,
+                k_index: np.ndarray = None,
+                decouple: bool = False):
+    """solve the k points of `problem` in order, one at a time
+
+    Args:
+        problem (dict): returned by `_set_tb_problem`
+        k_index (np.ndarray, optional): indices of the k points solved. Defaults to None, all.
+        other arguments: see `tb_solver`
+
+    Yields:
+        tuple: (k index, k vector, {emesh, dmesh}, {resid} for PrecisionType.SINGLE and {coupling} for `decouple`)
+    """
+
+    (npair_dict, ndist_dict, const_mtrx_dict) = (problem['npair'], problem['ndist'], problem['const'])
+    n_atom = problem['n_atom']
+    # seed, target energy and preconditioner for SolverType.DAVIDSON
+    davidson_state = {}
+    # bands of SolverType.DAVIDSON and of the refinement
+    n_window = 10 if n_eig is None else n_eig
+    cal_hamk = lambda k_vec: _cal_hamiltonian_k(ndist_dict, npair_dict, const_mtrx_dict, k_vec, n_atom, engine)
+
+    k_index = range(problem['kmesh'].shape[0]) if k_index is None else k_index
+    for i in k_index:
+        k_vec = problem['kmesh'][i]
+        print("k sampling process, counter:", i+1)
+        ret = {}
+        if solver == SolverType.DAVIDSON:
+            hamk = _set_hamk_operator(ndist_dict, npair_dict, const_mtrx_dict, k_vec, n_atom, engine)
+            # the full hamiltonian is only assembled for a new factorization
+            assemble = lambda: cal_hamk(k_vec)
+            eigen_val, eigen_vec = _cal_eigen_hamk_seeded(hamk, assemble, const_mtrx_dict['sr'], davidson_state,
+                                                          n_window, datatype, engine)
+        elif decouple:
+            eigen_val, eigen_vec, ret['coupling'] = _cal_eigen_decoupled(ndist_dict, npair_dict, const_mtrx_dict, k_vec,
+                                                                         n_atom, datatype, backend, n_eig)
+        else:
+            hamk = cal_hamk(k_vec)
+            # the refinement needs the whole low precision spectrum
+            eigen_val, eigen_vec = _cal_eigen_hamk(hamk, const_mtrx_dict['sr'], datatype, engine, backend,
+                                                   None if precision == PrecisionType.SINGLE else n_eig)
+        if precision == PrecisionType.SINGLE:
+            eigen_val, eigen_vec, ret['resid'] = _cal_eigen_hamk_refined(ndist_dict, npair_dict, const_mtrx_dict, k_vec,
+                                                                         n_atom, eigen_val, eigen_vec, n_window,
+                                                                         n_refine, datatype)
+        ret['emesh'] = eigen_val
+        ret['dmesh'] = _set_band_range(eigen_vec, band_range)
+        yield (i, k_vec, ret)
+
+
+def iter_bands(n_moire: int,
+               n_g: int,
+               n_k: int,
+               disp: bool = True,
+               datatype=DataType.CORRU,
+               engine=EngineType.TBPLW,
+               valley=ValleyType.VALLEYK1,
+               solver=SolverType.DENSE,
+               n_eig: int = None,
+               backend: str = None,
+               precision=PrecisionType.DOUBLE,
+               n_refine: int = 0,
+               band_range: tuple = None,
+               vec: bool = True,
+               session=None,
+               decouple: bool = False):
+    """generator of the bands of `tb_solver`, one k point at a time
+
+    Only the current k point is held in memory, so DOS accumulation or plotting can consume the
+    bands while they are computed. `moire_parallel.collect_bands` writes them into preallocated arrays.
+
+    Args:
+        vec (bool, optional): whether yield the eigenvectors. Defaults to True.
+        other arguments: see `tb_solver`
+
+    Yields:
+        tuple: (k index, k vector, eigenvalues, eigenvectors or None)
+    """
+
+    _check_solver(engine, solver, backend, precision, valley, decouple)
+    structure = None if session is None else session.get_structure(n_moire, datatype)
+    problem = _set_tb_problem(n_moire, n_g, n_k, disp, datatype, valley, precision, structure)
+    for (i, k_vec, ret) in _iter_kpnts(problem,
+                                       datatype,
+                                       engine,
+                                       solver,
+                                       n_eig,
+                                       backend,
+                                       precision,
+                                       n_refine,
+                                       band_range,
+                                       decouple=decouple):
+        yield (i, k_vec, ret['emesh'], ret['dmesh'] if vec else None)
+
+
 def tb_solver(n_moire: int,
               n_g: int,
               n_k: int,
               disp: bool = True,
               datatype=DataType.CORRU,
               engine=EngineType.TBPLW,
-              valley=ValleyType.VALLEYK1) -> dict:
+              valley=ValleyType.VALLEYK1,
+              solver=SolverType.DENSE,
+              n_eig: int = None,
+              backend: str = None,
+              precision=PrecisionType.DOUBLE,
+              n_refine: int = 0,
+              n_proc: int = None,
+              n_thread: int = None,
+              band_range: tuple = None,
+              dmesh_file: str = None,
+              checkpoint: str = None,
+              restart: bool = False,
+              shard: tuple = None,
+              session=None,
+              irreducible: bool = False,
+              kmesh: np.ndarray = None,
+              decouple: bool = False) -> dict:
     """tight binding solver for TBG
 
     Args:
@@ -235,76 +969,187 @@ def tb_solver(n_moire: int,
         datatype (DataType, optional): atom data type. Defaults to DataType.CORRU.
         engine (EngineType, optional): TB solver engine type. Defaults to EngineType.TBPLW.
         valley (EngineType, optional): valley concerned. Defaults to EngineType.VALLEYK1.
+        solver (SolverType, optional): eigen solver on each k point. Defaults to SolverType.DENSE.
+        n_eig (int, optional): number of bands closest to charge neutrality solved by `backend`,
+            SolverType.DAVIDSON or refined in PrecisionType.SINGLE, None for all bands of `backend`
+            and 10 bands otherwise. Defaults to None.
+        backend (str, optional): eigen solver backend of SolverType.DENSE registered in `moire_eigen`,
+            'auto' for autotuning. Defaults to None, the default solver of each engine.
+        precision (PrecisionType, optional): precision of the TBPLW hamiltonian and the dense eigen
+            solver. Defaults to PrecisionType.DOUBLE.
+        n_refine (int, optional): double precision refinement steps of the `n_eig` bands in
+            PrecisionType.SINGLE. Defaults to 0.
+        n_proc (int, optional): number of worker processes solving the k points of SolverType.DENSE,
+            None for `moire_parallel.N_PROC` (environment variable MTBMTBG_NPROC), or chosen by
+            `moire_parallel.set_schedule` if that is unset. Defaults to None.
+        n_thread (int, optional): BLAS threads of each process, None for `moire_parallel.N_THREAD`
+            (environment variable MTBMTBG_NTHREAD), or chosen by `moire_parallel.set_schedule` if that
+            is unset. Defaults to None.
+        band_range (tuple, optional): (start, stop) columns of the eigenvectors kept on each k point,
+            e.g. the flat bands. Defaults to None, all bands.
+        dmesh_file (str, optional): path of a .npy file the eigenvectors are written into, k point by
+            k point, instead of memory. 'dmesh' is then a read only np.memmap of it. Defaults to None.
+        checkpoint (str, optional): directory the finished k points are saved into, with the hash of
+            the inputs and the setup. Defaults to None.
+        restart (bool, optional): resume `checkpoint`, the finished k points are skipped and the setup
+            is reused. Defaults to False.
+        shard (tuple, optional): (i, n), solve only the i-th of n contiguous shards of the k points, see
+            `moire_shard`. Defaults to None, all k points.
+        session (MoireSession, optional): `moire_session.MoireSession` of `n_moire` and `datatype`, whose
+            atoms, pairs and constant matrices are reused. Defaults to None.
+        irreducible (bool, optional): solve only the C3z irreducible k points of the kmesh, about a third,
+            and unfold the eigenvalues and eigenvectors to the full kmesh. Defaults to False.
+        kmesh (np.ndarray, optional): k points solved instead of the ones of `n_k` and `disp`, 'kline' is
+            then 0. Defaults to None.
+        decouple (bool, optional): solve the two valley blocks of VALLEYC independently, leaving out the
+            intervalley block whose size is returned as 'coupling'. Defaults to False.
+
+    Raises:
+        Exception: single precision is only implemented for dense TBPLW.
+        Exception: irreducible kmesh is only implemented for TBPLW, disp=False and a single valley.
+        Exception: eigen solver backend is only used by SolverType.DENSE.
+        Exception: decoupled valleys are only implemented for dense double precision TBPLW VALLEYC.
+        Exception: the checkpoint to resume was written for other inputs.
 
     Returns:
         dict:         
         'emesh': np.array(emesh),
         'dmesh': np.array(dmesh),
         'kline': kline,
-        'trans': transmat_list,
-        'nbmap': neighbor_map
+        'nbmap': neighbor_map, indices of the G vectors G_m+i*mg1+j*mg2, see `moire_gk.set_neighbor_map`
+        'resid': residual of the `n_eig` bands on each k point (PrecisionType.SINGLE only)
+        'coupling': largest intervalley matrix element of the bands around charge neutrality on each
+            k point (`decouple` only), see `_cal_eigen_decoupled`
     """
-    start_time = time.process_time()
-    dmesh = []
-    emesh = []
-    kline = 0
-    emax = -1000
-    emin = 1000
-    count = 1
-
-    # load atom data
-    atom_pstn_list = mio.read_atom_pstn_list(n_moire, datatype)
-    # construct moire info
-    (_, m_basis_vecs, high_symm_pnts) = mset._set_moire(n_moire)
-    (all_nns, enlarge_atom_pstn_list) = mset.set_atom_neighbour_list(atom_pstn_list, m_basis_vecs)
-    (npair_dict, ndist_dict) = mset.set_relative_dis_ndarray(atom_pstn_list, enlarge_atom_pstn_list, all_nns)
-    # set up g list
-    o_g_vec_list = mgk.set_g_vec_list(n_g, m_basis_vecs)
-    # move to specific valley or combined valley
-    g_vec_list = _set_g_vec_list_valley(n_moire, o_g_vec_list, m_basis_vecs, valley)
-    # constant matrix dictionary
-    const_mtrx_dict = _set_const_mtrx(n_moire, npair_dict, ndist_dict, m_basis_vecs, g_vec_list, atom_pstn_list)
-    # constant list
-    (transmat_list, neighbor_map) = mgk.set_kmesh_neighbour(n_g, m_basis_vecs, o_g_vec_list)
-
-    if disp:
-        (kline, kmesh) = mgk.set_tb_disp_kmesh(n_k, high_symm_pnts)
-    else:
-        kmesh = mgk.set_kmesh(n_k, m_basis_vecs)
+    _check_solver(engine, solver, backend, precision, valley, decouple)
+    if irreducible and (engine != EngineType.TBPLW or shard is not None):
+        raise Exception("irreducible kmesh is only implemented for TBPLW without shards.")
 
-    n_atom = atom_pstn_list.shape[0]
-    n_band = g_vec_list.shape[0]*4
+    start_time = time.process_time()
+    resumed = False
+    if checkpoint is not None:
+        inputs = {
+            'n_moire': n_moire,
+            'n_g': n_g,
+            'n_k': n_k,
+            'disp': disp,
+            'datatype': datatype,
+            'engine': engine,
+            'valley': valley,
+            'solver': solver,
+            'n_eig': n_eig,
+            'backend': backend,
+            'precision': precision,
+            'n_refine': n_refine,
+            'band_range': band_range,
+            'shard': shard,
+            'irreducible': irreducible,
+            'decouple': decouple
+        }
+        arrays = [mio.read_atom_pstn_list(n_moire, datatype)]+([] if kmesh is None else [kmesh])
+        key = mckpt.set_input_key(inputs, *arrays)
+        resumed = mckpt.open_checkpoint(checkpoint, key, restart)
+    problem = mckpt.load_setup(checkpoint) if resumed else None
+    if problem is None:
+        structure = None if session is None else session.get_structure(n_moire, datatype)
+        problem = _set_tb_problem(n_moire, n_g, n_k, disp, datatype, valley, precision, structure, irreducible, kmesh)
+        if checkpoint is not None:
+            mckpt.save_setup(checkpoint, problem)
+    if shard is not None:
+        problem = dict(problem, kmesh=problem['kmesh'][mpar.set_shard(problem['kmesh'].shape[0], shard)])
+    (npair_dict, ndist_dict, const_mtrx_dict) = (problem['npair'], problem['ndist'], problem['const'])
+    kmesh = problem['kmesh']
+    n_atom = problem['n_atom']
+    n_band = problem['n_band']
     n_kpts = kmesh.shape[0]
     print("="*100)
     print("num of atoms".ljust(30), ":", n_atom)
     print("num of kpoints".ljust(30), ":", n_kpts)
+    if irreducible:
+        print("num of unfolded kpoints".ljust(30), ":", problem['unfold']['kmap'].size)
     print("num of bands".ljust(30), ":", n_band)
     print("="*100)
     setup_time = time.process_time()
 
-    for k_vec in kmesh:
-        print("k sampling process, counter:", count)
-        count += 1
-        hamk = _cal_hamiltonian_k(ndist_dict, npair_dict, const_mtrx_dict, k_vec, n_atom, engine)
-        eigen_val, eigen_vec = _cal_eigen_hamk(hamk, const_mtrx_dict['sr'], datatype, engine)
-        if np.max(eigen_val)>emax:
-            emax = np.max(eigen_val)
-        if np.min(eigen_val)<emin:
-            emin = np.min(eigen_val)
-        emesh.append(eigen_val)
-        dmesh.append(eigen_vec)
-    comp_time = time.process_time()
+    # the davidson seed is carried along the k path, so its k points are solved in order
+    n_proc = (mpar.N_PROC if n_proc is None else n_proc) if solver == SolverType.DENSE else 1
+    n_dim = {EngineType.TBPLW: n_band, EngineType.TBFULL: n_atom}.get(engine, 0)
+    schedule = mpar.set_schedule(n_dim, n_kpts, n_proc, mpar.N_THREAD if n_thread is None else n_thread)
+    print("processes x BLAS threads".ljust(30), ":", schedule['n_proc'], "x", schedule['n_thread'])
+    # the unfolded eigenvectors are written into `dmesh_file` instead
+    out_file = {} if dmesh_file is None or irreducible else {'dmesh': dmesh_file}
+    (k_index, done_file) = (None, None)
+    if checkpoint is not None:
+        # all results are written into the checkpoint as they are solved
+        names = ['emesh', 'dmesh', 'resid'] if precision == PrecisionType.SINGLE else ['emesh', 'dmesh']
+        names = names+['coupling'] if decouple else names
+        out_file = dict(mckpt.set_out_file(checkpoint, names), **out_file)
+        k_index = mckpt.set_todo(checkpoint, n_kpts, resumed)
+        done_file = os.path.join(checkpoint, mckpt.DONE_FILE)
+        print("k points done".ljust(30), ":", n_kpts-k_index.size)
+    with threadpool_limits(limits=schedule['n_thread']):
+        if schedule['n_proc']>1:
+            # the same k point solver on a process pool, results are in k order
+            shared = dict(const_mtrx_dict, r=npair_dict['r'], c=npair_dict['c'], dr=ndist_dict['dr'])
+            params = {
+                'n_atom': n_atom,
+                'datatype': datatype,
+                'engine': engine,
+                'backend': backend,
+                'precision': precision,
+                'n_eig': n_eig,
+                'n_refine': n_refine,
+                'band_range': band_range,
+                'decouple': decouple
+            }
+            wall_time = time.perf_counter()
+            ret_k = mpar.parallel_kmesh(_solve_kpnt,
+                                        kmesh,
+                                        shared,
+                                        params,
+                                        schedule['n_proc'],
+                                        n_thread=schedule['n_thread'],
+                                        out_file=out_file,
+                                        k_index=k_index,
+                                        done_file=done_file)
+            # the cpu time of the workers is invisible to the parent, report the wall time instead
+            comp_time = setup_time+time.perf_counter()-wall_time
+        else:
+            # written into arrays allocated at the first k point
+            kpnts = _iter_kpnts(problem, datatype, engine, solver, n_eig, backend, precision, n_refine, band_range,
+                                k_index, decouple)
+            ret_k = mpar.collect_kmesh(((i, ret) for (i, _, ret) in kpnts), n_kpts, out_file, done_file, mckpt.N_SAVE)
+            comp_time = time.process_time()
+    if checkpoint is not None:
+        # only the eigenvectors asked for in a file stay out of memory
+        ret_k = {
+            name: np.array(value) if name != 'dmesh' or dmesh_file is None else value
+            for (name, value) in ret_k.items()
+        }
+    if irreducible:
+        ret_k = _unfold_kmesh(problem, ret_k, dmesh_file)
+    (emesh, dmesh) = (ret_k['emesh'], ret_k['dmesh'])
 
     print("="*100)
-    print("emax =", emax, "emin =", emin)
+    print("emax =", np.max(emesh), "emin =", np.min(emesh))
+    if precision == PrecisionType.SINGLE:
+        print("max residual".ljust(30), ":", np.max(ret_k['resid']))
+    if decouple:
+        print("max intervalley coupling".ljust(30), ":", np.max(ret_k['coupling']))
     print("="*100)
     print("set up time:", setup_time-start_time, "comp time:", comp_time-setup_time)
+    print("processes x BLAS threads:", schedule['n_proc'], "x", schedule['n_thread'], "on", schedule['n_core'], "cores")
     print("="*100)
 
-    return {
-        'emesh': np.array(emesh),
-        'dmesh': np.array(dmesh),
-        'kline': kline,
-        'trans': transmat_list,
-        'nbmap': neighbor_map
-    }
\ No newline at end of file
+    ret = {
+        'emesh': emesh,
+        'dmesh': dmesh,
+        'kline': problem['kline'],
+        'nbmap': problem['nbmap']
+    }
+    if precision == PrecisionType.SINGLE:
+        ret['resid'] = ret_k['resid']
+    if decouple:
+        ret['coupling'] = ret_k['coupling']
+
+    return ret
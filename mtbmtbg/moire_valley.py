@@ -0,0 +1,215 @@
+import numpy as np
+import scipy.linalg as sla
+
+import mtbmtbg.moire_gk as mgk
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_setup as mset
+import mtbmtbg.moire_cont as mcont
+from mtbmtbg.moire_session import MoireSession
+from mtbmtbg.config import DataType, ValleyType
+
+
+def set_inversion_map(n_k: int) -> tuple:
+    """k -> -k on the kmesh of `moire_gk.set_kmesh`
+
+    Args:
+        n_k (int): n_k*n_k k points
+
+    Returns:
+        tuple: (kmap, gshift), -p = kmap[p]-G with G = gshift[p] in moire reciprocal coordinates
+    """
+
+    coords = np.array([(i, j) for i in range(n_k) for j in range(n_k)])
+    inv_coords = (-coords) % n_k
+    kmap = inv_coords[:, 0]*n_k+inv_coords[:, 1]
+    gshift = (inv_coords+coords)//n_k
+
+    return (kmap, gshift)
+
+
+def set_inversion_path(kmesh: np.ndarray) -> tuple:
+    """k points of a path closed under inversion
+
+    Args:
+        kmesh (np.ndarray): k points of the path
+
+    Returns:
+        tuple: (kmesh, kmap), the path followed by the -k points which are not on it, and the index of
+            -k of each path point
+    """
+
+    extra = []
+    kmap = np.empty(kmesh.shape[0], dtype=int)
+    for (i, k_vec) in enumerate(kmesh):
+        found = np.flatnonzero(np.all(np.isclose(kmesh, -k_vec), axis=1))
+        if found.size>0:
+            kmap[i] = found[0]
+        else:
+            kmap[i] = kmesh.shape[0]+len(extra)
+            extra.append(-k_vec)
+
+    return (np.concatenate([kmesh, np.reshape(extra, (-1, 2))]), kmap)
+
+
+def _set_g_inversion(o_g_vec_list: np.ndarray, m_basis_vecs: dict) -> np.ndarray:
+    """index of -G of each G in the Glist
+
+    Raises:
+        Exception: the Glist is not inversion symmetric.
+    """
+
+    g_coords = mgk.set_g_coords(o_g_vec_list, m_basis_vecs)
+    ginv = mgk.find_g_coords(mgk.set_g_table(g_coords), -g_coords)
+    if np.any(ginv<0):
+        raise Exception("Glist is not inversion symmetric.")
+
+    return ginv
+
+
+def _invert_vec(dmesh: np.ndarray, ginv: np.ndarray) -> np.ndarray:
+    """complex conjugated eigenvectors with the Glist inverted, rows are 4 blocks of the Glist"""
+
+    shape = dmesh.shape
+    vec = np.reshape(dmesh, shape[:-2]+(4, ginv.size, shape[-1]))[..., ginv, :]
+
+    return np.conj(vec).reshape(shape)
+
+
+def map_valley(ret: dict,
+               n_moire: int,
+               n_g: int,
+               kmap: np.ndarray,
+               gshift: np.ndarray = None,
+               datatype=DataType.CORRU,
+               valley=ValleyType.VALLEYK1,
+               session: MoireSession = None) -> dict:
+    """results of the opposite valley by time reversal
+
+    Time reversal maps the basis k+G+K of a valley onto -k-G-K, so the opposite valley at k is
+    the complex conjugate of `valley` at -k, with the Glist inverted. A point -p of the kmesh is
+    kmap[p]-G, the states of kmap[p] are moved by -G with the atomic phases, see
+    `moire_tb._set_shift_mtrx`.
+
+    Args:
+        ret (dict): {emesh, dmesh} of `moire_tb.tb_solver` for `valley`
+        n_moire (int): an integer describing the size of commensurate TBG systems
+        n_g (int): Glist size
+        kmap (np.ndarray): index of -k of each k point, see `set_inversion_map` and `set_inversion_path`
+        gshift (np.ndarray, optional): -k = kmesh[kmap]-G, G in moire reciprocal coordinates. Defaults to
+            None, -k is solved.
+        datatype (DataType, optional): atom data type. Defaults to DataType.CORRU.
+        valley (ValleyType, optional): valley of `ret`. Defaults to ValleyType.VALLEYK1.
+        session (MoireSession, optional): session of `n_moire` and `datatype`. Defaults to None.
+
+    Raises:
+        Exception: only a single valley is mapped.
+
+    Returns:
+        dict: {emesh, dmesh} of the opposite valley
+    """
+
+    if valley == ValleyType.VALLEYC:
+        raise Exception("only a single valley is mapped by time reversal.")
+    emesh = np.asarray(ret['emesh'])[kmap]
+    dmesh = ret['dmesh']
+    if np.ndim(dmesh) != 3:
+        return {'emesh': emesh, 'dmesh': np.asarray(dmesh)[kmap]}
+
+    session = MoireSession(n_moire, n_g, datatype, valley) if session is None else session
+    structure = session.get_structure(n_moire, datatype)
+    tb_const = session.get_const(n_g, valley)
+    ginv = _set_g_inversion(tb_const['o_glist'], structure['m_basis_vecs'])
+
+    dmesh = np.asarray(dmesh)[kmap]
+    if gshift is not None:
+        const = tb_const['const']
+        sr_cho = sla.cho_factor(const.get('sr_ref', const['sr']))
+        mg = np.array([structure['m_basis_vecs']['mg1'], structure['m_basis_vecs']['mg2']])
+        (g_list, p_group) = np.unique(gshift, axis=0, return_inverse=True)
+        for (i, g_coords) in enumerate(g_list):
+            if not np.any(g_coords):
+                continue
+            # computed once for each G
+            shift_mtrx = mtb._set_shift_mtrx(const, sr_cho, structure['atoms'][:, :2], -g_coords@mg)
+            p_list = np.flatnonzero(p_group.ravel() == i)
+            dmesh[p_list] = shift_mtrx@dmesh[p_list]
+
+    return {'emesh': emesh, 'dmesh': _invert_vec(dmesh, ginv)}
+
+
+def valley_solver(n_moire: int,
+                  n_g: int,
+                  n_k: int,
+                  disp: bool = True,
+                  datatype=DataType.CORRU,
+                  session: MoireSession = None,
+                  **kwargs) -> dict:
+    """TBPLW results of both valleys from a single VALLEYK1 solve
+
+    The kmesh is closed under inversion up to moire reciprocal vectors, so VALLEYK2 costs no
+    diagonalization. The -k points missing from the k path are added to the VALLEYK1 solve.
+
+    Args:
+        n_moire (int): an integer describing the size of commensurate TBG systems
+        n_g (int): Glist size
+        n_k (int): n_k
+        disp (bool, optional): whether calculate dispersion. Defaults to True.
+        datatype (DataType, optional): atom data type. Defaults to DataType.CORRU.
+        session (MoireSession, optional): session of `n_moire` and `datatype`. Defaults to None.
+        kwargs: other arguments of `moire_tb.tb_solver`
+
+    Returns:
+        dict: result of `moire_tb.tb_solver` for VALLEYK1, and {emesh_k2, dmesh_k2} for VALLEYK2
+    """
+
+    session = MoireSession(n_moire, n_g, datatype) if session is None else session
+    gshift = None
+    if disp:
+        (kline, kmesh) = mgk.set_tb_disp_kmesh(n_k, session.structure['high_symm_pnts'])
+        (kmesh, kmap) = set_inversion_path(kmesh)
+        full = mtb.tb_solver(n_moire, n_g, n_k, disp, datatype, session=session, kmesh=kmesh, **kwargs)
+        # the added -k points are left out of the VALLEYK1 results
+        ret = {
+            name: value[:kmap.size] if name in ('emesh', 'dmesh', 'resid') else value for (name, value) in full.items()
+        }
+        ret['kline'] = kline
+    else:
+        (kmap, gshift) = set_inversion_map(n_k)
+        full = ret = mtb.tb_solver(n_moire, n_g, n_k, disp, datatype, session=session, **kwargs)
+    ret_k2 = map_valley(full, n_moire, n_g, kmap, gshift, datatype, ValleyType.VALLEYK1, session)
+    ret['emesh_k2'] = ret_k2['emesh']
+    ret['dmesh_k2'] = ret_k2['dmesh']
+
+    return ret
+
+
+def cont_valley_solver(n_moire: int, n_g: int, n_k: int, disp: bool = True, **kwargs) -> dict:
+    """continuum model bands of both valleys from a single valley=1 solve
+
+    The valley -1 at k has the eigenvalues of the valley 1 at -k, the -k points missing from the
+    k points are added to the solve, so both valleys are one solver call and one cache entry.
+
+    Args:
+        n_moire (int): an integer describing the size of commensurate TBG systems
+        n_g (int): Glist size
+        n_k (int): n_k
+        disp (bool, optional): whether calculate dispersion. Defaults to True.
+        kwargs: other arguments of `moire_cont.cont_solver`
+
+    Returns:
+        dict: result of `moire_cont.cont_solver` for the valley 1, and {emesh_k2} for the valley -1
+    """
+
+    (_, m_basis_vecs, high_symm_pnts) = mset._set_moire(n_moire)
+    if disp:
+        (kline, kmesh) = mgk.set_tb_disp_kmesh(n_k, high_symm_pnts)
+    else:
+        (kline, kmesh) = (0, mgk.set_kmesh(n_k, m_basis_vecs))
+    (kmesh, kmap) = set_inversion_path(kmesh)
+    full = mcont.cont_solver(n_moire, n_g, n_k, disp, valley=1, kmesh=kmesh, **kwargs)
+    # the added -k points are left out of the valley 1 results
+    ret = {name: value[:kmap.size] if name in ('emesh', 'dmesh', 'resid') else value for (name, value) in full.items()}
+    ret['kline'] = kline
+    ret['emesh_k2'] = np.asarray(full['emesh'])[kmap]
+
+    return ret
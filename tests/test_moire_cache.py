@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import tempfile
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_cache as mcache
+from mtbmtbg.config import DataType, TBInfo
+
+
+class MoireCacheTest(unittest.TestCase):
+
+    def test_cache_key(self):
+        key = mcache.set_cache_key(mtb.tb_solver, 30, 3, 2, False)
+        # defaults and keywords give the same call
+        self.assertEqual(key, mcache.set_cache_key(mtb.tb_solver, 30, 3, 2, disp=False, datatype=DataType.CORRU))
+        self.assertEqual(key, mcache.set_cache_key(mtb.tb_solver, 30, 3, 2, False, n_proc=2))
+        self.assertNotEqual(key, mcache.set_cache_key(mtb.tb_solver, 30, 3, 2, False, DataType.RIGID))
+        self.assertNotEqual(key, mcache.set_cache_key(mtb.tb_solver, 30, 3, 2, False, keep=('emesh',)))
+        vpi_0 = TBInfo.VPI_0
+        try:
+            TBInfo.VPI_0 = vpi_0*1.1
+            self.assertNotEqual(key, mcache.set_cache_key(mtb.tb_solver, 30, 3, 2, False))
+        finally:
+            TBInfo.VPI_0 = vpi_0
+
+    def test_cached_call(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ret = mcache.cached_call(mtb.tb_solver, 30, 3, 2, False, n_proc=1, cache_dir=tmpdir)
+            start_time = time.perf_counter()
+            ret_cache = mcache.cached_call(mtb.tb_solver, 30, 3, 2, False, n_proc=1, cache_dir=tmpdir)
+            self.assertLess(time.perf_counter()-start_time, 1)
+            for name in ('emesh', 'dmesh', 'nbmap'):
+                self.assertTrue(np.array_equal(ret[name], ret_cache[name]))
+            self.assertEqual(ret_cache['kline'], 0)
+            ret_keep = mcache.cached_call(mtb.tb_solver, 30, 3, 2, False, keep=('emesh', 'kline'), cache_dir=tmpdir)
+            self.assertEqual(set(ret_keep), {'emesh', 'kline'})
+            self.assertEqual(len(os.listdir(tmpdir)), 2)
+            # explicit invalidation
+            key = mcache.set_cache_key(mtb.tb_solver, 30, 3, 2, False)
+            mcache.cache_invalidate(key, cache_dir=tmpdir)
+            self.assertIsNone(mcache.cache_load(key, cache_dir=tmpdir))
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+            mcache.cache_invalidate(cache_dir=tmpdir)
+            self.assertEqual(len(os.listdir(tmpdir)), 0)
+
+    def test_cache_evict(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for (i, key) in enumerate(['a', 'b', 'c']):
+                mcache.cache_save(key, {'emesh': np.zeros(1000)}, cache_dir=tmpdir)
+                os.utime(os.path.join(tmpdir, key+'.npz'), (i, i))
+            # 'a' is used again, 'b' is the least recently used
+            mcache.cache_load('a', cache_dir=tmpdir)
+            size = os.path.getsize(os.path.join(tmpdir, 'a.npz'))
+            mcache.cache_evict(2*size, cache_dir=tmpdir)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['a.npz', 'c.npz'])
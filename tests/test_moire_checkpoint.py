@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_checkpoint as mckpt
+from mtbmtbg.config import DataType
+
+
+class MoireCheckpointTest(unittest.TestCase):
+
+    def test_input_key(self):
+        key = mckpt.set_input_key({'n_g': 3, 'n_k': 2}, np.arange(4))
+        self.assertEqual(key, mckpt.set_input_key({'n_k': 2, 'n_g': 3}, np.arange(4)))
+        self.assertNotEqual(key, mckpt.set_input_key({'n_k': 2, 'n_g': 3}, np.arange(5)))
+        self.assertNotEqual(key, mckpt.set_input_key({'n_k': 2, 'n_g': 4}, np.arange(4)))
+
+    def test_checkpoint_restart(self):
+        n_moire = 30
+        n_g = 3
+        n_k = 3
+        ret = mtb.tb_solver(n_moire, n_g, n_k, False, DataType.CORRU, n_proc=1)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for n_proc in [1, 2]:
+                mtb.tb_solver(n_moire, n_g, n_k, False, DataType.CORRU, n_proc=n_proc, checkpoint=tmpdir)
+                done = np.load(os.path.join(tmpdir, mckpt.DONE_FILE))
+                self.assertTrue(np.all(done == 1))
+                # a preempted run: the last k points are lost
+                done[4:] = 0
+                np.save(os.path.join(tmpdir, mckpt.DONE_FILE), done)
+                emesh = np.load(os.path.join(tmpdir, "emesh.npy"), mmap_mode='r+')
+                emesh[4:] = 0
+                emesh.flush()
+                del emesh
+                ret_ckpt = mtb.tb_solver(n_moire,
+                                         n_g,
+                                         n_k,
+                                         False,
+                                         DataType.CORRU,
+                                         n_proc=n_proc,
+                                         checkpoint=tmpdir,
+                                         restart=True)
+                self.assertTrue(np.allclose(ret_ckpt['emesh'], ret['emesh']))
+                self.assertEqual(ret_ckpt['dmesh'].shape, ret['dmesh'].shape)
+            # inputs changed since the checkpoint
+            with self.assertRaises(Exception):
+                mtb.tb_solver(n_moire, 4, n_k, False, DataType.CORRU, n_proc=1, checkpoint=tmpdir, restart=True)
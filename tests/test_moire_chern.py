@@ -4,7 +4,9 @@ import unittest
 sys.path.append("..")
 
 import numpy as np
+import mtbmtbg.moire_tb as mtb
 import mtbmtbg.moire_chern as mchern
+from mtbmtbg.config import ValleyType
 
 
 class MoireChernTest(unittest.TestCase):
@@ -29,4 +31,27 @@ class MoireChernTest(unittest.TestCase):
         n_g = 5
         n_chern = 5
         cherns = mchern.cal_moire_chern(n_moire, n_g, n_k, n_chern)
-        self.assertTrue(np.allclose(cherns, np.array([-5, 1, 0, 1, 1, -1, -1, 0, 0, -2])))
\ No newline at end of file
+        self.assertTrue(np.allclose(cherns, np.array([-5, 1, 0, 1, 1, -1, -1, 0, 0, -2])))
+
+    def test_chern_irreducible(self):
+        n_moire = 30
+        n_k = 10
+        n_g = 5
+        n_chern = 5
+        cherns = mchern.cal_moire_chern(n_moire, n_g, n_k, n_chern, irreducible=True)
+        self.assertTrue(np.allclose(cherns, np.array([-5, 1, 0, 1, 1, -1, -1, 0, 0, -2])))
+
+    def test_irreducible_bands(self):
+        n_moire = 30
+        n_k = 4
+        n_g = 5
+        for valley in (ValleyType.VALLEYK1, ValleyType.VALLEYK2):
+            ret = mtb.tb_solver(n_moire, n_g, n_k, False, valley=valley, n_proc=1)
+            ret_irr = mtb.tb_solver(n_moire, n_g, n_k, False, valley=valley, n_proc=1, irreducible=True)
+            # the bands converged in the Glist agree, the ones near its cutoff are not periodic in k either
+            n_band = ret['emesh'].shape[1]//2
+            self.assertTrue(
+                np.allclose(ret['emesh'][:, n_band-5:n_band+5], ret_irr['emesh'][:, n_band-5:n_band+5], atol=1e-5))
+            self.assertEqual(ret['dmesh'].shape, ret_irr['dmesh'].shape)
+        with self.assertRaises(Exception):
+            mtb.tb_solver(n_moire, n_g, n_k, True, irreducible=True)
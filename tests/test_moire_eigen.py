@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+import scipy.sparse as sp
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_eigen as meig
+import mtbmtbg.moire_cont as mcont
+from mtbmtbg.config import DataType, EngineType, SolverType, PrecisionType
+
+
+def random_hermitian(n: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    mat = rng.normal(size=(n, n))+1j*rng.normal(size=(n, n))
+
+    return (mat+mat.conj().T)/2
+
+
+class MoireEigenTest(unittest.TestCase):
+
+    def test_backend_registry(self):
+        hamk = random_hermitian(60)
+        smat = np.identity(60)+0.01*random_hermitian(60, seed=1)
+        v_ref, _ = np.linalg.eigh(hamk)
+        for name in meig.candidate_backends(hamk):
+            v, w = meig.eigh(hamk, backend=name)
+            self.assertTrue(np.allclose(v, v_ref))
+            self.assertTrue(np.allclose(hamk@w, w*v))
+            v, w = meig.eigh(hamk, n_eig=6, backend=name)
+            self.assertTrue(np.allclose(v, v_ref[27:33]))
+        self.assertNotIn('numpy', meig.candidate_backends(hamk, smat))
+        for name in meig.candidate_backends(hamk, smat):
+            v, w = meig.eigh(hamk, smat, n_eig=6, sigma=0.0, backend=name)
+            self.assertTrue(np.allclose(hamk@w, smat@w*v))
+        hamk_sparse = sp.csr_matrix(hamk)
+        self.assertEqual(meig.candidate_backends(hamk_sparse, n_eig=6, sigma=0.0), ['eigsh'])
+        v, _ = meig.eigh(hamk_sparse, n_eig=6, sigma=0.0, backend='eigsh')
+        self.assertTrue(np.allclose(v, np.sort(v_ref[np.argsort(np.abs(v_ref))[:6]])))
+
+    def test_backend_autotune(self):
+        hamk = random_hermitian(40)
+        with tempfile.TemporaryDirectory() as path:
+            cache_path = os.path.join(path, "tune.json")
+            meig._TUNE_TABLE.clear()
+            name = meig.autotune_backend(hamk, n_eig=4, cache_path=cache_path)
+            self.assertIn(name, meig.EIGEN_BACKENDS)
+            with open(cache_path, "r") as f:
+                table = json.load(f)
+            self.assertEqual(list(table.values()), [name])
+            # a new process reads the winner back from disk
+            meig._TUNE_TABLE.clear()
+            self.assertEqual(meig.autotune_backend(hamk, n_eig=4, cache_path=cache_path), name)
+
+    def test_davidson_tbplw(self):
+        n_moire = 30
+        n_g = 4
+        n_k = 10
+        n_eig = 8
+        for datatype in [DataType.CORRU, DataType.RELAX]:
+            emesh = mtb.tb_solver(n_moire, n_g, n_k, True, datatype)['emesh']
+            ret = mtb.tb_solver(n_moire, n_g, n_k, True, datatype, solver=SolverType.DAVIDSON, n_eig=n_eig)
+            n_band = emesh.shape[1]
+            sigma = (emesh[0, n_band//2-1]+emesh[0, n_band//2])/2
+            self.assertEqual(ret['emesh'].shape, (emesh.shape[0], n_eig))
+            self.assertEqual(ret['dmesh'].shape, (emesh.shape[0], n_band, n_eig))
+            for (e_dense, e_davidson) in zip(emesh, ret['emesh']):
+                e_ref = np.sort(e_dense[np.argsort(np.abs(e_dense-sigma))[:n_eig]])
+                self.assertTrue(np.allclose(e_ref, e_davidson))
+
+    def test_davidson_seed(self):
+        n_eig = 6
+        hamk = np.diag(np.linspace(-1, 1, 200))+0.05*random_hermitian(200)
+        hamk_next = hamk+1e-3*random_hermitian(200, seed=1)
+        v_ref = np.linalg.eigvalsh(hamk_next)
+        sigma = 0.01
+        v, w = np.linalg.eigh(hamk)
+        x0 = w[:, np.sort(np.argsort(np.abs(v-sigma))[:n_eig+2])]
+        # the factorization of the previous hamiltonian is reused, only hamk_next@X is needed
+        precond = meig._set_shift_invert(hamk, None, sigma+1e-3)
+        rng = np.random.default_rng(2)
+        x_random = rng.normal(size=x0.shape)+1j*rng.normal(size=x0.shape)
+        n_iter = {}
+        for (name, x) in [('seed', x0), ('random', x_random)]:
+            v, _, converged, n_iter[name] = meig.davidson_eigh(hamk_next, x, sigma, precond=precond, n_eig=n_eig)
+            self.assertTrue(converged)
+            v = np.sort(v[np.argsort(np.abs(v-sigma))[:n_eig]])
+            self.assertTrue(np.allclose(v, np.sort(v_ref[np.argsort(np.abs(v_ref-sigma))[:n_eig]])))
+        self.assertLess(n_iter['seed'], n_iter['random'])
+
+    def test_backend_tbplw(self):
+        n_moire = 30
+        n_g = 4
+        n_k = 10
+        for datatype in [DataType.CORRU, DataType.RELAX]:
+            emesh = mtb.tb_solver(n_moire, n_g, n_k, True, datatype)['emesh']
+            ret = mtb.tb_solver(n_moire, n_g, n_k, True, datatype, backend='scipy_gvx')
+            self.assertTrue(np.allclose(emesh, ret['emesh']))
+            # only the bands around charge neutrality are solved
+            n_band = emesh.shape[1]
+            ret = mtb.tb_solver(n_moire, n_g, n_k, True, datatype, backend='scipy_gvx', n_eig=8)
+            self.assertEqual(ret['dmesh'].shape, (emesh.shape[0], n_band, 8))
+            self.assertTrue(np.allclose(emesh[:, n_band//2-4:n_band//2+4], ret['emesh']))
+        with self.assertRaises(Exception):
+            mtb.tb_solver(n_moire, n_g, n_k, True, solver=SolverType.DAVIDSON, backend='scipy_gvx')
+
+    def test_davidson_sparse(self):
+        n_moire = 10
+        n_g = 5
+        n_k = 5
+        emesh = mtb.tb_solver(n_moire, n_g, n_k, True, DataType.RIGID, engine=EngineType.TBSPARSE)['emesh']
+        ret = mtb.tb_solver(n_moire,
+                            n_g,
+                            n_k,
+                            True,
+                            DataType.RIGID,
+                            engine=EngineType.TBSPARSE,
+                            solver=SolverType.DAVIDSON)
+        self.assertTrue(np.allclose(np.sort(emesh, axis=1), ret['emesh']))
+
+    def test_single_precision(self):
+        n_moire = 30
+        n_g = 4
+        n_k = 5
+        n_eig = 8
+        for datatype in [DataType.CORRU, DataType.RELAX]:
+            emesh = mtb.tb_solver(n_moire, n_g, n_k, True, datatype)['emesh']
+            n_band = emesh.shape[1]
+            window = np.arange(n_band//2-n_eig//2, n_band//2+n_eig//2)
+            ret = mtb.tb_solver(n_moire, n_g, n_k, True, datatype, n_eig=n_eig, precision=PrecisionType.SINGLE)
+            self.assertEqual(ret['dmesh'].dtype, np.complex64)
+            self.assertEqual(ret['resid'].shape, (emesh.shape[0], n_eig))
+            self.assertTrue(np.allclose(emesh, ret['emesh'], atol=1e-3))
+            ret = mtb.tb_solver(n_moire,
+                                n_g,
+                                n_k,
+                                True,
+                                datatype,
+                                n_eig=n_eig,
+                                precision=PrecisionType.SINGLE,
+                                n_refine=2)
+            self.assertEqual(ret['dmesh'].dtype, np.complex128)
+            self.assertTrue(np.all(ret['resid']<1e-9))
+            self.assertTrue(np.allclose(emesh[:, window], ret['emesh'][:, window], rtol=0, atol=1e-9))
+        emesh = mcont.cont_solver(n_moire, n_g, n_k)['emesh']
+        ret = mcont.cont_solver(n_moire, n_g, n_k, precision=PrecisionType.SINGLE, n_eig=n_eig, n_refine=2)
+        n_band = emesh.shape[1]
+        window = np.arange(n_band//2-n_eig//2, n_band//2+n_eig//2)
+        self.assertTrue(np.all(ret['resid']<1e-9))
+        self.assertTrue(np.allclose(emesh[:, window], ret['emesh'][:, window], rtol=0, atol=1e-9))
@@ -65,3 +65,52 @@ class MoireGKTest(unittest.TestCase):
         self.assertEqual(kline1[2*n_k1], kline3[2*n_k3])
         self.assertEqual(kline1[3*n_k1], kline2[3*n_k2])
         self.assertEqual(kline1[3*n_k1], kline3[3*n_k3])
+
+    def test_kmesh_neighbour(self):
+        ((rt_angle_r, rt_angle_d), m_basis_vecs, high_symm_pnts) = mset._set_moire(30)
+        glist = mgk.set_g_vec_list(4, m_basis_vecs)
+        (shift_list, neighbor_map) = mgk.set_kmesh_neighbour(4, m_basis_vecs, glist)
+        err = 0.02*np.dot(m_basis_vecs['mg1'], m_basis_vecs['mg1'])
+        # G_i+G_m is G_shift[m, i], or outside the Glist
+        for m in range(glist.shape[0]):
+            diff = np.linalg.norm(glist[:, None, :]+glist[m]-glist[None, :, :], axis=2)
+            self.assertTrue(
+                np.array_equal(shift_list[m], np.where(np.any(diff<err, axis=1), np.argmin(diff, axis=1), -1)))
+        self.assertTrue(np.array_equal(mgk.set_g_shift(glist, m_basis_vecs, (1, 1)), shift_list[neighbor_map[0, 1, 1]]))
+        inside = neighbor_map[:, 1, 0] >= 0
+        self.assertTrue(np.allclose(glist[neighbor_map[inside, 1, 0]], glist[inside]+m_basis_vecs['mg1']))
+
+    def test_glist_order(self):
+        ((rt_angle_r, rt_angle_d), m_basis_vecs, high_symm_pnts) = mset._set_moire(30)
+        glist = mgk.set_g_vec_list(5, m_basis_vecs)
+        g_coords = mgk.set_g_int_list(5)
+        self.assertTrue(np.array_equal(mgk.set_g_coords(glist, m_basis_vecs), g_coords))
+        # the same G vectors by shells of |G|, G[0] = 0 first
+        glist_shell = mgk.set_g_vec_list(5, m_basis_vecs, shell=True)
+        g_norm = np.linalg.norm(glist_shell, axis=1)
+        self.assertTrue(np.allclose(glist_shell[0], np.array([0.0, 0.0])))
+        self.assertTrue(np.all(np.diff(g_norm)> -1e-9))
+        self.assertEqual(set(map(tuple, mgk.set_g_int_list(5, True, m_basis_vecs))), set(map(tuple, g_coords)))
+        # constant time lookup of integer coordinates
+        g_table = mgk.set_g_table(g_coords)
+        self.assertTrue(np.array_equal(mgk.find_g_coords(g_table, g_coords), np.arange(glist.shape[0])))
+        coords = np.array([[5, 0], [-4, -4], [4, -4]])
+        self.assertTrue(np.array_equal(mgk.find_g_coords(g_table, coords) >= 0, [False, True, False]))
+
+    def test_kmesh_irreducible(self):
+        ((rt_angle_r, rt_angle_d), m_basis_vecs, high_symm_pnts) = mset._set_moire(30)
+        n_k = 10
+        kmesh = mgk.set_kmesh(n_k, m_basis_vecs)
+        irr = mgk.set_kmesh_irreducible(n_k, m_basis_vecs)
+        self.assertEqual(irr['kmesh'].shape[0], 34)
+        self.assertEqual(np.sum(irr['weight']), n_k*n_k)
+        self.assertTrue(np.allclose(kmesh[irr['kidx']], irr['kmesh']))
+        # each full kmesh point is a rotated irreducible point up to a moire reciprocal vector
+        c3 = np.array([[-1/2, -np.sqrt(3)/2], [np.sqrt(3)/2, -1/2]])
+        for p in range(n_k*n_k):
+            k_vec = np.linalg.matrix_power(c3, irr['rot'][p])@irr['kmesh'][irr['kmap'][p]]
+            g_vec = kmesh[p]-k_vec
+            self.assertTrue(
+                np.allclose(
+                    mgk.set_g_coords(g_vec[None, :], m_basis_vecs)@np.array([m_basis_vecs['mg1'], m_basis_vecs['mg2']]),
+                    g_vec))
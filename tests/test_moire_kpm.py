@@ -0,0 +1,52 @@
+import sys
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+from scipy import sparse
+import mtbmtbg.moire_setup as mset
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_io as mio
+import mtbmtbg.moire_kpm as mkpm
+from mtbmtbg.config import DataType, EngineType
+
+
+class MoireKPMTest(unittest.TestCase):
+
+    def test_kpm_moments(self):
+        n_moire = 10
+        n_moments = 32
+        atom_pstn_list = mio.read_atom_pstn_list(n_moire, DataType.RIGID)
+        (_, m_basis_vecs, _) = mset._set_moire(n_moire)
+        (all_nns, enlarge_atom_pstn_list) = mset.set_atom_neighbour_list(atom_pstn_list, m_basis_vecs)
+        (npair_dict, ndist_dict) = mset.set_relative_dis_ndarray(atom_pstn_list, enlarge_atom_pstn_list, all_nns)
+        n_atom = atom_pstn_list.shape[0]
+        hopping = mtb._sk_integral(ndist_dict)
+        tr_mtrx = sparse.csr_matrix((hopping, (npair_dict['r'], npair_dict['c'])), shape=(n_atom, n_atom))
+        hamk = mtb._cal_hamiltonian_k(ndist_dict, npair_dict, {
+            'gr': None,
+            'tr': tr_mtrx
+        }, np.array([0.0, 0.0]), n_atom, EngineType.TBSPARSE)
+        (a, b) = mkpm._set_spectral_bounds(hamk)
+        v = np.linalg.eigvalsh(hamk.toarray())
+        self.assertTrue(np.all(np.abs(v-b)<a))
+        # exact moments of the total DOS
+        exact = np.mean(np.cos(np.arange(n_moments)[:, np.newaxis]*np.arccos((v-b)/a)), axis=1)
+        group_idx = np.repeat(np.arange(4), n_atom//4)
+        moments = mkpm.cal_kpm_moments(hamk, n_moments, group_idx, 4, a, b, 32, 8, np.random.default_rng(0))
+        # stochastic error ~ 1/sqrt(n_atom*n_random)
+        self.assertTrue(np.allclose(np.mean(moments, axis=0), exact, atol=2e-2))
+
+    def test_kpm_dos(self):
+        ret = mkpm.kpm_solver(10, n_moments=256, n_random=8, datatype=DataType.RIGID, seed=0)
+        d_energy = ret['energy'][1]-ret['energy'][0]
+        self.assertTrue(np.abs(np.sum(ret['dos'])*d_energy-1)<1e-2)
+        self.assertTrue(np.all(ret['dos']> -1e-3))
+        # no states outside the spectral bounds
+        ret = mkpm.kpm_solver(10, n_moments=64, n_random=2, e_range=(-100, 100), datatype=DataType.RIGID, seed=0)
+        self.assertFalse(np.any(np.isnan(ret['dos'])))
+        self.assertTrue(np.all(ret['dos'][[0, -1]] == 0))
+        for group in mkpm.SUBLATTICES+tuple(mkpm.LAYERS):
+            self.assertEqual(ret['ldos'][group].shape, ret['energy'].shape)
+        self.assertTrue(np.allclose((ret['ldos']['layer1']+ret['ldos']['layer2'])/2, ret['dos']))
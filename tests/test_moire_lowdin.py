@@ -0,0 +1,42 @@
+import sys
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_lowdin as mlow
+from mtbmtbg.config import DataType
+
+
+class MoireLowdinTest(unittest.TestCase):
+
+    def test_lowdin_flat_bands(self):
+        n_moire = 30
+        n_g = 4
+        n_k = 5
+        emesh = mtb.tb_solver(n_moire, n_g, n_k, True, DataType.CORRU)['emesh']
+        n_band = emesh.shape[1]
+        e_flat = emesh[:, n_band//2-1:n_band//2+1]
+        for order in [2, None]:
+            ret = mlow.lowdin_solver(n_moire, n_g, n_k, g_cut=2.0, order=order, cal_resid=True)
+            n_low = ret['emesh'].shape[1]
+            self.assertTrue(n_low<n_band)
+            self.assertEqual(ret['resid'].shape, ret['emesh'].shape)
+            e_low = ret['emesh'][:, n_low//2-1:n_low//2+1]
+            # within 1 meV
+            self.assertTrue(np.max(np.abs(e_low-e_flat))<1e-3)
+
+    def test_lowdin_neumann_fallback(self):
+        rng = np.random.default_rng(0)
+        n_p = 8
+        n_q = 16
+        hamk = rng.normal(size=(n_p+n_q, n_p+n_q))+1j*rng.normal(size=(n_p+n_q, n_p+n_q))
+        hamk = (hamk+hamk.conj().T)/2
+        # strong coupling between the high energy blocks, the Neumann series diverges
+        hamk[n_p:, n_p:] *= 10
+        hamk_blocks = {'pp': hamk[:n_p, :n_p], 'pq': hamk[:n_p, n_p:], 'qq': hamk[n_p:, n_p:]}
+        (h_exact, s_exact, _) = mlow.lowdin_fold(hamk_blocks, None, 0.0, None)
+        (h_eff, s_eff, _) = mlow.lowdin_fold(hamk_blocks, None, 0.0, 2)
+        self.assertTrue(np.allclose(h_exact, h_eff))
+        self.assertTrue(np.allclose(s_exact, s_eff))
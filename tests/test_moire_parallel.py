@@ -0,0 +1,94 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_cont as mcont
+import mtbmtbg.moire_parallel as mpar
+from mtbmtbg.config import DataType, EngineType
+
+
+class MoireParallelTest(unittest.TestCase):
+
+    def test_parallel_kmesh(self):
+        n_moire = 30
+        n_g = 3
+        n_k = 3
+        for datatype in [DataType.CORRU, DataType.RELAX]:
+            ret = mtb.tb_solver(n_moire, n_g, n_k, False, datatype, n_proc=1)
+            ret_par = mtb.tb_solver(n_moire, n_g, n_k, False, datatype, n_proc=2)
+            self.assertTrue(np.allclose(ret['emesh'], ret_par['emesh']))
+            self.assertEqual(ret['dmesh'].shape, ret_par['dmesh'].shape)
+
+    def test_parallel_kmesh_full(self):
+        n_moire = 10
+        n_g = 3
+        n_k = 2
+        for (engine, backend) in [(EngineType.TBFULL, None), (EngineType.TBFULL, 'numpy'), (EngineType.TBSPARSE, None),
+                                  (EngineType.TBSPARSE, 'eigsh')]:
+            ret = mtb.tb_solver(n_moire, n_g, n_k, False, DataType.RIGID, engine=engine, backend=backend, n_proc=1)
+            ret_par = mtb.tb_solver(n_moire, n_g, n_k, False, DataType.RIGID, engine=engine, backend=backend, n_proc=2)
+            self.assertTrue(np.allclose(np.sort(ret['emesh'], axis=1), np.sort(ret_par['emesh'], axis=1)))
+            self.assertEqual(ret['dmesh'].shape, ret_par['dmesh'].shape)
+            if engine == EngineType.TBFULL:
+                # the full TB eigenvectors are never kept
+                self.assertEqual(ret['dmesh'].shape, (n_k*n_k,))
+
+    def test_schedule(self):
+        # small matrices: one BLAS thread per process, the cores go to the k points
+        self.assertEqual(mpar.set_schedule(200, 100, n_core=16), {'n_proc': 16, 'n_thread': 1, 'n_core': 16})
+        # large matrices: BLAS threads first
+        self.assertEqual(mpar.set_schedule(8000, 100, n_core=16), {'n_proc': 2, 'n_thread': 8, 'n_core': 16})
+        # cores left over by few k points go back to BLAS
+        self.assertEqual(mpar.set_schedule(200, 4, n_core=16), {'n_proc': 4, 'n_thread': 4, 'n_core': 16})
+        # given values are kept
+        self.assertEqual(mpar.set_schedule(200, 100, n_proc=2, n_core=16)['n_thread'], 8)
+        self.assertEqual(mpar.set_schedule(200, 100, n_thread=4, n_core=16)['n_proc'], 4)
+        ret = mcont.cont_solver(30, 5, 3, n_proc=1)
+        ret_par = mcont.cont_solver(30, 5, 3, n_proc=2)
+        self.assertTrue(np.allclose(ret['emesh'], ret_par['emesh']))
+
+    def test_iter_bands(self):
+        n_moire = 30
+        n_g = 3
+        n_k = 3
+        n_kpts = 3*n_k+1
+        ret = mtb.tb_solver(n_moire, n_g, n_k, True, DataType.CORRU, n_proc=1)
+        bands = mpar.collect_bands(mtb.iter_bands(n_moire, n_g, n_k, True, DataType.CORRU), n_kpts)
+        self.assertTrue(np.allclose(ret['emesh'], bands['emesh']))
+        self.assertEqual(ret['dmesh'].shape, bands['dmesh'].shape)
+        self.assertEqual(bands['kmesh'].shape, (n_kpts, 2))
+        ret = mcont.cont_solver(n_moire, n_g, n_k, n_proc=1)
+        bands = mpar.collect_bands(mcont.iter_bands(n_moire, n_g, n_k, vec=False), n_kpts)
+        self.assertTrue(np.allclose(ret['emesh'], bands['emesh']))
+        self.assertNotIn('dmesh', bands)
+
+    def test_dmesh_file(self):
+        n_moire = 30
+        n_g = 3
+        n_k = 3
+        band_range = (20, 28)
+        ret = mtb.tb_solver(n_moire, n_g, n_k, False, DataType.CORRU, n_proc=1)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for n_proc in [1, 2]:
+                dmesh_file = os.path.join(tmpdir, "dmesh"+str(n_proc)+".npy")
+                ret_file = mtb.tb_solver(n_moire,
+                                         n_g,
+                                         n_k,
+                                         False,
+                                         DataType.CORRU,
+                                         n_proc=n_proc,
+                                         band_range=band_range,
+                                         dmesh_file=dmesh_file)
+                self.assertIsInstance(ret_file['dmesh'], np.memmap)
+                self.assertEqual(ret_file['dmesh'].shape, (n_k*n_k, ret['dmesh'].shape[1], 8))
+                self.assertTrue(np.allclose(ret_file['emesh'], ret['emesh']))
+                # eigenvectors are fixed up to a phase
+                overlap = np.abs(np.sum(ret['dmesh'][:, :, 20:28].conj()*ret_file['dmesh'], axis=1))
+                self.assertTrue(np.allclose(overlap, 1))
+                self.assertTrue(np.allclose(np.load(dmesh_file), ret_file['dmesh']))
+                del ret_file
@@ -0,0 +1,46 @@
+import sys
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_path as mpath
+
+
+class MoirePathTest(unittest.TestCase):
+
+    def test_refine_score(self):
+        kline = np.linspace(0, 1, 5)
+        corner = np.array([True, False, False, False, True])
+        emesh = np.zeros((5, 1))
+        emesh[2] = 1e-2
+        dmesh = np.ones((5, 1, 1))
+        score = mpath.set_refine_score(kline, emesh, dmesh, corner, tol=1e-3)
+        self.assertTrue(np.allclose(score, [5, 10, 10, 5]))
+        # a band changing its character
+        dmesh = np.zeros((5, 2, 1))
+        dmesh[:3, 0] = 1
+        dmesh[3:] = [[0.6], [0.8]]
+        score = mpath.set_refine_score(kline, np.zeros((5, 1)), dmesh, corner, ovl_tol=0.9)
+        self.assertTrue(np.allclose(score, [0, 0, 4, 0]))
+
+    def test_adaptive_path(self):
+        n_moire = 30
+        n_g = 4
+        ref = mtb.tb_solver(n_moire, n_g, 40, True)
+        ret = mpath.adaptive_path_solver(n_moire, n_g, 5, max_kpts=52)
+        n_kpts = ret['kline'].size
+        self.assertTrue(n_kpts <= 52)
+        self.assertTrue(np.all(np.diff(ret['kline'])>0))
+        self.assertTrue(np.allclose(ret['kline'][ret['corners']], ref['kline'][::40]))
+        # the refined path interpolates the bands better than a uniform one of the same size
+        uniform = mtb.tb_solver(n_moire, n_g, (n_kpts-1)//3, True)
+        n_band = ref['emesh'].shape[1]
+        err = []
+        for (kline, emesh) in ((ret['kline'], ret['emesh']), (uniform['kline'], uniform['emesh'])):
+            err.append(
+                max(
+                    np.max(np.abs(np.interp(ref['kline'], kline, emesh[:, i])-ref['emesh'][:, i]))
+                    for i in range(n_band//2-2, n_band//2+2)))
+        self.assertTrue(err[0]<err[1])
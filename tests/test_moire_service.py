@@ -0,0 +1,66 @@
+import sys
+import json
+import asyncio
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+import mtbmtbg.moire_gk as mgk
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_analysis as manal
+from mtbmtbg.moire_service import MoireService
+from mtbmtbg.config import DataType
+
+
+class MoireServiceTest(unittest.TestCase):
+
+    def test_bands_batch(self):
+        n_moire = 30
+        n_g = 3
+        ret = mtb.tb_solver(n_moire, n_g, 2, disp=False, n_proc=1)
+
+        async def query(service):
+            kmesh = mgk.set_kmesh(2, service.get_session(n_moire, n_g).structure['m_basis_vecs'])
+            emesh = await asyncio.gather(service.bands(n_moire, n_g, kmesh[:1]), service.bands(n_moire, n_g, kmesh[1:]))
+            mpot = await service.run(manal.analyze_moire_potential, n_moire, n_g)
+            return (np.concatenate(emesh), mpot)
+
+        service = MoireService()
+        (emesh, mpot) = asyncio.run(query(service))
+        service.close()
+        self.assertTrue(np.allclose(emesh, ret['emesh']))
+        # the two requests are solved as one batch of the warm session
+        self.assertEqual(service.n_batch, 1)
+        self.assertEqual(len(service.sessions), 1)
+        self.assertEqual(mpot['glist'].shape[0]*4, emesh.shape[1])
+
+    def test_session_lru(self):
+        service = MoireService(max_sessions=1)
+        session = service.get_session(30, 3)
+        self.assertIs(service.get_session(30, 3), session)
+        service.get_session(30, 3, DataType.RIGID)
+        self.assertEqual(list(service.sessions), [(30, DataType.RIGID)])
+        service.close()
+
+    def test_serve(self):
+
+        async def query(service):
+            server = await service.serve()
+            port = server.sockets[0].getsockname()[1]
+            (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+            writer.write((json.dumps({'job': 'dos', 'n_moire': 30, 'n_g': 3, 'n_k': 2, 'n_bin': 10})+'\n').encode())
+            writer.write((json.dumps({'job': 'chern'})+'\n').encode())
+            await writer.drain()
+            replies = [json.loads(await reader.readline()) for _ in range(2)]
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return replies
+
+        service = MoireService()
+        (dos, error) = asyncio.run(query(service))
+        service.close()
+        self.assertEqual(len(dos['dos']), 10)
+        self.assertAlmostEqual(np.sum(dos['dos'])*(dos['energy'][1]-dos['energy'][0]), 1)
+        self.assertIn('error', error)
@@ -0,0 +1,32 @@
+import sys
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_analysis as manal
+from mtbmtbg.moire_session import MoireSession
+from mtbmtbg.config import DataType, ValleyType
+
+
+class MoireSessionTest(unittest.TestCase):
+
+    def test_session_reuse(self):
+        n_moire = 30
+        n_g = 3
+        session = MoireSession(n_moire, n_g)
+        ret = mtb.tb_solver(n_moire, n_g, 2, disp=False, n_proc=1)
+        ret_session = mtb.tb_solver(n_moire, n_g, 2, disp=False, n_proc=1, session=session)
+        self.assertTrue(np.allclose(ret['emesh'], ret_session['emesh']))
+        structure = session.structure
+        mpot = manal.analyze_moire_potential(n_moire, n_g)
+        mpot_session = manal.analyze_moire_potential(n_moire, n_g, session=session)
+        self.assertTrue(np.allclose(mpot['mpot']['gamma']['u1'], mpot_session['mpot']['gamma']['u1']))
+        band = manal.analyze_band_convergence(n_moire, n_g, valley=ValleyType.VALLEYK2, session=session)
+        self.assertEqual(band['band']['gamma'].shape, (mpot['glist'].shape[0],))
+        # the structure is set up once, the constant matrices once per valley
+        self.assertIs(session.structure, structure)
+        self.assertEqual(len(session.structure['const']), 2)
+        with self.assertRaises(Exception):
+            mtb.tb_solver(n_moire, n_g, 2, datatype=DataType.RIGID, session=session)
@@ -0,0 +1,62 @@
+import os
+import sys
+import subprocess
+import tempfile
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_cont as mcont
+import mtbmtbg.moire_shard as mshard
+import mtbmtbg.moire_parallel as mpar
+
+
+def run_shard_process(args: list):
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(".."))
+    subprocess.run([sys.executable, "-m", "mtbmtbg.moire_shard"]+args, env=env, check=True, capture_output=True)
+
+
+class MoireShardTest(unittest.TestCase):
+
+    def test_set_shard(self):
+        shards = [mpar.set_shard(10, (i, 3)) for i in range(3)]
+        self.assertTrue(np.array_equal(np.concatenate(shards), np.arange(10)))
+        self.assertEqual(mshard.parse_shard("1/3"), (1, 3))
+        self.assertEqual(mshard.shard_jobs(list("abcde"), (0, 2)), list("abc"))
+        with self.assertRaises(Exception):
+            mpar.set_shard(10, (3, 3))
+
+    def test_shard_processes(self):
+        n_shard = 3
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = [os.path.join(tmpdir, "tb"+str(i)+".npz") for i in range(n_shard)]
+            for (i, path) in enumerate(paths):
+                run_shard_process([
+                    "tb", "--shard",
+                    str(i)+"/"+str(n_shard), "--out", path, "n_moire=30", "n_g=3", "n_k=2", "disp=False"
+                ])
+            ret = mtb.tb_solver(30, 3, 2, disp=False, n_proc=1)
+            ret_merged = mshard.merge_shards(paths[::-1])
+            self.assertTrue(np.allclose(ret['emesh'], ret_merged['emesh']))
+            self.assertEqual(ret['dmesh'].shape, ret_merged['dmesh'].shape)
+            self.assertTrue(np.allclose(ret['nbmap'], ret_merged['nbmap']))
+            self.assertEqual(ret_merged['kline'], 0)
+            # merged from the command line
+            merged_path = os.path.join(tmpdir, "tb.npz")
+            run_shard_process(["merge"]+paths+["--out", merged_path])
+            self.assertTrue(np.allclose(np.load(merged_path)['emesh'], ret['emesh']))
+            # a missing shard
+            with self.assertRaises(Exception):
+                mshard.merge_shards(paths[:2])
+            # a shard run with other inputs
+            mshard.run_shard('cont', (2, n_shard), paths[2], n_moire=30, n_g=3, n_k=2)
+            with self.assertRaises(Exception):
+                mshard.merge_shards(paths)
+            for (i, path) in enumerate(paths[:2]):
+                mshard.run_shard('cont', (i, n_shard), path, n_moire=30, n_g=3, n_k=2)
+            ret = mcont.cont_solver(30, 3, 2, n_proc=1)
+            ret_merged = mshard.merge_shards(paths)
+            self.assertTrue(np.allclose(ret['emesh'], ret_merged['emesh']))
+            self.assertTrue(np.allclose(ret['kline'], ret_merged['kline']))
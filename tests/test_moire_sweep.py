@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_sweep as msweep
+from mtbmtbg.config import DataType, ValleyType
+
+
+class MoireSweepTest(unittest.TestCase):
+
+    def test_sweep_order(self):
+        job_small = (30, DataType.CORRU, ValleyType.VALLEYK1, 3, 2)
+        job_large = (50, DataType.CORRU, ValleyType.VALLEYK1, 3, 2)
+        job_combv = (30, DataType.CORRU, ValleyType.VALLEYC, 3, 2)
+        self.assertGreater(msweep.estimate_cost(job_large), msweep.estimate_cost(job_small))
+        self.assertGreater(msweep.estimate_cost(job_combv), msweep.estimate_cost(job_small))
+        job_k2 = (30, DataType.CORRU, ValleyType.VALLEYK2, 3, 2)
+        groups = msweep._set_groups([job_small, job_large, job_k2])
+        # the jobs of one structure are a single task
+        self.assertEqual(groups, [[job_large], [job_small, job_k2]])
+
+    def test_sweep_solver(self):
+        jobs = [(30, DataType.CORRU, ValleyType.VALLEYK1, 3, 2), (30, DataType.CORRU, ValleyType.VALLEYK2, 3, 2),
+                (30, DataType.CORRU, ValleyType.VALLEYK1, 3, 3), (31, DataType.CORRU, ValleyType.VALLEYK1, 3, 2)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for n_proc in [1, 2]:
+                paths = msweep.sweep_solver(jobs, tmpdir, disp=False, n_proc=n_proc)
+                self.assertEqual(len(paths), len(jobs))
+                for job in jobs:
+                    path = paths[msweep.set_job_name(job)]
+                    self.assertTrue(os.path.exists(path))
+                    (n_moire, datatype, valley, n_g, n_k) = job
+                    ret = mtb.tb_solver(n_moire, n_g, n_k, False, datatype, valley=valley, n_proc=1)
+                    self.assertTrue(np.allclose(np.load(path)['emesh'], ret['emesh']))
@@ -0,0 +1,70 @@
+import sys
+import unittest
+
+sys.path.append("..")
+
+import numpy as np
+import mtbmtbg.moire_tb as mtb
+import mtbmtbg.moire_cont as mcont
+import mtbmtbg.moire_valley as mval
+from mtbmtbg.config import ValleyType
+
+
+class MoireValleyTest(unittest.TestCase):
+
+    def test_inversion_map(self):
+        n_k = 4
+        (kmap, gshift) = mval.set_inversion_map(n_k)
+        coords = np.array([(i, j) for i in range(n_k) for j in range(n_k)])
+        # -p = kmap[p]-G
+        self.assertTrue(np.array_equal(-coords, coords[kmap]-n_k*gshift))
+        self.assertTrue(np.array_equal(kmap[kmap], np.arange(n_k*n_k)))
+
+    def test_valley_kmesh(self):
+        n_moire = 30
+        n_g = 5
+        n_k = 4
+        ret = mval.valley_solver(n_moire, n_g, n_k, disp=False)
+        ret_k2 = mtb.tb_solver(n_moire, n_g, n_k, disp=False, valley=ValleyType.VALLEYK2)
+        n_band = ret['emesh'].shape[1]
+        bands = slice(n_band//2-5, n_band//2+5)
+        self.assertTrue(np.allclose(ret['emesh_k2'][:, bands], ret_k2['emesh'][:, bands], atol=1e-5))
+        # the flat band states span the same space
+        for (vec, vec_k2) in zip(ret['dmesh_k2'], ret_k2['dmesh']):
+            (vec, vec_k2) = (vec[:, n_band//2-1:n_band//2+1], vec_k2[:, n_band//2-1:n_band//2+1])
+            overlap = np.linalg.lstsq(vec, vec_k2, rcond=None)[0]
+            self.assertTrue(np.allclose(vec@overlap, vec_k2, atol=1e-4))
+
+    def test_valley_path(self):
+        n_moire = 30
+        n_g = 5
+        n_k = 4
+        ret = mval.valley_solver(n_moire, n_g, n_k, disp=True)
+        ret_k2 = mtb.tb_solver(n_moire, n_g, n_k, disp=True, valley=ValleyType.VALLEYK2)
+        self.assertTrue(np.allclose(ret['kline'], ret_k2['kline']))
+        self.assertEqual(ret['emesh'].shape, ret_k2['emesh'].shape)
+        self.assertTrue(np.allclose(ret['emesh_k2'], ret_k2['emesh'], atol=1e-10))
+
+    def test_cont_valley_path(self):
+        n_moire = 30
+        n_g = 5
+        n_k = 4
+        ret = mval.cont_valley_solver(n_moire, n_g, n_k)
+        ret_k2 = mcont.cont_solver(n_moire, n_g, n_k, valley=-1)
+        self.assertTrue(np.allclose(ret['kline'], ret_k2['kline']))
+        self.assertTrue(np.allclose(ret['emesh_k2'], ret_k2['emesh'], atol=1e-10))
+
+    def test_decoupled_valleys(self):
+        n_moire = 30
+        n_g = 5
+        n_k = 2
+        ret = mtb.tb_solver(n_moire, n_g, n_k, valley=ValleyType.VALLEYC)
+        ret_dc = mtb.tb_solver(n_moire, n_g, n_k, valley=ValleyType.VALLEYC, decouple=True)
+        self.assertEqual(ret['emesh'].shape, ret_dc['emesh'].shape)
+        self.assertEqual(ret['dmesh'].shape, ret_dc['dmesh'].shape)
+        self.assertTrue(np.all(np.diff(ret_dc['emesh'], axis=1) >= 0))
+        # the intervalley coupling is tiny without relaxation
+        self.assertTrue(np.max(ret_dc['coupling'])<1e-6)
+        self.assertTrue(np.allclose(ret['emesh'], ret_dc['emesh'], atol=1e-6))
+        with self.assertRaises(Exception):
+            mtb.tb_solver(n_moire, n_g, n_k, valley=ValleyType.VALLEYK1, decouple=True)